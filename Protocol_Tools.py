@@ -32,6 +32,8 @@ from StepDerivatives import *
 from LabelEntry import LabelEntry
 from no_wait_Dialog import no_wait_Dialog
 import config
+import uibus
+from notifier import StepNotifier, CANCEL
 
 
 # Routine is a base class that manages a list of items to execute. Items can be either loops or single steps.
@@ -262,7 +264,7 @@ class Routine(object):
     #           loop is first, the second outer loop is second, and so on. This is used for recursive error checking.
     def run(self, iter = None):
         for i in self.steps:
-            i.run()
+            i.run(iter = iter)
 
     # Routine.disconnected: Called by event handler if the device is disconnected while a protocol is running.
     #   input:
@@ -471,12 +473,12 @@ class Protocol(Routine): #ArduinoErrorProofedRoutine):
                     self.runbtn.config(bg ='SystemButtonFace', text = "Run Protocol")
                 except:
                     self.runbtn.config(bg='gray', text="Run Protocol")
-            Routine.pRun.event.set() #sends message to protocol running in separate thread to stop
+            Routine.pRun.cancel() #sends message to protocol running in separate thread to stop
             self.running = False
             RoutineThread.protocolRunning = False
 
-            if Loop.activeLoop:
-                Loop.activeLoop.currIter.config(text="")
+            if Loop.activeLoop: # through the bus so that an iteration posted by the protocol thread can't overwrite it
+                uibus.bus.post(Loop.activeLoop.currIter, text="")
             return
 
 
@@ -498,7 +500,8 @@ class Protocol(Routine): #ArduinoErrorProofedRoutine):
                 print("Error Dialog")
                 return
             self.running = True
-            self.runbtn.config(bg = 'red', text = "Cancel Run")
+            # through the bus so that the reset posted at the end of the last run can't overwrite it
+            uibus.bus.post(self.runbtn, bg = 'red', text = "Cancel Run")
             if self.writable:
                 config.stopEditing = True
 
@@ -626,7 +629,7 @@ class Loop(Routine):#(ArduinoErrorProofedRoutine):
     def run(self, iter = None):
         Loop.activeLoop = self #this marker allows steps to clean up iteration counter if the protocol is canceled
         for i in range(1,self.saveIter+1):
-            self.currIter.config(text= "Iteration: " + str(i))
+            uibus.bus.post(self.currIter, text= "Iteration: " + str(i))
             if not iter:
                 iter0 = (i,)
 
@@ -634,7 +637,7 @@ class Loop(Routine):#(ArduinoErrorProofedRoutine):
                 iter0 = (i,) + iter
             if super(Loop, self).run(iter = iter0) == "Error": #run through one iteration of the loop
                 return "Error"
-        self.currIter.config(text="")
+        uibus.bus.post(self.currIter, text="")
         Loop.activeLoop = None
 
 # RoutineThread: class to run protocols in their own thread. This allows the program to run a protocl and manage the GUI at the same time
@@ -660,12 +663,21 @@ class RoutineThread(Thread):
         self.pRun = pRun
         self.setDaemon(True)
         self.event = threading.Event()
+        self.notifier = StepNotifier()
         self.mainthread = mainthread
         Step.event = self.event
+        Step.notifier = self.notifier
         Step.mainthread = self.mainthread
         Loop.mainthread = self.mainthread
         self.button = button
 
+    # RoutineThread.cancel: flags the protocol to stop and wakes it if it is waiting in a step
+    #   Inputs: None
+    #   Outputs: None
+    def cancel(self):
+        self.event.set()
+        self.notifier.notify(CANCEL)
+
     # RoutineThread.run: Start a RoutineThread
     #   Inputs: None
     #   Outputs: None
@@ -680,12 +692,17 @@ class RoutineThread(Thread):
             print("Finally")
             config.stopEditing = False
             RoutineThread.protocolRunning = False
-            try:
-                self.routineObject.runbtn.config(bg='SystemButtonFace', text = self.routineObject.name)
-            except:
-                self.routineObject.runbtn.config(bg='gray', text=self.routineObject.name)
+            uibus.bus.call((self.routineObject.runbtn, 'reset'), self.resetButton)
             self.routineObject.running = False
 
+    # RoutineThread.resetButton: returns the run button to its nonrunning view. Called on the Tk thread through the UI
+    # bus.
+    def resetButton(self):
+        try:
+            self.routineObject.runbtn.config(bg='SystemButtonFace', text = self.routineObject.name)
+        except:
+            self.routineObject.runbtn.config(bg='gray', text=self.routineObject.name)
+
 # ProtocolButtonPanel: User interface for loading saved protocols as custom buttons. Users can load single buttons, save
 #                       Panels of buttons, and load panels of buttons.
 class ProtocolButtonPanel:
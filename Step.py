@@ -16,6 +16,8 @@ import time
 from LabelEntry import LabelEntry
 from Protocol_Tools import *
 import config
+import uibus
+from notifier import CANCEL
 
 # Base class for steps in a protocol. Should extend in each usage case for particular kinds of steps on other kinds devices
 # Derived classes should add entries in the draw method, and place entries in self.entries array data member so they can
@@ -148,24 +150,32 @@ class Step:
             entry.saved = sList[i]
             entry.insert(0,sList[i])
 
-    # Step.pause: Step.pause pauses the protocol thread for however long the step action needs to take
-    # while checking whether the user has cancelled the protocol every 0.01 seconds.
+    # Step.pause: Step.pause pauses the protocol thread for however long the step action needs to take, or until the
+    # user cancels the protocol. The thread sleeps on the run's StepNotifier and is woken by either.
     # Inputs:
     #       runtime - the time to pause
     #       cleanup - a function that cleans up some other objects, for example GUI text or color, when the user cancels
     #           a protocol run
     #       iter - tuple of loop iterations. None if the step is not inside a loop. The iteration of the immediate loop
     #               is stored in i[0], the first outer loop in i[1], and the nth outer loop in i[n].
+    #       start - time.time() at which the step started, eg when the temperature settled. Now if None.
     # Outputs: None
-    def pause(self, runtime, cleanup = None, iter = None):
-        self.box.config(bg = 'green')
-        start = time.time()#clock()
-        while time.time() - start < runtime:#clock() - start < runtime:
-            self.timerWidget.config(text = "Step Runtime (s): " + str(int(time.time()-start)))#time.clock() - start)))
-            self.event.wait(0.01) #event set in RoutineThread initialization
-            self.checkIfCancel(cleanup = cleanup)
-        self.timerWidget.config(text = '')
-        self.timerWidget.grid_forget()
+    # Widgets are changed through the UI bus (see uibus.py) since this runs in the protocol thread, which also shows
+    # the elapsed time.
+    def pause(self, runtime, cleanup = None, iter = None, start = None):
+        uibus.bus.post(self.box, bg = 'green')
+        if start is None:
+            start = time.time()#clock()
+        uibus.bus.startTimer(self.timerWidget, start, "Step Runtime (s): ")
+        self.notifier.wait((CANCEL,), start + runtime) #notifier set in RoutineThread initialization
+        uibus.bus.stopTimer(self.timerWidget)
+        self.checkIfCancel(cleanup = cleanup)
+        uibus.bus.post(self.timerWidget, text = '')
+        uibus.bus.post(self.timerWidget, 'grid_forget')
+        uibus.bus.call((self.box, 'bg'), self.resetColor)
+
+    # Step.resetColor: returns the step icon to its nonrunning color. Called on the Tk thread through the UI bus.
+    def resetColor(self):
         try:
             self.box.config(bg = 'SystemButtonFace')
         except:
@@ -180,11 +190,9 @@ class Step:
     #   Outputs: None
     def checkIfCancel(self, cleanup = None):
         if self.event.isSet():
-            try:
-                self.box.config(bg='SystemButtonFace')
-            except:
-                self.box.config(bg='gray')
-            self.timerWidget.config(text="")
+            uibus.bus.call((self.box, 'bg'), self.resetColor)
+            uibus.bus.stopTimer(self.timerWidget)
+            uibus.bus.post(self.timerWidget, text="")
             config.stopEditing = False
             if cleanup:
                 cleanup()  # clean up step before ending
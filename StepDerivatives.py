@@ -11,6 +11,16 @@
 
 from Step import Step
 from LabelEntry import LabelEntry
+import uibus
+from stability import DFLT_TOLERANCE, DFLT_WINDOW
+from notifier import CANCEL, SETTLED
+
+# Overshoot limit of the ramp boost of new steps in C, 0 for no boost
+DFLT_BOOST = 0
+# A waiting step checks for equilibrium at least this often, which is how often the temperature is read when there
+# is no acquisition engine to report it settled, and prints that it is equilibrating every EQUIL_REPORT_CHECKS checks
+EQUIL_CHECK_INTERVAL = 1.0
+EQUIL_REPORT_CHECKS = 10
 try:
     from Tkinter import * #python 2.7
 except:
@@ -25,23 +35,84 @@ class TempStep(Step):
         self.box.config(text = self.parameter)
         self.temp = LabelEntry(self.box, 0, 2, "Temperature (C): ")
         self.time = LabelEntry(self.box, 0, 0, "Time (s):")
+        # the hold starts once the temperature has stayed within tolerance of the set point for the settle time
+        self.tolerance = LabelEntry(self.box, 1, 0, "Tolerance (C):")
+        self.tolerance.insert(0, str(DFLT_TOLERANCE))
+        self.window = LabelEntry(self.box, 1, 2, "Settle (s):")
+        self.window.insert(0, str(DFLT_WINDOW))
+        # ramp boost with this overshoot limit, 0 for none, see Therm.RampBoost
+        self.boost = LabelEntry(self.box, 1, 4, "Boost overshoot (C):")
+        self.boost.insert(0, str(DFLT_BOOST))
         self.entries.append(self.time)
         self.entries.append(self.temp)
+        self.entries.append(self.tolerance)
+        self.entries.append(self.window)
+        self.entries.append(self.boost)
         self.steptype = "TempStep"
 
+    # protocols saved before the tolerance, settle time and boost were added have fewer entries; those get the defaults
+    def load(self, sList):
+        defaults = [str(DFLT_TOLERANCE), str(DFLT_WINDOW), str(DFLT_BOOST)]
+        if 2 <= len(sList) < len(self.entries):
+            sList = list(sList) + defaults[len(sList) - 2:]
+        for entry in (self.tolerance, self.window, self.boost):
+            entry.Ent.delete(0, END)
+        Step.load(self, sList)
+
+    # The tolerance, settle time and boost are checked before running or saving, as a bad value would otherwise only
+    # fail once the step runs, on the acquisition or worker thread. They are numbers rather than loop expressions. A
+    # settle time of 0 means the hold starts on the first sample within tolerance.
+    def saveEntries(self, type = "float", iters = None):
+        Step.saveEntries(self, type, iters)
+        self.checkEntry(self.tolerance, "tolerance", True)
+        self.checkEntry(self.window, "settle time", False)
+        self.checkEntry(self.boost, "boost overshoot", False)
+
+    # raises a ValueError unless entry holds a number that is not negative, and if positive, not 0
+    def checkEntry(self, entry, name, positive):
+        if entry.expression:
+            raise ValueError("Error: The " + name + " of a " + self.parameter + " step must be a number.")
+        if entry.saved < 0 or (positive and entry.saved == 0):
+            raise ValueError("Error: The " + name + " of a " + self.parameter + " step must be " +
+                             ("positive." if positive else "0 or more."))
+
     def run(self, cleanup = None, iter = None, time = None):
-        self.setPoint(self.temp.saved)
-        self.box.config(bg='green')
-        self.timerWidget.config(text="Waiting to reach set point...")
-        while abs(self.getTemp() - self.temp.saved) > 1:
-            self.event.wait(1)
-            self.checkIfCancel()
-            print("Equilibrating...")
-        Step.pause(self, self.time.saved)
-
-    def setPoint(self, temp):
+        self.setPoint(self.temp.saved, self.boost.saved)
+        self.stepStarted(self.temp.saved, iter)
+        uibus.bus.post(self.box, bg='green')
+        uibus.bus.post(self.timerWidget, text="Waiting to reach set point...")
+        # decided on each temperature sample, and sampled when the temperature is predicted to settle, see
+        # StabilityWatch. The watch wakes the protocol thread through the run's StepNotifier, as does a cancel. The
+        # hold is timed from the sample that settled it.
+        self.notifier.clear(SETTLED)
+        watch = self.watchStability(self.temp.saved, self.tolerance.saved, self.window.saved,
+                                    onStable = lambda: self.notifier.notify(SETTLED))
+        try:
+            checks = 0
+            while not watch.wait(0):
+                if not self.notifier.wait((SETTLED, CANCEL), timeout = EQUIL_CHECK_INTERVAL):
+                    checks += 1
+                    if checks % EQUIL_REPORT_CHECKS == 0:
+                        print("Equilibrating...")
+                self.checkIfCancel(cleanup = watch.close)
+        finally:
+            watch.close()
+        Step.pause(self, self.time.saved, start = watch.stableTime)
+
+    def setPoint(self, temp, boost = None):
         raise NotImplementedError("Error: must redefine setPoint method for TempStep class when initializing the device connection")
 
     def getTemp(self):
         raise NotImplementedError(
-            "Error: must redefine getTemp method for TempStep class when initializing the device connection")
\ No newline at end of file
+            "Error: must redefine getTemp method for TempStep class when initializing the device connection")
+
+    # returns a StabilityWatch for the temperature reaching target, calling onStable when it does, see
+    # Thermocycler.watchStability
+    def watchStability(self, target, tolerance, window, onStable = None):
+        raise NotImplementedError(
+            "Error: must redefine watchStability method for TempStep class when initializing the device connection")
+
+    # called as each step starts with its set point and the loop iterations, eg to mark the step in the run archive.
+    # Redefined when initializing the device connection.
+    def stepStarted(self, setpoint, iter):
+        pass
\ No newline at end of file
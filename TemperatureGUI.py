@@ -11,11 +11,21 @@
 
 from USB_GUI import *
 from Therm import Thermocycler
-from matplotlib import pyplot as plt
-import matplotlib
-from threading import Thread, Lock
-import tkMessageBox
-import csv
+from telemetry import TelemetryBuffer, MISSING
+from runlog import RunLog, runPath
+from runarchive import ArchiveWriter
+from decimation import DecimationPyramid
+from liveplot import LivePlot
+import uibus
+try:
+    import tkMessageBox # python 2.7
+except ImportError:
+    from tkinter import messagebox as tkMessageBox # python 3
+import config
+import os
+
+# The connection is checked this often, in ms
+WATCHDOG_INTERVAL = 2000
 
 
 class tempGUI(usbGUI):
@@ -56,119 +66,178 @@ class tempGUI(usbGUI):
         # Draw Protocol Box
         self.ProtocolBox(3,0, TempStep)
 
-        # If this box is checked, will plot recent temperatures in a separate window
+        # This button shows the logged temperatures in a chart below the controls, see LivePlot
         self.logTempBtn = Button(self.powerrunbox, text = "Display Temperature Plot", command = self.livePlot)
         self.logTempBtn.grid(column = 0, row = 2, sticky = W)
         self.liveplotting = False
+        self.plot = None
         self.firstlog = True
-        self.logLock = Lock()
-        plt.ion() #allow interactive plotting
-        self.templog = []
-        self.setptLog = []
-        self.times = []
+        # time, temperature, set point, power and current of the displayed samples, see TelemetryBuffer
+        self.telemetry = TelemetryBuffer()
+        # min/max decimated copies of the logged temperatures for plotting, see DecimationPyramid
+        self.pyramid = DecimationPyramid(self.telemetry, ('temperature', 'setpoint'))
+        # every sample is also streamed to the log file of the run and to its binary archive, see RunLog and
+        # ArchiveWriter
+        self.runLog = None
+        self.archive = None
         self.setpt = "Undefined"
-        self.logTime = 0
+        self.badThermistor = False
+        # the error of the last sample that could not be shown or logged, None once one is again
+        self.sampleError = None
+        self.watchdogId = None
 
 
         #save logged data
         self.saveButton = Button(self.powerrunbox, text = "Save Temperature Logs", command = self.save)
         self.saveButton.grid(column = 0, row = 3, sticky = W)
 
+    # the hooks, run log and display are only rewired when a new device was opened, not when the user declined to
+    # reconnect
     def connect(self, port):
+        old = self.device
         try:
             usbGUI.connect(self, port)
         except Exception as E:
             tkMessageBox.showerror("Error", E.message)
             return
+        if self.device is old:
+            return
+        if old:
+            old.acq.unsubscribe(self.updateTemp)
         TempStep.setPoint = self.set_setpt
         TempStep.getTemp = self.device.getTemp
+        TempStep.watchStability = self.device.watchStability
+        TempStep.stepStarted = self.markStep
+        self.startRunLog()
         print("Connected")
         self.connected = True
+        self.device.acq.subscribe(self.updateTemp, ('input1',))
+        if self.watchdogId is not None:
+            self.master.after_cancel(self.watchdogId)
+        self.watchdogId = self.master.after(WATCHDOG_INTERVAL, self.watchdog)
 
 
 
-    #called every second to update temperature display
-    def updateTemp(self):
-        if self.connected:
-            self.logTime += 1
-            try:
-                temp = self.device.getTemp()
-            except:
-                tkMessageBox.showerror("IOError", "IOError: could not communicate with the temperature controller. Please try reconnecting.")
-                self.connected = False
-                return
-            if int(temp) < -200: # If not connected to the thermistor\
-                no_wait_Dialog(self.master, "Error", "The connection to the thermistor is bad. Please adjust the connection.")
-                self.currTemp.config(text="?")
-            else:
-                self.logLock.acquire()
-                self.templog.append(temp)
-                self.times.append(time.clock())
-                if self.setpt != "Undefined":
-                    self.setptLog.append(float(self.device.setpt))
-                self.logLock.release()
-                self.currTemp.config(text= temp)
-            time.sleep(1)
+    # called by the acquisition engine thread with each temperature sample: logs it and updates the display through
+    # the UI bus. Nothing runs between samples, and the engine samples faster during ramps, see Thermocycler.adaptRates.
+    # An error, eg writing the run log, is shown once and does not stop the samples that follow.
+    def updateTemp(self, channel, t, temp):
+        try:
+            self.showTemp(t, temp)
+        except Exception as E:
+            if self.sampleError is None:
+                uibus.bus.call('sample error', no_wait_Dialog, self.master, "Error",
+                               "Could not log the temperature: " + str(E))
+            self.sampleError = E
+        else:
+            self.sampleError = None
+
+    def showTemp(self, t, temp):
+        if int(temp) < -200: # If not connected to the thermistor
+            if not self.badThermistor:
+                uibus.bus.call('thermistor', no_wait_Dialog, self.master, "Error",
+                               "The connection to the thermistor is bad. Please adjust the connection.")
+                self.badThermistor = True
+            uibus.bus.post(self.currTemp, text="?")
+            return
+        self.badThermistor = False
+        setpt = MISSING
+        if self.setpt != "Undefined":
+            setpt = float(self.device.setpt)
+        self.telemetry.append(t - self.device.acq.startTime, temp, setpt,
+                              self.device.latestValue('power output'), self.device.latestValue('output current'))
+        uibus.bus.post(self.currTemp, text= temp)
+
+    # runs on the Tk thread every WATCHDOG_INTERVAL ms while connected, and reports the connection lost if the
+    # temperature samples stop. Should the engine have dropped updateTemp for raising, the error is shown and the
+    # display subscribed again.
+    def watchdog(self):
+        self.watchdogId = None
+        if not self.connected:
+            return
+        error = self.device.acq.subscriberError(self.updateTemp)
+        if error is not None:
+            self.device.acq.unsubscribe(self.updateTemp)
+            self.device.acq.subscribe(self.updateTemp, ('input1',))
+            tkMessageBox.showerror("Error", "The temperature display failed: " + str(error))
+        if self.device.acq.stale('input1'):
+            self.device.acq.unsubscribe(self.updateTemp)
+            self.connected = False
+            tkMessageBox.showerror("IOError", "IOError: could not communicate with the temperature controller. Please try reconnecting.")
+            return
+        self.watchdogId = self.master.after(WATCHDOG_INTERVAL, self.watchdog)
 
 
+    # show or hide the temperature chart, which is created (and matplotlib imported) the first time it is shown
     def livePlot(self):
         if not self.connected:
             tkMessageBox.showerror("Error", "Error: Not connected to Temperature Controller")
             return
         try:
             if not self.liveplotting:
+                if self.plot is None:
+                    self.plot = LivePlot(self.mainframe, self.pyramid)
+                self.plot.grid(row = 2, column = 0, columnspan = 2, sticky = W)
+                self.plot.start()
                 self.logTempBtn.config(bg = "green")
                 self.liveplotting = True
-                self.plotThread = Thread(target=self.plotTempRun)
-                self.plotThread.daemon = True
-                self.plotThread.start()
             else:
+                self.plot.stop()
+                self.plot.widget.grid_remove()
                 self.logTempBtn.config(bg = "gray")
                 self.liveplotting = False
-                plt.close()
-        except E:
-            tkMessageBox.showerror("Error",E.message)
+        except Exception as E:
+            tkMessageBox.showerror("Error", str(E))
 
-    def save(self):
-        file = tkFileDialog.asksaveasfile(mode='w', title="Save Procedure", defaultextension='.csv')
+    # start a new log file and archive for the samples from this connection, closing the previous ones
+    def startRunLog(self):
+        self.stopRunLog()
+        path = runPath(config.runLogDir)
         try:
-            writer = csv.writer(file, delimiter = ',')
-            setpt = ["Ndef"]* len(self.templog)
-            setpt[-len(self.setptLog):] = self.setptLog
-            writer.writerow(["Time(s)","Temperature(C)", "SetPoint(C)"])
-            for i in range(len(self.templog)):
-                writer.writerow([self.times[i],self.templog[i], setpt[i]])
-        except E:
-            tkMessageBox.showerror("Error",E.message)
-        finally:
-            file.close()
-
-    def plotTemp(self):
-
-        plt.clf()
-        self.logLock.acquire()
-        timescopy = list(self.times)
-        setptcopy = list(self.setptLog)
-        templogcopy = list(self.templog)
-        self.logLock.release()
-        plt.plot(timescopy, templogcopy, color = 'k')
-        plt.xlabel("Time (s)")
-        plt.ylabel("Temperature (C)")
-        if len(setptcopy) != len(templogcopy) and len(setptcopy) != 0:
+            self.runLog = RunLog(path)
+            self.archive = ArchiveWriter(os.path.splitext(path)[0] + ".archive")
+        except (IOError, OSError) as E:
+            tkMessageBox.showerror("Error", "Could not create the run log: " + str(E))
+            self.stopRunLog()
+            return
+        self.telemetry.subscribe(self.runLog.write)
+        self.telemetry.subscribe(self.archive.append)
+
+    def stopRunLog(self):
+        if self.runLog is not None:
+            self.telemetry.unsubscribe(self.runLog.write)
+            self.runLog.close()
+            self.runLog = None
+        if self.archive is not None:
+            self.telemetry.unsubscribe(self.archive.append)
+            self.archive.close()
+            self.archive = None
+
+    # mark the start of a protocol step in the archive, called by TempStep.run
+    def markStep(self, setpoint, iter):
+        if self.archive is not None:
             try:
-                plt.plot(timescopy[-len(setptcopy):],setptcopy, color = 'r')
-            except E:
-                print(E.message)
-                pass
-        elif(len(setptcopy) == len(templogcopy)):
-            plt.plot(timescopy, setptcopy,  color = 'r')
-        plt.pause(1)
+                setpoint = float(setpoint)
+            except (TypeError, ValueError):
+                setpoint = MISSING
+            self.archive.markStep(setpoint, iter)
 
-    def plotTempRun(self):
-        while self.liveplotting == True:
-            self.plotTemp()
-        plt.close()
+    # the run is already on disk, saving copies its log file
+    def save(self):
+        if self.runLog is None:
+            tkMessageBox.showerror("Error", "Error: Nothing has been logged yet.")
+            return
+        path = tkFileDialog.asksaveasfilename(title="Save Procedure", defaultextension='.csv')
+        if not path:
+            return
+        try:
+            self.runLog.copy(path)
+        except (IOError, OSError) as E:
+            tkMessageBox.showerror("Error", str(E))
 
+    def destroy(self, arg1 = None, arg2 = None):
+        self.stopRunLog()
+        usbGUI.destroy(self, arg1, arg2)
 
     #called when the New setPoint     button is pressed, sends entered value to controller
     def set_setpt_btn(self):
@@ -182,15 +251,17 @@ class tempGUI(usbGUI):
         self.set_setpt(setpoint)
         self.setpt = setpoint
 
-    # set_setpoint can be called by step objects and the set_setpt_btn method
-    def set_setpt(self, setpoint):
+    # set_setpoint can be called by step objects and the set_setpt_btn method. boost is the overshoot limit of a ramp
+    # boost, see Thermocycler.setPoint. Steps call it on the protocol thread, so widgets are changed through the UI bus.
+    def set_setpt(self, setpoint, boost = None):
         if not self.connected:
-            tkMessageBox.showerror("Error","Error: Not connected to temperature controller.")
+            uibus.bus.call('setpt error', tkMessageBox.showerror, "Error",
+                           "Error: Not connected to temperature controller.")
             return
-        self.setptdisp.config(text = setpoint)
+        uibus.bus.post(self.setptdisp, text = setpoint)
 
 
-        self.device.setPoint(int(setpoint))#Turn On/Turn Off button pressed
+        self.device.setPoint(int(setpoint), boost)#Turn On/Turn Off button pressed
 
     def toggleOutput(self):
         self.output = not self.output
@@ -209,25 +280,9 @@ class tempGUI(usbGUI):
 
 
 
-class updater(Thread):
-    def __init__(self, time, call):
-        self.time = time
-        self.call = call
-        Thread.__init__(self)
-        self.setDaemon(True)
-
-    def run(self):
-        while True:
-            self.call()
-
-
-
-root = Tk()
-
-app = tempGUI(root)
+if __name__ == '__main__':
+    root = Tk()
 
-#updtr is a thread that updates the current temperature display every second by calling the updateTemp method
-updtr = updater(1, app.updateTemp)
-updtr.start()
+    app = tempGUI(root)
 
-root.mainloop()
\ No newline at end of file
+    root.mainloop()
@@ -5,152 +5,904 @@
 
 import tc3625
 import time
-from threading import Lock
+from telemetry import TelemetryBuffer, MISSING
+from stability import StabilityDetector, SettlePredictor
+import itertools
+from threading import Thread, Lock, Condition, Event, Timer, current_thread
+from collections import OrderedDict, deque
+from tc3625_stats import LatencyHistogram
+try:
+    from queue import PriorityQueue
+except ImportError:
+    from Queue import PriorityQueue
+
+# Reads of the same value that are less than this many seconds apart share one serial transaction
+DFLT_READ_TTL = 0.5
+
+# Channels sampled by the AcquisitionEngine, with their default rates in samples per second (0 to disable)
+DFLT_RATES = OrderedDict([
+    ('input1', 1.0),
+    ('input2', 0.2),
+    ('power output', 1.0),
+    ('output current', 1.0),
+    ('alarm status', 0.2),
+])
+# Number of samples kept per channel
+DFLT_BUFFER_LEN = 3600
+
+# Adaptive sampling (see Thermocycler.adaptRates): the rates of the temperature, power and current channels in each
+# mode, in samples per second. 'settle' uses the DFLT_RATES.
+RATE_MODES = {
+    # temperature more than RAMP_BAND from the set point, or within TRANSITION_WINDOW of a set point change
+    'ramp': {'input1': 4.0, 'power output': 4.0, 'output current': 4.0},
+    # within RAMP_BAND of the set point for HOLD_AFTER seconds
+    'hold': {'input1': 0.5, 'power output': 0.5, 'output current': 0.5},
+    # output off
+    'idle': {'input1': 0.2, 'power output': 0.2, 'output current': 0.2},
+}
+RAMP_BAND = 1.0
+TRANSITION_WINDOW = 15.0
+HOLD_AFTER = 30.0
+
+# The controller is equilibrated (see checkEquil) when the temperature has stayed within EQUIL_TOLERANCE C of the set
+# point and within EQUIL_SPREAD C of itself for EQUIL_WINDOW seconds
+EQUIL_TOLERANCE = 0.3
+EQUIL_SPREAD = 0.2
+EQUIL_WINDOW = 20.0
+# A sample requested at a predicted band entry is taken at least this many seconds after the previous one
+PREDICT_MIN_INTERVAL = 0.1
+# Number of (target, predicted, entered) settle records kept, see Thermocycler.settled
+SETTLE_LOG_LEN = 1000
+
+# Alarm window of the controller profile, in C
+LOW_ALARM = 0
+HIGH_ALARM = 105
+# Ramp boost (see RampBoost): the set point is commanded up to BOOST_OFFSET C beyond the target, and kept BOOST_MARGIN C
+# inside the alarm window. Only ramps of at least BOOST_MIN_RAMP C are boosted.
+BOOST_OFFSET = 10
+BOOST_MARGIN = 3
+BOOST_MIN_RAMP = 3.0
+# initial lead time of the crossover in seconds, and its bounds as it adapts to the measured overshoot
+BOOST_LEAD = 1.0
+BOOST_LEAD_MIN = 0.2
+BOOST_LEAD_MAX = 10.0
+# the crossover happens at the latest this many seconds after the boost starts, whether or not samples arrive
+BOOST_TIMEOUT = 300.0
+# the overshoot is measured for this many seconds after the crossover
+BOOST_WATCH = 20.0
+
+# Priorities of the commands served by the CommandWorker, lowest first
+PRIORITY_POWER = 0
+PRIORITY_SETPOINT = 1
+PRIORITY_TELEMETRY = 2
+PRIORITY_NAMES = {PRIORITY_POWER: 'power', PRIORITY_SETPOINT: 'setpoint', PRIORITY_TELEMETRY: 'telemetry'}
+
+
+# The GUI display, the running step and the log all ask for the temperature independently, often within
+# milliseconds of each other. A ReadCoalescer sits in front of one controller read: a caller gets the last value
+# if it is younger than ttl seconds, and callers arriving while a read is in flight wait for that read instead
+# of sending their own.
+class ReadCoalescer:
+    def __init__(self, read, ttl=DFLT_READ_TTL):
+        self.read = read
+        self.ttl = ttl
+        self.cond = Condition(Lock())
+        self.inflight = False
+        self.value = None
+        self.error = None
+        self.stamp = None
+        # number of serial reads made and number of calls answered without one
+        self.numReads = 0
+        self.numShared = 0
+
+    def get(self):
+        with self.cond:
+            if self.stamp is not None and time.time() - self.stamp <= self.ttl:
+                self.numShared += 1
+                return self.value
+            if self.inflight:
+                # share the read already on the line
+                while self.inflight:
+                    self.cond.wait()
+                self.numShared += 1
+                if self.error is not None:
+                    raise self.error
+                return self.value
+            self.inflight = True
+        value, error = None, None
+        try:
+            value = self.read()
+        except Exception as E:
+            error = E
+        with self.cond:
+            self.inflight = False
+            self.value, self.error = value, error
+            self.stamp = time.time() if error is None else None
+            self.numReads += 1
+            self.cond.notify_all()
+        if error is not None:
+            raise error
+        return value
+
+
+# Result of a command submitted to the CommandWorker. result() blocks until the command has run and returns its
+# value or raises its exception.
+class Future:
+    def __init__(self):
+        self.event = Event()
+        self.value = None
+        self.error = None
+        # seconds the command spent in the queue before the worker started it
+        self.queueWait = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def setResult(self, value):
+        self.value = value
+        self.event.set()
+
+    def setError(self, error):
+        self.error = error
+        self.event.set()
+
+    def result(self, timeout=None):
+        if not self.event.wait(timeout):
+            raise IOError("Controller command did not complete within " + str(timeout) + " s")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+# The CommandWorker is the only thread that talks to the controller. Commands are queued with a priority and
+# served lowest priority number first (first come first served within a priority), so a power off is never stuck
+# behind a backlog of temperature polls, and an exception in one command can't leave the link locked. The time each
+# command waits in the queue is recorded per priority.
+class CommandWorker(Thread):
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self.queue = PriorityQueue()
+        self.counter = itertools.count()
+        self.stopped = False
+        self.queueWait = dict([(p, LatencyHistogram()) for p in PRIORITY_NAMES])
+
+    # queue func(*args) and return its Future
+    def submit(self, priority, func, *args):
+        future = Future()
+        if self.stopped:
+            future.setError(IOError("The controller connection is closed."))
+            return future
+        self.queue.put((priority, next(self.counter), time.time(), future, func, args))
+        return future
+
+    # run func(*args) on the worker and wait for its result. Commands issued from the worker itself (eg by a
+    # command calling back into the Thermocycler) run directly.
+    def call(self, priority, func, *args):
+        if current_thread() is self:
+            return func(*args)
+        return self.submit(priority, func, *args).result()
+
+    # stop once the commands already queued have run
+    def stop(self):
+        if not self.stopped:
+            self.stopped = True
+            self.queue.put((max(PRIORITY_NAMES) + 1, next(self.counter), time.time(), None, None, None))
+
+    def run(self):
+        while True:
+            priority, count, queued, future, func, args = self.queue.get()
+            if future is None:
+                break
+            future.queueWait = time.time() - queued
+            self.queueWait[priority].add(future.queueWait)
+            try:
+                future.setResult(func(*args))
+            except Exception as E:
+                future.setError(E)
+
+    # queue wait statistics per priority, in seconds
+    def waitStats(self):
+        stats = {}
+        for priority, hist in self.queueWait.items():
+            stats[PRIORITY_NAMES[priority]] = {
+                'count': hist.num,
+                'p50': hist.percentile(50),
+                'p95': hist.percentile(95),
+                'max': hist.max,
+            }
+        return stats
+
+
+# The AcquisitionEngine is the only thing that polls the controller for telemetry. It samples each channel at its
+# own rate (channels that fall due together are read in one pipelined transaction) into buffers of
+# (time, value) samples and calls every subscriber with (channel, time, value) for each new sample. The GUI display,
+# plots, equilibrium detection and loggers read from it, so the serial load does not depend on how many of them
+# there are.
+#   read - function taking a list of channel names and returning their values
+#   rates - dictionary of channel name: samples per second
+class AcquisitionEngine(Thread):
+    def __init__(self, read, rates=DFLT_RATES, bufferLen=DFLT_BUFFER_LEN):
+        Thread.__init__(self)
+        self.daemon = True
+        self.read = read
+        self.periods = OrderedDict([(ch, 1.0/rate) for ch, rate in rates.items() if rate > 0])
+        self.buffers = dict([(ch, deque(maxlen=bufferLen)) for ch in self.periods])
+        self.subscribers = []
+        # callback: exception, of the subscribers dropped because they raised, see publish
+        self.failed = {}
+        self.cond = Condition(Lock())
+        self.stopEvent = Event()
+        # set to wake the engine when its rates change, a sample is requested or it is stopped
+        self.wakeEvent = Event()
+        self.rescheduled = False
+        # channel: time of a requested extra sample
+        self.requested = {}
+        self.startTime = time.time()
+        self.lastError = None
+        self.numErrors = 0
+        self.numSweeps = 0
+
+    # callback(channel, time, value) is called from the engine thread for every new sample of the given channels
+    # (all channels if None). It must return quickly.
+    def subscribe(self, callback, channels=None):
+        with self.cond:
+            self.subscribers.append((callback, channels))
+
+    def unsubscribe(self, callback):
+        with self.cond:
+            self.subscribers = [(cb, chs) for cb, chs in self.subscribers if cb != callback]
+            self.failed.pop(callback, None)
+
+    # the exception raised by callback if it was dropped for raising one, else None
+    def subscriberError(self, callback):
+        with self.cond:
+            return self.failed.get(callback)
+
+    # most recent (time, value) sample of channel, or None
+    def latest(self, channel):
+        with self.cond:
+            buf = self.buffers[channel]
+            if len(buf) == 0:
+                return None
+            return buf[-1]
+
+    # copy of the buffered (time, value) samples of channel, oldest first
+    def history(self, channel):
+        with self.cond:
+            return list(self.buffers[channel])
+
+    # block until there is a sample of channel taken after time 'after' (any sample if None) and return it.
+    # Raises IOError if none arrives within timeout seconds (default: three sample periods plus two seconds).
+    def wait(self, channel, after=None, timeout=None):
+        if timeout is None:
+            timeout = 3*self.periods[channel] + 2.0
+        deadline = time.time() + timeout
+        with self.cond:
+            buf = self.buffers[channel]
+            while len(buf) == 0 or (after is not None and buf[-1][0] <= after):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_alive():
+                    raise IOError("No %s sample from the controller (last error: %s)" % (channel, self.lastError))
+                self.cond.wait(remaining)
+            return buf[-1]
+
+    # latest value of channel, waiting for the first sample. Raises IOError if the latest sample is stale.
+    def get(self, channel):
+        sample = self.latest(channel)
+        if sample is None or time.time() - sample[0] > 3*self.periods[channel] + 2.0:
+            sample = self.wait(channel, None if sample is None else sample[0])
+        return sample[1]
+
+    # True if the engine has stopped or channel has not been sampled for three sample periods plus two seconds
+    def stale(self, channel):
+        sample = self.latest(channel)
+        last = self.startTime if sample is None else sample[0]
+        return not self.is_alive() or time.time() - last > 3*self.periods[channel] + 2.0
+
+    # change the sample rates of some of the channels, eg setRates({'input1': 4.0}). A faster rate takes effect at
+    # once, a slower one after the next sample.
+    def setRates(self, rates):
+        with self.cond:
+            for ch, rate in rates.items():
+                if ch in self.periods:
+                    if rate <= 0:
+                        raise ValueError("the rate of %s must be positive" % (ch,))
+                    self.periods[ch] = 1.0/rate
+            self.rescheduled = True
+        self.wakeEvent.set()
+
+    # sample channel at time t (time.time()) if it is not due before then
+    def sampleAt(self, channel, t):
+        with self.cond:
+            self.requested[channel] = min(t, self.requested.get(channel, t))
+            self.rescheduled = True
+        self.wakeEvent.set()
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wakeEvent.set()
+
+    def run(self):
+        due = dict([(ch, time.time()) for ch in self.periods])
+        last = dict([(ch, time.time()) for ch in self.periods])
+        while not self.stopEvent.is_set():
+            if self.rescheduled:
+                with self.cond:
+                    self.rescheduled = False
+                    for ch in due:
+                        due[ch] = min(due[ch], last[ch] + self.periods[ch])
+                    for ch, t in self.requested.items():
+                        if ch in due:
+                            due[ch] = min(due[ch], t)
+                    self.requested.clear()
+            now = time.time()
+            channels = [ch for ch in self.periods if due[ch] <= now]
+            if len(channels) > 0:
+                try:
+                    values = self.read(channels)
+                except Exception as E:
+                    values = None
+                    self.lastError = E
+                    self.numErrors += 1
+                t = time.time()
+                for ch in channels:
+                    last[ch] = t
+                    # keep to the schedule, but don't try to catch up after a stall
+                    due[ch] += self.periods[ch]
+                    if due[ch] <= t:
+                        due[ch] = t + self.periods[ch]
+                if values is not None:
+                    self.publish(channels, t, values)
+            # sleeps until the next channel is due, setRates and stop cut this short
+            self.wakeEvent.wait(max(min(due.values()) - time.time(), 0))
+            self.wakeEvent.clear()
+        with self.cond:
+            self.cond.notify_all()
+
+    def publish(self, channels, t, values):
+        with self.cond:
+            for ch, value in zip(channels, values):
+                self.buffers[ch].append((t, value))
+            self.numSweeps += 1
+            subscribers = list(self.subscribers)
+            self.cond.notify_all()
+        for callback, chs in subscribers:
+            for ch, value in zip(channels, values):
+                if chs is None or ch in chs:
+                    try:
+                        callback(ch, t, value)
+                    except Exception as E:
+                        # a subscriber that raises is dropped rather than failing on every sample, and its error is
+                        # kept for it to find, see subscriberError
+                        with self.cond:
+                            self.subscribers = [(cb, c) for cb, c in self.subscribers if cb != callback]
+                            self.failed[callback] = E
+                        break
+
+
+# Feeds the samples of a channel of the acquisition engine to a StabilityDetector, starting with the ones it has
+# buffered, so a window that has already been watched counts at once. As soon as a sample makes the detector stable,
+# wait() returns and onStable is called (from the engine thread). Without an engine, wait() reads the temperature with
+# poll instead.
+#
+# With a SettlePredictor, the engine is asked for a sample at the predicted time of entering the band, so the entry
+# is seen within one serial transaction instead of on the next scheduled sample. The predicted and actual times are
+# kept in predicted and entered.
+class StabilityWatch:
+    def __init__(self, detector, acq=None, channel='input1', poll=None, predictor=None, onClose=None, onStable=None):
+        self.detector = detector
+        self.onClose = onClose
+        self.onStable = onStable
+        self.acq = acq
+        self.channel = channel
+        self.poll = poll
+        self.predictor = predictor
+        self.cond = Condition(Lock())
+        self.isStable = False
+        # latest prediction of the band entry, and the time of the first sample in band
+        self.predicted = None
+        self.entered = None
+        # time at which the detector became stable, where a hold timer starts, no earlier than the watch
+        self.stableTime = None
+        self.created = time.time()
+        if acq is not None:
+            with self.cond:
+                # samples published meanwhile wait for the lock, and the detector ignores those it already has
+                acq.subscribe(self.add, (channel,))
+                # stability and the band entry are judged on the latest sample, not on the buffered ones
+                history = acq.history(channel)
+                for t, value in history[:-1]:
+                    detector.add(t, value)
+                    if predictor is not None:
+                        predictor.add(t, value)
+                if history:
+                    self.update(*history[-1])
+
+    def add(self, channel, t, value):
+        with self.cond:
+            wasStable = self.isStable
+            self.update(t, value)
+            self.cond.notify_all()
+        if self.isStable and not wasStable and self.onStable is not None:
+            self.onStable()
+
+    def update(self, t, value):
+        if self.isStable:
+            return
+        self.isStable = self.detector.add(t, value)
+        if self.isStable:
+            self.stableTime = max(t, self.created)
+        if self.entered is None and abs(value - self.detector.target) <= self.detector.tolerance:
+            self.entered = max(t, self.created)
+        if self.predictor is not None and self.entered is None:
+            self.predictor.add(t, value)
+            # the prediction from the last sample before the entry is the one recorded
+            self.predicted = self.predictor.predict()
+            if self.predicted is not None and self.acq is not None:
+                self.acq.sampleAt(self.channel, max(self.predicted, t + PREDICT_MIN_INTERVAL))
+
+    # block until stable or for timeout seconds (None for no limit), returns whether stable. Raises IOError if the
+    # engine dropped the watch because it raised.
+    def wait(self, timeout=None):
+        if self.acq is None:
+            self.add(None, time.time(), self.poll())
+            if not self.isStable:
+                time.sleep(1 if timeout is None else min(timeout, 1))
+            return self.isStable
+        deadline = None if timeout is None else time.time() + timeout
+        with self.cond:
+            while not self.isStable:
+                error = self.acq.subscriberError(self.add)
+                if error is not None:
+                    raise IOError("The stability watch failed: " + str(error))
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return self.isStable
+
+    def close(self):
+        if self.acq is not None:
+            self.acq.unsubscribe(self.add)
+        if self.onClose is not None:
+            onClose, self.onClose = self.onClose, None
+            onClose(self)
+
+
+# Ramp boost: the controller is given a set point beyond the target, which keeps its output saturated for longer than
+# the PID would on its own, and the target is written at the crossover, when the temperature extrapolated 'lead' seconds
+# ahead at its current slope reaches it. Driven by the samples of the acquisition engine, so the crossover happens even
+# if the protocol thread is cancelled. A timer forces the crossover after BOOST_TIMEOUT seconds, so the boosted set
+# point is not left on the controller if the samples stop. The overshoot past the target is then watched for
+# BOOST_WATCH seconds and the lead of the next boost in the same direction adapted: longer if the overshoot exceeded the
+# limit, slowly shorter if it stayed well within it. Finished boosts are recorded in the Thermocycler's boostLog.
+#   tc - the Thermocycler
+#   target - set point of the step
+#   limit - largest acceptable overshoot in C
+#   temp - current temperature
+class RampBoost:
+    def __init__(self, tc, target, limit, temp):
+        self.tc = tc
+        self.target = target
+        self.limit = limit
+        self.direction = 1 if target > temp else -1
+        self.setpt = int(min(max(target + self.direction*BOOST_OFFSET, LOW_ALARM + BOOST_MARGIN),
+                             HIGH_ALARM - BOOST_MARGIN))
+        self.lead = tc.boostLead[self.direction]
+        self.lock = Lock()
+        self.samples = deque(maxlen=3)
+        self.state = 'boost'
+        self.startTime = time.time()
+        self.crossTime = None
+        # the write of the target at the crossover, a Future
+        self.crossWrite = None
+        self.overshoot = 0.0
+        self.timer = None
+        self.restoreError = None
+
+    def start(self):
+        self.tc.io.call(PRIORITY_SETPOINT, self.tc.ctlr.set_if_changed, 'setpt', self.setpt)
+        self.tc.acq.subscribe(self.add, ('input1',))
+        self.arm(BOOST_TIMEOUT)
+
+    # call expire after delay seconds
+    def arm(self, delay):
+        self.timer = Timer(delay, self.expire)
+        self.timer.daemon = True
+        self.timer.start()
+
+    # called by the timer: crosses over if no sample has, and ends the watch if the samples stopped
+    def expire(self):
+        with self.lock:
+            if self.state == 'boost':
+                self.crossover(time.time())
+            elif self.state == 'watch':
+                self.finish()
+
+    # called by the acquisition engine with each temperature sample
+    def add(self, channel, t, temp):
+        with self.lock:
+            if self.state == 'boost':
+                self.samples.append((t, temp))
+                ahead = temp
+                if len(self.samples) > 1:
+                    (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+                    slope = (v1 - v0)/(t1 - t0)
+                    if slope*self.direction > 0:
+                        ahead = temp + slope*self.lead
+                if (ahead - self.target)*self.direction >= 0 or t - self.startTime > BOOST_TIMEOUT:
+                    self.crossover(t)
+            elif self.state == 'watch':
+                self.overshoot = max(self.overshoot, (temp - self.target)*self.direction)
+                if t - self.crossTime > BOOST_WATCH:
+                    self.finish()
+
+    def crossover(self, t):
+        self.state = 'watch'
+        self.crossTime = t
+        # not waited for, the engine thread must not block on the controller
+        self.crossWrite = self.tc.io.submit(PRIORITY_SETPOINT, self.tc.ctlr.set_if_changed, 'setpt', self.target)
+        self.timer.cancel()
+        self.arm(BOOST_WATCH)
+
+    # True unless the target was written at the crossover
+    def targetPending(self):
+        return self.crossWrite is None or not self.crossWrite.done() or self.crossWrite.error is not None
+
+    def finish(self):
+        self.state = 'done'
+        self.timer.cancel()
+        self.tc.acq.unsubscribe(self.add)
+        if self.crossWrite.error is not None:
+            self.crossWrite = self.tc.io.submit(PRIORITY_SETPOINT, self.tc.ctlr.set_if_changed, 'setpt', self.target)
+        if self.overshoot > self.limit:
+            lead = min(self.lead*1.5, BOOST_LEAD_MAX)
+        elif self.overshoot < self.limit/2.0:
+            lead = max(self.lead*0.9, BOOST_LEAD_MIN)
+        else:
+            lead = self.lead
+        self.tc.boostLead[self.direction] = lead
+        self.tc.boostLog.append((self.target, self.setpt, self.lead, self.crossTime - self.startTime, self.overshoot))
+
+    # stop the boost, eg when a new set point is written or the controller is shut down. Unless the target was
+    # written at the crossover it is written now, so the boosted set point is never left behind; a boost past its
+    # crossover still adapts the lead from the overshoot seen so far. A failed write is reported and kept in
+    # restoreError rather than raised, so that a shutdown carries on.
+    def cancel(self):
+        with self.lock:
+            self.timer.cancel()
+            if self.state == 'watch':
+                self.finish()
+            self.state = 'done'
+            restore = self.targetPending()
+        self.tc.acq.unsubscribe(self.add)
+        if restore:
+            try:
+                self.tc.io.call(PRIORITY_SETPOINT, self.tc.ctlr.set_if_changed, 'setpt', self.target)
+            except (IOError, OSError) as E:
+                self.restoreError = E
+                print("Could not restore the set point after a ramp boost: " + str(E))
 
-class Thermocycler:
-    def __init__(self, _port):
 
-        # initialize arrays to log time and temperature throughout script protocol
-        self.timeLog = []
-        self.tempLog = []
-        self.setpointLog = []
-        self.outCurrLog = []
+class Thermocycler:
+    deviceType = "TC-36-25"
+
+    # _port - serial port of the controller
+    # transport - used instead of the serial port if given, eg to record or replay traffic (see tc3625_journal)
+    # readTTL - freshness window of the coalesced reads used while the acquisition engine is not running
+    # acquire - start the acquisition engine, sampling the channels in rates
+    # adaptive - change the sample rates with what the controller is doing, see adaptRates
+    def __init__(self, _port, transport=None, readTTL=DFLT_READ_TTL, acquire=True, rates=DFLT_RATES,
+                 adaptive=True):
+
+        # ring buffer of time, temperature, set point, power and current logged throughout script protocol
+        self.telemetry = TelemetryBuffer()
         self.setpt = 'undefined'
         self.currentTemp = None
-        self.tc3625Lock = Lock()
+
+        # all controller commands go through the worker, see CommandWorker
+        self.io = CommandWorker()
+        self.io.start()
+
+        # hot reads are shared between callers, see ReadCoalescer
+        self.tempReader = ReadCoalescer(self.readTemp, readTTL)
+        self.outCurrReader = ReadCoalescer(self.readOutCurr, readTTL)
+        self.powerReader = ReadCoalescer(self.readPower, readTTL)
+
+        # background sampling of the telemetry channels, started once the controller is configured
+        self.acq = AcquisitionEngine(self.readChannels, rates)
+        self.rates = rates
+        self.adaptive = adaptive and acquire
+        self.rateMode = 'settle'
+        self.rateLock = Lock()
+        # time of the last set point change and since when the temperature has been within RAMP_BAND of it
+        self.setptTime = None
+        self.inBandSince = None
+        # (target, predicted, entered) times of the band entries watched by TempSteps, see settled
+        self.settleLog = deque(maxlen=SETTLE_LOG_LEN)
+        # the running RampBoost, the lead of the next boost up (1) and down (-1), and (target, boosted set point, lead,
+        # seconds to the crossover, overshoot) of each finished boost
+        self.boost = None
+        self.boostLead = {1: BOOST_LEAD, -1: BOOST_LEAD}
+        self.boostLog = deque(maxlen=SETTLE_LOG_LEN)
 
         #open tc3625 object, coded at caltech to talk to the device.
+        #transport can be given to record or replay the serial traffic (see tc3625_journal).
         try:
-            self.ctlr = tc3625.TC3625(port=_port, max_attempt=1)
-            self.ctlr.open()
+            self.ctlr = tc3625.TC3625(port=_port, max_attempt=1, transport=transport)
         except(IOError):
+            self.io.stop()
             raise IOError("Could not connect to "+_port+".")
 
-        #set control Temp Type to computer controlled set point
-        self.ctlr.set_setpt_type('computer')
-
-        #Set temp high range to 105 C
-        self.ctlr.set_high_external_set_range(105)
-
-        #Set temp low range to 0 C
-        self.ctlr.set_low_external_set_range(0)
-
-        #Set control type to PID control
-        self.ctlr.set_control_type('PID')
-
-        # Set Control mode to WP2 + and WP1 -
-        self.ctlr.set_output_polarity('heat wp1+ wp2-')
-
-        # Set alarm type to fixed value alarms
-        self.ctlr.set_alarm_type('fixed')
-
-        # Set POWER SHUTDOWN IF ALARM to MAINOUT SHUTDOWN IF ALARM
-        self.ctlr.set_shutdown_if_alarm('off')
-
-        # Set high alarm setting to 100 C. If the temperate of the plate surpasses this, the system will shut off.
-        self.ctlr.set_high_alarm(105)
-
-        # Set low alarm setting to 0 C. If the temperature of the plate gets bellow this, the system will shut off.
-        self.ctlr.set_low_alarm(0)
-
-        # Set Alarm Deadband to 10 C
-        self.ctlr.set_alarm_deadband(5)
-
-        # Set alarm latch to alarm latch on
-        self.ctlr.set_alarm_latch('on')
-
-        # Set sensor type to TS-67, TS132 15K
-        #self.ctlr.set_sensor_type('TS67 TS136 15K') #Default thermistor with orange wires
-        self.ctlr.set_sensor_type('TS103 50K') #This is the MP-3022 for use with Nick's water cooled thermocycler
-
-        # Set Sensor for alarm to CONTROL SENSOR
-        self.ctlr.set_alarm_sensor('input1')
-
-        # Set temperature scale to Celsius
-        self.ctlr.set_working_units('C')
-
-        # Set overcurrent level to 15 A
-        self.ctlr.set_over_current_compare(30)
-
-        # Set overcurrent level restart attempts to continuous
-        self.ctlr.set_over_current_restart_type('continuous')
-
-
-        # PID settings, P = 1
-        self.ctlr.set_proportional_bandwidth(3)
-        self.ctlr.set_integral_gain(1)
-        self.ctlr.set_derivative_gain(0)
-
-
-        #PID control settings
-        self.ctlr.set_heat_multiplier(1)
-        self.ctlr.set_cool_multiplier(1)
+        try:
+            self.configure(acquire)
+        except Exception:
+            self.abandon()
+            raise
+
+    # writes the default controller configuration, reads the power state and starts sampling. Called once connected.
+    def configure(self, acquire):
+        # The default controller configuration. The current settings are read back in one pipelined sweep and only
+        # the ones that differ are written, in this order, so reconnecting to a configured controller writes nothing.
+        self.io.call(PRIORITY_SETPOINT, self.ctlr.apply_profile, OrderedDict([
+            # set control Temp Type to computer controlled set point
+            ('setpt type', 'computer'),
+            # Set temp high range to 105 C
+            ('high external set range', 105),
+            # Set temp low range to 0 C
+            ('low external set range', 0),
+            # Set control type to PID control
+            ('control type', 'PID'),
+            # Set Control mode to WP2 + and WP1 -
+            ('output polarity', 'heat wp1+ wp2-'),
+            # Set alarm type to fixed value alarms
+            ('alarm type', 'fixed'),
+            # Set POWER SHUTDOWN IF ALARM to MAINOUT SHUTDOWN IF ALARM
+            ('shutdown if alarm', 'off'),
+            # Set high alarm setting to 100 C. If the temperate of the plate surpasses this, the system will shut off.
+            ('high alarm', HIGH_ALARM),
+            # Set low alarm setting to 0 C. If the temperature of the plate gets bellow this, the system will shut off.
+            ('low alarm', LOW_ALARM),
+            # Set Alarm Deadband to 10 C
+            ('alarm deadband', 5),
+            # Set alarm latch to alarm latch on
+            ('alarm latch', 'on'),
+            # Set sensor type to TS-67, TS132 15K
+            #('sensor type', 'TS67 TS136 15K'), #Default thermistor with orange wires
+            ('sensor type', 'TS103 50K'), #This is the MP-3022 for use with Nick's water cooled thermocycler
+            # Set Sensor for alarm to CONTROL SENSOR
+            ('alarm sensor', 'input1'),
+            # Set temperature scale to Celsius
+            ('working units', 'C'),
+            # Set overcurrent level to 15 A
+            ('over current compare', 30),
+            # Set overcurrent level restart attempts to continuous
+            ('over current restart type', 'continuous'),
+            # PID settings, P = 1
+            ('proportional bandwidth', 3),
+            ('integral gain', 1),
+            ('derivative gain', 0),
+            #PID control settings
+            ('heat multiplier', 1),
+            ('cool multiplier', 1),
+        ]))
+
+        self.powerOn = self.io.call(PRIORITY_SETPOINT, self.ctlr.get_power_state) == 'on'
+
+        self.connected = True
+
+        if acquire:
+            if self.adaptive:
+                self.acq.subscribe(self.onTempSample, ('input1',))
+                self.adaptRates()
+            self.acq.start()
+
+    # stops the threads and closes the port of a connection that could not be configured, so that a reconnect does
+    # not find the port busy. Errors are ignored, the caller raises the one that made it give up.
+    def abandon(self):
+        self.acq.stop()
+        try:
+            self.io.call(PRIORITY_POWER, self.ctlr.close)
+        except Exception:
+            pass
+        finally:
+            self.io.stop()
+            self.connected = False
 
     def setPowerOn(self):
-        self.tc3625Lock.acquire()
-        self.ctlr.set_power_state('on')
-        self.tc3625Lock.release()
+        self.io.call(PRIORITY_POWER, self.ctlr.set_power_state, 'on')
+        self.powerOn = True
+        self.adaptRates()
         
     def setPowerOff(self):
-        self.tc3625Lock.acquire()
-        self.ctlr.set_power_state('off')
-        self.tc3625Lock.release()
+        self.io.call(PRIORITY_POWER, self.ctlr.set_power_state, 'off')
+        self.powerOn = False
+        self.adaptRates()
 
+    # telemetry comes from the acquisition engine when it is running and from coalesced reads otherwise
     def getTemp(self):
-        self.tc3625Lock.acquire()
-        self.currentTemp = self.ctlr.get_input1()
-        self.tc3625Lock.release()
+        if self.sampling('input1'):
+            self.currentTemp = self.acq.get('input1')
+        else:
+            self.currentTemp = self.tempReader.get()
         return self.currentTemp
 
-
     def getOutCurr(self):
-        self.tc3625Lock.acquire()
-        curr =  self.ctlr.get_output_current()
-        self.tc3625Lock.release()
-        return curr
-
-    def setPoint(self, temp):
+        if self.sampling('output current'):
+            return self.acq.get('output current')
+        return self.outCurrReader.get()
+
+    def getPower(self):
+        if self.sampling('power output'):
+            return self.acq.get('power output')
+        return self.powerReader.get()
+
+    def sampling(self, channel):
+        return self.acq.is_alive() and channel in self.acq.periods
+
+    # latest value of channel from the acquisition engine, MISSING if it has not been sampled
+    def latestValue(self, channel):
+        if channel not in self.acq.buffers:
+            return MISSING
+        sample = self.acq.latest(channel)
+        if sample is None:
+            return MISSING
+        return sample[1]
+
+    # wait for a temperature sample taken after time 'after' and return its time
+    def waitTemp(self, after=None):
+        if self.sampling('input1'):
+            return self.acq.wait('input1', after)[0]
+        time.sleep(1)
+        return time.time()
+
+    # read the list of channels in one transaction, used by the acquisition engine
+    def readChannels(self, channels):
+        return self.io.call(PRIORITY_TELEMETRY, self.ctlr.get_by_list, channels)
+
+    # uncached reads, used by the ReadCoalescers
+    def readTemp(self):
+        return self.io.call(PRIORITY_TELEMETRY, self.ctlr.get_input1)
+
+    def readOutCurr(self):
+        return self.io.call(PRIORITY_TELEMETRY, self.ctlr.get_output_current)
+
+    def readPower(self):
+        return self.io.call(PRIORITY_TELEMETRY, self.ctlr.get_power_output)
+
+    # boost - overshoot limit in C of a ramp boost to temp (see RampBoost), None or 0 for no boost
+    def setPoint(self, temp, boost=None):
         if type(temp) != int:
             raise TypeError('set point must be an integer')
         if temp < 0 or temp > 100:
             raise ValueError('This thermocycler operates between 0 C and 100C. Please enter a set point in that range.')
         print("Set point to " + str(temp))
-        self.tc3625Lock.acquire()
-        self.ctlr.set_setpt(temp)
-        self.tc3625Lock.release()
+        self.cancelBoost()
+        current = self.getTemp() if boost else None
+        if boost and self.sampling('input1') and abs(temp - current) >= BOOST_MIN_RAMP:
+            self.boost = RampBoost(self, temp, boost, current)
+            self.boost.start()
+        else:
+            # skipped if the controller already has this set point
+            self.io.call(PRIORITY_SETPOINT, self.ctlr.set_if_changed, 'setpt', temp)
+        if temp != self.setpt:
+            self.setptTime = time.time()
+            self.inBandSince = None
         self.setpt = temp
+        self.adaptRates()
         self.log()
 
-    #We will say the PID controller is equilibrated if the last 20 temp logs have been within 0.1 C of each other.
+    # called by the acquisition engine with every temperature sample
+    def onTempSample(self, channel, t, temp):
+        if self.setpt != 'undefined' and abs(temp - self.setpt) <= RAMP_BAND:
+            if self.inBandSince is None:
+                self.inBandSince = t
+        else:
+            self.inBandSince = None
+        self.adaptRates(t)
+
+    # The acquisition engine samples the temperature, power and current fast while the temperature is moving (the
+    # set point changed recently or the temperature is far from it), at the default rates while it settles, and
+    # slowly during long holds or when the output is off. This keeps the resolution of ramps and overshoots while
+    # cutting the serial traffic of a run, which is mostly holds.
+    def rateModeAt(self, now):
+        if not self.powerOn:
+            return 'idle'
+        if self.setptTime is not None and now - self.setptTime < TRANSITION_WINDOW:
+            return 'ramp'
+        if self.setpt == 'undefined':
+            return 'settle'
+        if self.inBandSince is None:
+            return 'ramp'
+        if now - self.inBandSince >= HOLD_AFTER:
+            return 'hold'
+        return 'settle'
+
+    def adaptRates(self, now=None):
+        if not self.adaptive:
+            return
+        with self.rateLock:
+            mode = self.rateModeAt(time.time() if now is None else now)
+            if mode == self.rateMode:
+                return
+            self.rateMode = mode
+            rates = RATE_MODES.get(mode, self.rates)
+            self.acq.setRates(dict([(ch, rates.get(ch, self.rates[ch])) for ch in RATE_MODES['ramp']
+                                    if ch in self.rates]))
+
+    # watch for the temperature to be stable at target, see StabilityDetector. With predict, the band entry is
+    # predicted and sampled when due, see SettlePredictor. onStable is called once it is stable. Call close() on the
+    # returned StabilityWatch when done with it.
+    def watchStability(self, target, tolerance, window, spread=None, predict=True, onStable=None):
+        detector = StabilityDetector(target, tolerance, window, spread)
+        if self.sampling('input1'):
+            predictor = SettlePredictor(target, tolerance) if predict else None
+            return StabilityWatch(detector, self.acq, 'input1', predictor=predictor, onClose=self.settled,
+                                  onStable=onStable)
+        return StabilityWatch(detector, poll=self.getTemp, onStable=onStable)
+
+    # records the predicted and actual band entry of a closed StabilityWatch
+    def settled(self, watch):
+        if watch.entered is None:
+            return
+        self.settleLog.append((watch.detector.target, watch.predicted, watch.entered))
+
+    # number of predicted band entries, and the mean and max absolute error of the predictions in seconds
+    def settleStats(self):
+        errors = [abs(p - e) for target, p, e in self.settleLog if p is not None]
+        if not errors:
+            return 0, None, None
+        return len(errors), sum(errors)/len(errors), max(errors)
+
+    # number of finished ramp boosts, and the mean and max overshoot past their targets in C, see boostLog
+    def boostStats(self):
+        overshoots = [overshoot for target, setpt, lead, crossover, overshoot in self.boostLog]
+        if not overshoots:
+            return 0, None, None
+        return len(overshoots), sum(overshoots)/len(overshoots), max(overshoots)
+
+    # The PID controller is equilibrated if the temperature has been within EQUIL_TOLERANCE of the set point, and
+    # within EQUIL_SPREAD of itself, for the last EQUIL_WINDOW seconds
     def checkEquil(self):
-        for i in self.tempLog[-20]:
-            if i -self.tempLog[-1] > 0.1 or i - self.setpt > 0.3:
-                #if any are more than 0.1 away from the current temp,
-                return False
-        #otherwise,
-        return True
-
-    def waitEquil(self):
-        equil = False
-        while not equil:
-            time.sleep(1)
-            self.log()
-            equil = self.checkEquil()
+        if self.setpt == 'undefined':
+            return False
+        detector = StabilityDetector(self.setpt, EQUIL_TOLERANCE, EQUIL_WINDOW, EQUIL_SPREAD)
+        if self.sampling('input1'):
+            samples = self.acq.history('input1')
+        else:
+            times = self.telemetry.window('time')
+            samples = zip(times, self.telemetry.window('temperature', len(times)))
+        for t, temp in samples:
+            detector.add(t, temp)
+        return detector.stable()
+
+    # wait until equilibrated (see checkEquil) or for timeout seconds (None for no limit), returns whether equilibrated
+    def waitEquil(self, timeout=None):
+        if self.setpt == 'undefined':
+            raise ValueError("Error: the set point has not been set.")
+        watch = self.watchStability(self.setpt, EQUIL_TOLERANCE, EQUIL_WINDOW, EQUIL_SPREAD)
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            while not watch.wait(1):
+                if deadline is not None and time.time() >= deadline:
+                    return False
+                if watch.acq is not None and self.acq.stale('input1'):
+                    raise IOError("No temperature samples from the controller (last error: %s)" % (self.acq.lastError,))
+            return True
+        finally:
+            watch.close()
 
 
     def setIntegralGain(self,gain):
         if (type(gain) != int) and (type(gain) != float):
             raise TypeError("The integral gain must be either an integer or a float.")
-        self.tc3625Lock.acquire()
-        self.ctlr.set_integral_gain(gain)
-        self.tc3625Lock.release()
+        self.io.call(PRIORITY_SETPOINT, self.ctlr.set_integral_gain, gain)
 
     def setDerivativeGain(self,gain):
         if (type(gain) != int) and (type(gain) != float):
             raise TypeError("The derivative gain must be either an integer or a float.")
-        self.tc3625Lock.acquire()
-        self.ctlr.set_derivative_gain(gain)
-        self.tc3625Lock.release()
+        self.io.call(PRIORITY_SETPOINT, self.ctlr.set_derivative_gain, gain)
 
     #specify the number of seconds to pause.
     def pause(self,pause):
@@ -163,12 +915,44 @@ class Thermocycler:
 
 
     def log(self):
-        self.tempLog.append(float(self.getTemp()))
-        #self.timeLog.append(float(time.clock()))
-        #self.setpointLog.append(self.setpt)
-        #self.outCurrLog.append(self.getOutCurr())
+        setpt = self.setpt if self.setpt != 'undefined' else MISSING
+        self.telemetry.append(time.time(), float(self.getTemp()), setpt,
+                              self.latestValue('power output'), self.latestValue('output current'))
 
+    def isOpen(self):
+        return self.connected
+
+    def cancelBoost(self):
+        if self.boost is not None:
+            self.boost.cancel()
+            self.boost = None
+
+    def close(self):
+        try:
+            self.cancelBoost()
+        finally:
+            self.acq.stop()
+            self.acq.unsubscribe(self.onTempSample)
+            try:
+                self.io.call(PRIORITY_POWER, self.ctlr.close)
+            finally:
+                self.io.stop()
+                self.connected = False
+
+    # switches the output off first, then restores a boosted set point and closes the port. Each step runs even if an
+    # earlier one fails.
     def destroy(self):
         print("Shutting Down...")
-        self.setPowerOff()
+        try:
+            self.setPowerOff()
+        finally:
+            try:
+                self.cancelBoost()
+            finally:
+                self.acq.stop()
+                try:
+                    self.io.call(PRIORITY_POWER, self.ctlr.close)
+                finally:
+                    self.io.stop()
+                    self.connected = False
 
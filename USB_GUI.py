@@ -18,8 +18,7 @@ except:
 from Protocol_Tools import *
 from Step import Step
 from LabelEntry import LabelEntry
-import serial
-from serial.tools import list_ports
+import uibus
 
 
 #Serves as a base class for GUIs connecting USB devices.
@@ -60,14 +59,17 @@ class usbGUI:
         self.menubar = Menu(master)
         #self.menubar.config(bg ='red')
         self.connectmenu = Menu(self.menubar, tearoff=0)
+        # the menu is filled in when it is opened, scanning the ports at startup is slow on some systems
         self.connectmenu.config(postcommand = self.resetConnectMenu)
-        self.populateConnectMenu()
         self.menubar.add_cascade(label="Connect", menu=self.connectmenu)
 
         master.config(menu=self.menubar)
 
         self.device = None #not yet initialized
 
+        # apply the widget changes posted by protocol threads
+        uibus.bus.start(master)
+
     # usbGUI.resetConnectMenu: Called when the user clicks on the "Connect" dropdown menu- checks what USB devices are
     #   connected and updates the dropdown menu to list those devices.
     # Inputs: None
@@ -85,7 +87,8 @@ class usbGUI:
     # Inputs: None
     # Outputs: None
     def populateConnectMenu(self):
-        ports = [port for port in serial.tools.list_ports.comports() if port[2] != 'n/a']
+        from serial.tools import list_ports
+        ports = [port for port in list_ports.comports() if port[2] != 'n/a']
         for port in ports:
             self.connectmenu.add_command(label=port[1], command=lambda prt=port[0]: self.connect(prt))
 
@@ -155,6 +158,7 @@ class usbGUI:
     # Inputs: None
     # Outputs: None
     def destroy(self, arg1 = None, arg2 = None): #cleans up at window close
+        uibus.bus.stop()
         try:
             self.device.destroy()
 
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark for the TC-36-25 frame codec.
+
+Compares the original per-call frame construction (struct.pack of single
+characters, ord() checksum loop and string slicing for the twos
+complement conversion) with tc3625_codec for one read and one write
+transaction, excluding the serial port itself. For each path it reports
+the time per transaction and, on Python 3, the memory allocated at peak
+while encoding the send string and decoding the return string.
+
+Usage:
+
+  python bench_codec.py [num_transactions]
+"""
+from __future__ import print_function
+import struct
+import sys
+import timeit
+
+from tc3625_serial import SERIAL_CMDS, ADDRESS, STX, ETX, ACK, RETURN_SIZE
+from tc3625_serial import get_checksum, to_twoscomp, from_twoscomp
+from tc3625_codec import get_codec, WRITE_FRAME_SIZE
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+READ_CMD = 'input1'
+WRITE_CMD = 'fixed desired control setting'
+WRITE_VAL = 4250
+
+
+def _return_frame(val):
+    val_2c = to_twoscomp(val)
+    return (STX + val_2c + get_checksum(val_2c) + ACK).encode('ascii')
+
+READ_RETURN = _return_frame(2512)
+WRITE_RETURN = _return_frame(WRITE_VAL)
+
+
+# Original implementation, as it was in TC3625_Serial.read/write
+def legacy_read():
+    cc = SERIAL_CMDS[READ_CMD]['read']
+    cs = get_checksum(ADDRESS+cc)
+    cmd_tuple = (STX,ADDRESS[0],ADDRESS[1],cc[0],cc[1],cs[0],cs[1],ETX)
+    send = struct.pack('c'*8,*[c.encode('ascii') for c in cmd_tuple])
+    ret = READ_RETURN.decode('ascii')
+    cs = get_checksum(ret[1:-3])
+    if cs != ret[-3:-1]:
+        raise IOError('checksum')
+    if ret[1:-3] == 'X'*8:
+        raise IOError('nak')
+    return send, from_twoscomp(ret[1:-3])
+
+def legacy_write():
+    cc = SERIAL_CMDS[WRITE_CMD]['write']
+    val_2c = to_twoscomp(int(WRITE_VAL))
+    cs = get_checksum(ADDRESS+cc+val_2c)
+    cmd_list = [STX,ADDRESS[0],ADDRESS[1],cc[0],cc[1]]
+    for x in val_2c:
+        cmd_list.append(x)
+    cmd_list.extend([cs[0],cs[1],ETX])
+    send = struct.pack('c'*16,*[c.encode('ascii') for c in cmd_list])
+    ret = WRITE_RETURN.decode('ascii')
+    cs = get_checksum(ret[1:-3])
+    if cs != ret[-3:-1]:
+        raise IOError('checksum')
+    if ret[1:-3] == 'X'*8:
+        raise IOError('nak')
+    return send, from_twoscomp(ret[1:-3])
+
+
+# Codec implementation, as used by TC3625_Serial
+codec = get_codec(SERIAL_CMDS, ADDRESS)
+send_buf = bytearray(WRITE_FRAME_SIZE)
+ret_buf = bytearray(RETURN_SIZE)
+
+def codec_read():
+    send = codec.read_frame(READ_CMD)
+    ret_buf[:] = READ_RETURN
+    return send, codec.decode(ret_buf)
+
+def codec_write():
+    codec.encode_write(send_buf, 0, WRITE_CMD, WRITE_VAL)
+    ret_buf[:] = WRITE_RETURN
+    return send_buf, codec.decode(ret_buf)
+
+
+def peak_bytes(func, num=100):
+    """ Average memory allocated at peak per call of func """
+    if tracemalloc is None:
+        return None
+    func()
+    tracemalloc.start()
+    total = 0
+    for i in range(num):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total/float(num)
+
+
+def main(num=100000):
+    assert legacy_read()[1] == codec_read()[1]
+    assert legacy_write() == (bytes(codec_write()[0]), WRITE_VAL)
+    print('%-14s %12s %16s' % ('transaction', 'us/call', 'peak bytes/call'))
+    for name, func in (
+            ('legacy read', legacy_read),
+            ('codec read', codec_read),
+            ('legacy write', legacy_write),
+            ('codec write', codec_write),
+            ):
+        t = min(timeit.repeat(func, number=num, repeat=3))/num
+        peak = peak_bytes(func)
+        peak_str = 'n/a' if peak is None else '%.0f' % peak
+        print('%-14s %12.2f %16s' % (name, 1e6*t, peak_str))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
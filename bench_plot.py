@@ -0,0 +1,87 @@
+"""
+Frame time benchmark for the live temperature chart.
+
+Fills a telemetry buffer with a simulated thermocycling run of each size
+and times the frames drawn by liveplot.BlitPlot (decimated series,
+blitted line artists) on an off-screen Agg canvas. For comparison it also
+times the old approach of clearing the figure and replotting every
+sample. The Tk canvas adds the copy of the blitted region to the window,
+which does not depend on the run length.
+
+Usage:
+
+  python bench_plot.py [num_frames]
+"""
+from __future__ import print_function
+import math
+import sys
+import time
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from telemetry import TelemetryBuffer
+from decimation import DecimationPyramid
+from liveplot import BlitPlot
+
+SIZES = [10**3, 10**5, 10**6]
+# The old full replot is only timed up to this many samples
+MAX_FULL_REPLOT = 10**5
+
+
+def simulated_run(num):
+    """ Buffer and pyramid holding num samples at 1 Hz of a 3 step cycle """
+    buf = TelemetryBuffer(capacity=num)
+    pyramid = DecimationPyramid(buf, ('temperature', 'setpoint'))
+    steps = [(95.0, 30), (55.0, 30), (72.0, 60)]
+    temp = 25.0
+    t = 0
+    while t < num:
+        for setpt, hold in steps:
+            for i in range(hold):
+                if t >= num:
+                    break
+                temp += 0.2 * (setpt - temp)
+                buf.append(float(t), temp + 0.05 * math.sin(t), setpt, 50.0, 2.0)
+                t += 1
+    return buf, pyramid
+
+def time_blit(buf, pyramid, num_frames):
+    figure = Figure(figsize=(6, 3.5), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    plot = BlitPlot(figure, canvas, pyramid)
+    canvas.draw()
+    plot.frame()
+    plot.frameTimes.clear()
+    for i in range(num_frames):
+        plot.frame()
+    return plot.frameStats()
+
+def time_full_replot(buf, num_frames):
+    figure = Figure(figsize=(6, 3.5), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    times = []
+    for i in range(num_frames):
+        start = time.time()
+        log = buf.snapshot(('time', 'temperature', 'setpoint'))
+        figure.clf()
+        axes = figure.add_subplot(111)
+        axes.plot(log['time'], log['temperature'], color='k')
+        axes.plot(log['time'], log['setpoint'], color='r')
+        canvas.draw()
+        times.append(time.time() - start)
+    return sum(times) / len(times), max(times)
+
+
+if __name__ == '__main__':
+
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    print('%10s %14s %14s %16s' % ('samples', 'blit mean ms', 'blit max ms', 'full replot ms'))
+    for num in SIZES:
+        buf, pyramid = simulated_run(num)
+        mean, worst = time_blit(buf, pyramid, num_frames)
+        if num <= MAX_FULL_REPLOT:
+            full = '%.1f' % (1e3 * time_full_replot(buf, max(num_frames // 4, 1))[0],)
+        else:
+            full = '-'
+        print('%10d %14.2f %14.2f %16s' % (num, 1e3 * mean, 1e3 * worst, full))
@@ -0,0 +1,106 @@
+"""
+Cold start benchmark for the temperature controller GUI.
+
+Starts a fresh interpreter which imports TemperatureGUI, builds the main
+window and draws the first frame, and reports the time from launching
+the interpreter to the end of the imports and to the first frame. On
+Python 3.7+ the slowest imports are listed from -X importtime. Heavy
+modules which must only be loaded on first use (matplotlib, the serial
+port scan) are checked not to be imported at startup.
+
+The exit status is 1 if a budget is exceeded or a deferred module was
+imported, so this can be run as a regression check. Without a display
+only the imports are measured.
+
+Usage:
+
+  python bench_startup.py [num_runs]
+"""
+from __future__ import print_function
+import json
+import subprocess
+import sys
+import time
+
+# Budgets in seconds, from launching the interpreter (best of num_runs)
+IMPORT_BUDGET = 0.5
+FIRST_FRAME_BUDGET = 0.8
+
+# Modules which must not be imported before the window appears
+DEFERRED_MODULES = ['matplotlib', 'serial.tools.list_ports', 'numpy']
+
+CHILD = """
+import json, sys, time
+t_start = float(sys.argv[1])
+result = {}
+import TemperatureGUI
+result['import'] = time.time() - t_start
+result['loaded'] = [m for m in %r if m in sys.modules]
+try:
+    root = TemperatureGUI.Tk()
+except TemperatureGUI.TclError as E:
+    result['no display'] = str(E)
+else:
+    app = TemperatureGUI.tempGUI(root)
+    root.update()
+    result['first frame'] = time.time() - t_start
+    result['loaded after frame'] = [m for m in %r if m in sys.modules]
+    root.destroy()
+print(json.dumps(result))
+""" % (DEFERRED_MODULES, DEFERRED_MODULES)
+
+
+def run_once():
+    out = subprocess.check_output([sys.executable, '-c', CHILD, repr(time.time())])
+    return json.loads(out.decode('ascii').strip().splitlines()[-1])
+
+def slowest_imports(num=10):
+    """ Cumulative import times (s) of the slowest modules, from -X importtime """
+    if sys.version_info < (3, 7):
+        return None
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import TemperatureGUI'],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err = proc.communicate()[1].decode('utf-8', 'replace')
+    times = []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative_us) * 1e-6, name.rstrip()))
+    times.sort(reverse=True)
+    return times[:num]
+
+
+if __name__ == '__main__':
+
+    num_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = [run_once() for i in range(num_runs)]
+    failed = False
+
+    best_import = min(r['import'] for r in results)
+    print('imports      %6.3f s  (budget %.3f s)' % (best_import, IMPORT_BUDGET))
+    failed |= best_import > IMPORT_BUDGET
+
+    frames = [r['first frame'] for r in results if 'first frame' in r]
+    if frames:
+        print('first frame  %6.3f s  (budget %.3f s)' % (min(frames), FIRST_FRAME_BUDGET))
+        failed |= min(frames) > FIRST_FRAME_BUDGET
+    else:
+        print('first frame  not measured: %s' % (results[0]['no display'],))
+
+    loaded = set()
+    for r in results:
+        loaded.update(r['loaded'])
+        loaded.update(r.get('loaded after frame', []))
+    if loaded:
+        print('deferred modules imported at startup: %s' % (', '.join(sorted(loaded)),))
+        failed = True
+
+    slowest = slowest_imports()
+    if slowest:
+        print('slowest imports (cumulative):')
+        for t, name in slowest:
+            print('  %6.1f ms  %s' % (1e3 * t, name))
+
+    print('FAIL' if failed else 'OK')
+    sys.exit(1 if failed else 0)
@@ -10,4 +10,6 @@
 
 
 root = None
-stopEditing = False
\ No newline at end of file
+stopEditing = False
+# directory of the per run log files written while connected, see runlog.RunLog
+runLogDir = "Run Logs"
\ No newline at end of file
@@ -0,0 +1,153 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from bisect import bisect_left, bisect_right
+
+from telemetry import TelemetryBuffer, MISSING, isMissing
+
+# Each level has one bucket for every FACTOR buckets (or samples) of the level below
+DFLT_FACTOR = 4
+DFLT_LEVELS = 10
+# Buckets kept per level. Should be at least the largest number of points plotted.
+DFLT_LEVEL_CAPACITY = 4096
+# Default number of points returned by series, about two per pixel of a plot
+DFLT_MAX_POINTS = 2000
+
+
+def combine(lo, hi, value):
+    if isMissing(value):
+        return lo, hi
+    if isMissing(lo) or value < lo:
+        lo = value
+    if isMissing(hi) or value > hi:
+        hi = value
+    return lo, hi
+
+
+# Bucket of a level being filled: the time of its first entry and the min and max of each column
+class Accumulator:
+    def __init__(self, numColumns):
+        self.numColumns = numColumns
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.time = MISSING
+        self.mins = [MISSING] * self.numColumns
+        self.maxs = [MISSING] * self.numColumns
+
+    def add(self, t, mins, maxs):
+        if self.count == 0:
+            self.time = t
+        for i in range(self.numColumns):
+            self.mins[i], self.maxs[i] = combine(self.mins[i], self.maxs[i], mins[i])
+            self.mins[i], self.maxs[i] = combine(self.mins[i], self.maxs[i], maxs[i])
+        self.count += 1
+
+
+# Min/max decimation pyramid over columns of a TelemetryBuffer, for plotting long runs. Level 0 is the buffer itself;
+# a bucket of level k holds the time of its first sample and the min and max of each column over FACTOR**k samples,
+# so peaks and overshoots survive decimation. Buckets are added as samples arrive (the pyramid subscribes to the
+# buffer), which is O(1) amortized per sample. series() picks the finest level that covers the requested time range
+# in at most maxPoints points, so the cost of a redraw depends on the plot width and not on the length of the run.
+# Each level is a TelemetryBuffer, so reading needs no lock.
+#   buffer - TelemetryBuffer holding the samples, time in its first column
+#   columns - names of the columns to decimate
+class DecimationPyramid:
+    def __init__(self, buffer, columns, factor=DFLT_FACTOR, levels=DFLT_LEVELS, capacity=DFLT_LEVEL_CAPACITY):
+        self.buffer = buffer
+        self.columns = tuple(columns)
+        self.indexes = [buffer.columns.index(col) for col in self.columns]
+        self.factor = factor
+        levelColumns = ['time']
+        for col in self.columns:
+            levelColumns += [col + ' min', col + ' max']
+        self.levels = [TelemetryBuffer(capacity, levelColumns) for k in range(levels)]
+        # levels[k] is level k+1; pending[k] is its bucket being filled
+        self.pending = [Accumulator(len(self.columns)) for k in range(levels)]
+        buffer.subscribe(self.append)
+
+    # add a row of the buffer, called by TelemetryBuffer.append
+    def append(self, row):
+        values = [row[i] for i in self.indexes]
+        t, mins, maxs = row[0], values, values
+        for level, acc in zip(self.levels, self.pending):
+            acc.add(t, mins, maxs)
+            if acc.count < self.factor:
+                break
+            t, mins, maxs = acc.time, list(acc.mins), list(acc.maxs)
+            bucket = [t]
+            for lo, hi in zip(mins, maxs):
+                bucket += [lo, hi]
+            level.append(*bucket)
+            acc.clear()
+
+    # (times, values) of column from start to stop (all of it if None), in at most maxPoints points. Decimated levels
+    # give two points, the min and the max, for each bucket.
+    def series(self, column, start=None, stop=None, maxPoints=DFLT_MAX_POINTS):
+        c = self.columns.index(column)
+        while True:
+            times, values, complete = self.read(c, column, start, stop, maxPoints)
+            if complete:
+                return times, values
+
+    def read(self, c, column, start, stop, maxPoints):
+        # raw samples
+        timeView = self.buffer.window('time')
+        lo, hi = self.bounds(timeView, start, stop)
+        if hi - lo <= maxPoints and self.covers(self.buffer, timeView, start):
+            valueView = self.buffer.window(column, len(timeView))
+            times, values = timeView[lo:hi], valueView[lo:hi]
+            return times, values, timeView.valid() and valueView.valid()
+        # decimated, finest level that fits
+        for k, level in enumerate(self.levels):
+            timeView = level.window('time')
+            lo, hi = self.bounds(timeView, start, stop)
+            if 2 * (hi - lo + 1) > maxPoints or not self.covers(level, timeView, start):
+                continue
+            minView = level.window(column + ' min', len(timeView))
+            maxView = level.window(column + ' max', len(timeView))
+            times, values = [], []
+            for t, vmin, vmax in zip(timeView[lo:hi], minView[lo:hi], maxView[lo:hi]):
+                times += [t, t]
+                values += [vmin, vmax]
+            complete = timeView.valid() and minView.valid() and maxView.valid()
+            # the samples since the last complete bucket of this level
+            if hi == len(timeView):
+                partial = self.partial(k, c)
+                if partial is not None:
+                    times += [partial[0], partial[0]]
+                    values += [partial[1], partial[2]]
+            return times, values, complete
+        return [], [], True
+
+    # rows of the time view between start and stop
+    def bounds(self, timeView, start, stop):
+        lo = 0 if start is None else max(bisect_right(timeView, start) - 1, 0)
+        hi = len(timeView) if stop is None else bisect_left(timeView, stop)
+        return lo, hi
+
+    # True if the view reaches back to start, or to the beginning of the run
+    def covers(self, buffer, timeView, start):
+        if buffer.count <= buffer.capacity:
+            return True
+        return start is not None and len(timeView) > 0 and timeView[0] <= start
+
+    # (time, min, max) of column c over the samples not yet in a complete bucket of level k+1, or None
+    def partial(self, k, c):
+        acc = Accumulator(1)
+        for j in range(k + 1):
+            pending = self.pending[j]
+            if pending.count > 0:
+                acc.add(pending.time, [pending.mins[c]], [pending.maxs[c]])
+                acc.time = min(acc.time, pending.time)
+        if acc.count == 0:
+            return None
+        return acc.time, acc.mins[0], acc.maxs[0]
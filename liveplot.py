@@ -0,0 +1,150 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Live temperature and set point chart. matplotlib is imported when a plot is first created, see bench_startup.py.
+
+import time
+from collections import deque
+
+from decimation import DFLT_LEVEL_CAPACITY
+
+DFLT_FRAME_RATE = 2.0
+# Axis limits are widened by this fraction of the data range when the data outgrows them
+AXIS_HEADROOM = 0.25
+# Number of frame times kept for frameStats
+FRAME_HISTORY = 100
+
+
+def expand(lo, hi, vmin, vmax, headroom=AXIS_HEADROOM, minSpan=1.0):
+    if vmin >= lo and vmax <= hi:
+        return None
+    span = max(vmax - vmin, minSpan)
+    return min(lo, vmin - headroom * span), max(hi, vmax + headroom * span)
+
+def finiteRange(values):
+    values = [v for v in values if v == v]
+    if not values:
+        return None
+    return min(values), max(values)
+
+
+# Draws the temperature and set point series of a DecimationPyramid onto a matplotlib figure by blitting: the axes,
+# ticks and labels are rendered once into a background, and each frame only restores that background, updates the
+# data of the two line artists in place and draws them. A full redraw only happens when the data outgrows the axis
+# limits (which are then widened with headroom, so this is rare) or the figure is resized. Works with any canvas
+# supporting copy_from_bbox/restore_region/blit, eg FigureCanvasTkAgg or FigureCanvasAgg.
+class BlitPlot:
+    def __init__(self, figure, canvas, pyramid):
+        self.figure = figure
+        self.canvas = canvas
+        self.pyramid = pyramid
+        self.axes = figure.add_subplot(111)
+        self.axes.set_xlabel("Time (s)")
+        self.axes.set_ylabel("Temperature (C)")
+        self.axes.set_xlim(0, 60)
+        self.axes.set_ylim(0, 100)
+        self.tempLine, = self.axes.plot([], [], color='k', animated=True)
+        # the set point is missing (nan) until one is set, which leaves a gap in its line
+        self.setptLine, = self.axes.plot([], [], color='r', animated=True)
+        self.background = None
+        self.numFullDraws = 0
+        self.frameTimes = deque(maxlen=FRAME_HISTORY)
+        canvas.mpl_connect('draw_event', self.onDraw)
+
+    # called by the canvas after every full draw, eg on resize
+    def onDraw(self, event=None):
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.drawLines()
+
+    # one point per pixel of the axes width, ie a min/max pair every two pixels. Peaks still show, and Agg takes about
+    # ten times longer to draw the envelope at twice the density.
+    def maxPoints(self):
+        return max(min(int(self.axes.bbox.width), DFLT_LEVEL_CAPACITY), 100)
+
+    def frame(self):
+        start = time.time()
+        maxPoints = self.maxPoints()
+        times, temps = self.pyramid.series('temperature', maxPoints=maxPoints)
+        setptTimes, setpts = self.pyramid.series('setpoint', maxPoints=maxPoints)
+        self.tempLine.set_data(times, temps)
+        self.setptLine.set_data(setptTimes, setpts)
+        if self.rescale(times, temps, setpts) or self.background is None:
+            self.numFullDraws += 1
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self.drawLines()
+            self.canvas.blit(self.axes.bbox)
+        self.frameTimes.append(time.time() - start)
+
+    def drawLines(self):
+        self.axes.draw_artist(self.tempLine)
+        self.axes.draw_artist(self.setptLine)
+
+    # widen the axis limits if the data has outgrown them, returns True if they changed
+    def rescale(self, times, temps, setpts):
+        changed = False
+        if times:
+            xlim = expand(self.axes.get_xlim()[0], self.axes.get_xlim()[1], times[0], times[-1], minSpan=60.0)
+            if xlim is not None:
+                self.axes.set_xlim(*xlim)
+                changed = True
+        yrange = finiteRange(list(temps) + list(setpts))
+        if yrange is not None:
+            ylim = expand(self.axes.get_ylim()[0], self.axes.get_ylim()[1], yrange[0], yrange[1])
+            if ylim is not None:
+                self.axes.set_ylim(*ylim)
+                changed = True
+        return changed
+
+    # mean and max of the recent frame times, in seconds
+    def frameStats(self):
+        if not self.frameTimes:
+            return None, None
+        return sum(self.frameTimes) / len(self.frameTimes), max(self.frameTimes)
+
+
+# The chart as a Tk widget, redrawn from the Tk event loop with after() at frameRate frames per second.
+#   master - Tkinter frame to place the chart in
+#   pyramid - DecimationPyramid of the logged temperatures
+class LivePlot:
+    def __init__(self, master, pyramid, frameRate=DFLT_FRAME_RATE, width=6, height=3.5):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        self.master = master
+        self.interval = int(1000 / frameRate)
+        self.figure = Figure(figsize=(width, height), dpi=100)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.plot = BlitPlot(self.figure, self.canvas, pyramid)
+        self.widget = self.canvas.get_tk_widget()
+        self.afterId = None
+
+    def grid(self, **kwargs):
+        self.widget.grid(**kwargs)
+        self.canvas.draw()
+
+    def start(self):
+        if self.afterId is None:
+            self.afterId = self.master.after(0, self.tick)
+
+    def stop(self):
+        if self.afterId is not None:
+            self.master.after_cancel(self.afterId)
+            self.afterId = None
+
+    def tick(self):
+        try:
+            self.plot.frame()
+        finally:
+            self.afterId = self.master.after(self.interval, self.tick)
+
+    def destroy(self):
+        self.stop()
+        self.widget.destroy()
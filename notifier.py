@@ -0,0 +1,54 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+from threading import Condition, Lock
+
+# Events of a protocol run
+# the user cancelled the run
+CANCEL = 'cancel'
+# the temperature of the running step is stable, see Therm.StabilityWatch
+SETTLED = 'settled'
+
+
+# The protocol thread blocks on a StepNotifier between step transitions instead of polling. Whatever sees an event
+# happen (the Tk thread for a cancel, the acquisition engine for a settled temperature) calls notify, which wakes the
+# protocol thread at once; a hold ends at the deadline passed to wait. Events stay set until cleared.
+class StepNotifier:
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.events = set()
+
+    def notify(self, event):
+        with self.cond:
+            self.events.add(event)
+            self.cond.notify_all()
+
+    def clear(self, event):
+        with self.cond:
+            self.events.discard(event)
+
+    def isSet(self, event):
+        return event in self.events
+
+    # block until one of events is set or time.time() reaches deadline (None for no limit), or for at most timeout
+    # seconds. Returns the set of those events that are set, empty if the deadline was reached.
+    def wait(self, events, deadline = None, timeout = None):
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                found = self.events.intersection(events)
+                if found:
+                    return found
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return found
+                self.cond.wait(remaining)
@@ -0,0 +1,200 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+# Binary columnar archive of a run, for opening long runs without parsing the CSV run log. An archive is a directory:
+#   header.json - format, column names, index stride and start time
+#   <column>.f64 - one little endian float64 per row for each column, eg time.f64, temperature.f64
+#   time.idx - sparse time index: (time float64, row int64) for every INDEX_STRIDE-th row
+#   steps.idx - step index: one STEP_FMT record for each protocol step started (see ArchiveWriter.markStep)
+# All files are only appended to. If the process is killed part way through a row the columns can differ in length;
+# the rows present in every column count, and reopening the archive for writing trims the rest.
+#
+# ArchiveWriter needs only the standard library. RunArchive memory maps the files with NumPy and returns views, so
+# reading a time range or a protocol step touches only the pages holding it, however long the run.
+
+import os
+import json
+import struct
+import time
+
+from telemetry import COLUMNS
+
+FORMAT = 'tc-run-archive-1'
+COLUMN_EXT = '.f64'
+VALUE = struct.Struct('<d')
+ROW_SIZE = VALUE.size
+INDEX_STRIDE = 256
+INDEX_FMT = '<dq'
+# row, time, step number, set point and the iteration of up to MAX_LOOP_DEPTH enclosing loops (i[0] first, 0 if none)
+MAX_LOOP_DEPTH = 4
+STEP_FMT = '<qdid' + str(MAX_LOOP_DEPTH) + 'i'
+STEP_SIZE = struct.calcsize(STEP_FMT)
+# Rows are flushed to disk at least this often
+DFLT_FLUSH_ROWS = 60
+
+
+def numRows(directory, columns):
+    sizes = []
+    for col in columns:
+        path = os.path.join(directory, col + COLUMN_EXT)
+        sizes.append(os.path.getsize(path) // ROW_SIZE if os.path.exists(path) else 0)
+    return min(sizes) if sizes else 0
+
+
+# Appends rows and step marks to an archive directory, created if it does not exist. The first column must be time,
+# increasing. append() is used as a TelemetryBuffer subscriber.
+class ArchiveWriter:
+    def __init__(self, directory, columns=COLUMNS, flushRows=DFLT_FLUSH_ROWS):
+        self.directory = directory
+        self.flushRows = flushRows
+        headerPath = os.path.join(directory, 'header.json')
+        if os.path.exists(headerPath):
+            with open(headerPath) as f:
+                header = json.load(f)
+            self.columns = header['columns']
+            self.stride = header['index stride']
+        else:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.columns = list(columns)
+            self.stride = INDEX_STRIDE
+            with open(headerPath, 'w') as f:
+                json.dump({'format': FORMAT, 'columns': self.columns, 'index stride': self.stride,
+                           'max loop depth': MAX_LOOP_DEPTH, 'start': time.time()}, f)
+        self.rows = numRows(directory, self.columns)
+        self.files = []
+        for col in self.columns:
+            f = open(os.path.join(directory, col + COLUMN_EXT), 'ab')
+            f.truncate(self.rows * ROW_SIZE)
+            self.files.append(f)
+        self.timeIndex = open(os.path.join(directory, 'time.idx'), 'ab')
+        self.timeIndex.truncate(((self.rows + self.stride - 1) // self.stride) * struct.calcsize(INDEX_FMT))
+        stepsPath = os.path.join(directory, 'steps.idx')
+        self.numSteps = os.path.getsize(stepsPath) // STEP_SIZE if os.path.exists(stepsPath) else 0
+        self.steps = open(stepsPath, 'ab')
+        self.steps.truncate(self.numSteps * STEP_SIZE)
+        self.lastTime = None
+
+    # append a row of values in column order
+    def append(self, row):
+        for f, value in zip(self.files, row):
+            f.write(VALUE.pack(value))
+        if self.rows % self.stride == 0:
+            self.timeIndex.write(struct.pack(INDEX_FMT, row[0], self.rows))
+        self.lastTime = row[0]
+        self.rows += 1
+        if self.rows % self.flushRows == 0:
+            self.flush()
+
+    # record that a protocol step with set point setpoint starts at the next row, stamped with the time of the last
+    # row. iter is the tuple of loop iterations passed to Step.run (None outside loops).
+    def markStep(self, setpoint, iter=None):
+        iters = list(iter or ())[:MAX_LOOP_DEPTH]
+        iters += [0] * (MAX_LOOP_DEPTH - len(iters))
+        t = self.lastTime if self.lastTime is not None else 0.0
+        self.steps.write(struct.pack(STEP_FMT, self.rows, t, self.numSteps, setpoint, *iters))
+        self.steps.flush()
+        self.numSteps += 1
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+        self.timeIndex.flush()
+
+    def close(self):
+        self.flush()
+        for f in self.files:
+            f.close()
+        self.timeIndex.close()
+        self.steps.close()
+
+
+# Read only, memory mapped view of an archive. Reopen (or call refresh) to see rows appended since.
+class RunArchive:
+    def __init__(self, directory):
+        import numpy
+        self.numpy = numpy
+        self.directory = directory
+        with open(os.path.join(directory, 'header.json')) as f:
+            self.header = json.load(f)
+        if self.header['format'] != FORMAT:
+            raise ValueError(directory + " is not a run archive")
+        self.columns = self.header['columns']
+        self.stride = self.header['index stride']
+        self.refresh()
+
+    def refresh(self):
+        numpy = self.numpy
+        self.rows = numRows(self.directory, self.columns)
+        self.data = {}
+        for col in self.columns:
+            if self.rows == 0:
+                self.data[col] = numpy.zeros(0)
+            else:
+                self.data[col] = numpy.memmap(os.path.join(self.directory, col + COLUMN_EXT), dtype='<f8', mode='r',
+                                              shape=(self.rows,))
+        self.timeIndex = self.load('time.idx', numpy.dtype([('time', '<f8'), ('row', '<i8')]))
+        self.steps = self.load('steps.idx', numpy.dtype([('row', '<i8'), ('time', '<f8'), ('step', '<i4'),
+                                                         ('setpoint', '<f8'), ('iter', '<i4', (MAX_LOOP_DEPTH,))]))
+        self.steps = self.steps[self.steps['row'] <= self.rows]
+
+    def load(self, name, dtype):
+        path = os.path.join(self.directory, name)
+        num = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+        if num == 0:
+            return self.numpy.zeros(0, dtype=dtype)
+        return self.numpy.memmap(path, dtype=dtype, mode='r', shape=(num,))
+
+    def __len__(self):
+        return self.rows
+
+    # dictionary of column: view of rows [start, stop) for the given columns (all if None)
+    def slice(self, start, stop, columns=None):
+        if columns is None:
+            columns = self.columns
+        return dict([(col, self.data[col][start:stop]) for col in columns])
+
+    # first row with time >= t. The sparse index narrows the search to one stride of the time column.
+    def rowAt(self, t):
+        numpy = self.numpy
+        i = int(numpy.searchsorted(self.timeIndex['time'], t, side='right'))
+        lo = 0 if i == 0 else int(self.timeIndex['row'][i - 1])
+        hi = self.rows if i >= len(self.timeIndex) else int(self.timeIndex['row'][i])
+        return lo + int(numpy.searchsorted(self.data[self.columns[0]][lo:hi], t, side='left'))
+
+    # views of the rows with start <= time < stop
+    def timeRange(self, start, stop, columns=None):
+        return self.slice(self.rowAt(start), self.rowAt(stop), columns)
+
+    # (first row, row after the last) of step number n
+    def stepRows(self, n):
+        start = int(self.steps['row'][n])
+        stop = int(self.steps['row'][n + 1]) if n + 1 < len(self.steps) else self.rows
+        return start, stop
+
+    # views of the rows of protocol step number n, counted from 0 in the order the steps ran
+    def step(self, n, columns=None):
+        start, stop = self.stepRows(n)
+        return self.slice(start, stop, columns)
+
+    # step numbers of the steps run in the loop iteration iter, matched from the innermost loop outwards, eg (3000,)
+    # for the 3000th iteration of the innermost loop or (2, 5) for iteration 2 of the loop inside iteration 5
+    def stepsIn(self, iter):
+        match = self.numpy.ones(len(self.steps), dtype=bool)
+        for k, i in enumerate(iter):
+            match &= self.steps['iter'][:, k] == i
+        return [int(n) for n in self.numpy.nonzero(match)[0]]
+
+    # views of the rows from the first to the last step of loop iteration iter (see stepsIn), None if it did not run
+    def iteration(self, iter, columns=None):
+        steps = self.stepsIn(iter)
+        if not steps:
+            return None
+        return self.slice(self.stepRows(steps[0])[0], self.stepRows(steps[-1])[1], columns)
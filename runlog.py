@@ -0,0 +1,161 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import time
+import shutil
+from threading import Thread, Lock
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+# Rows are written out once this many are waiting or the oldest has waited this many seconds
+DFLT_FLUSH_ROWS = 60
+DFLT_FLUSH_INTERVAL = 5.0
+
+# When the file is fsynced, so that it survives a power cut and not just the process being killed:
+#   'never' - left to the operating system
+#   'close' - when the log is closed
+#   'flush' - after every batch of rows
+FSYNC_POLICIES = ('never', 'close', 'flush')
+DFLT_FSYNC = 'flush'
+
+# Written for missing values, as the old 'Save Temperature Logs' did for an undefined set point
+MISSING_TEXT = "Ndef"
+
+# Default column headings for the rows of a TelemetryBuffer
+HEADER = ["Time(s)", "Temperature(C)", "SetPoint(C)", "Power(%)", "Current(A)"]
+
+
+# per run file name, eg "Run Logs/run_20181017_143012.csv"
+def runPath(directory, prefix="run"):
+    return os.path.join(directory, prefix + time.strftime("_%Y%m%d_%H%M%S") + ".csv")
+
+def formatValue(value):
+    if value != value:
+        return MISSING_TEXT
+    return repr(value)
+
+# Truncate a partly written last line, eg left by a power cut, so the file ends with a complete row
+def recover(path):
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            f.truncate(end)
+    return end
+
+
+# Append-only CSV log of one run. write() only queues the row; a writer thread appends queued rows to the file in
+# batches, each with a single write of whole lines followed by a flush, so the file only ever ends with a complete
+# row and a killed process loses at most the rows of the last flush interval. Used as a TelemetryBuffer subscriber.
+#   path - file to write, created with a header row (appended to if it exists)
+#   header - column headings
+#   flushRows, flushInterval - batch size and the longest time a row waits before it is written
+#   fsync - one of FSYNC_POLICIES
+class RunLog:
+    def __init__(self, path, header=HEADER, flushRows=DFLT_FLUSH_ROWS, flushInterval=DFLT_FLUSH_INTERVAL,
+                 fsync=DFLT_FSYNC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("fsync must be one of " + ", ".join(FSYNC_POLICIES))
+        self.path = path
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+        self.fsync = fsync
+        self.queue = Queue()
+        self.fileLock = Lock()
+        self.numRows = 0
+        self.numFlushes = 0
+        self.lastError = None
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        exists = os.path.exists(path)
+        if exists:
+            recover(path)
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write((",".join(header) + "\n").encode('ascii'))
+            self.sync()
+        self.writer = Thread(target=self.run)
+        self.writer.daemon = True
+        self.writer.start()
+
+    # queue a row of values (floats, nan is written as MISSING_TEXT)
+    def write(self, row):
+        self.queue.put(row)
+
+    # write out all rows queued so far, eg before copying the file
+    def flush(self):
+        self.queue.put(None)
+        self.queue.join()
+
+    # copy the log, with all rows queued so far, to path
+    def copy(self, path):
+        self.flush()
+        with self.fileLock:
+            shutil.copyfile(self.path, path)
+
+    def close(self):
+        self.queue.put(StopIteration)
+        self.writer.join()
+
+    def run(self):
+        batch = []
+        deadline = None
+        while True:
+            try:
+                if deadline is None:
+                    row = self.queue.get()
+                else:
+                    row = self.queue.get(True, max(deadline - time.time(), 0.001))
+            except Empty:
+                # the oldest row has waited flushInterval
+                self.writeBatch(batch)
+                batch, deadline = [], None
+                continue
+            if row is StopIteration:
+                self.writeBatch(batch)
+                self.queue.task_done()
+                break
+            if row is not None:
+                batch.append(row)
+                if deadline is None:
+                    deadline = time.time() + self.flushInterval
+            if row is None or len(batch) >= self.flushRows or time.time() >= deadline:
+                self.writeBatch(batch)
+                batch, deadline = [], None
+            self.queue.task_done()
+        with self.fileLock:
+            if self.fsync != 'never':
+                self.sync()
+            self.file.close()
+
+    def writeBatch(self, batch):
+        if not batch:
+            return
+        text = "".join([",".join([formatValue(v) for v in row]) + "\n" for row in batch])
+        try:
+            with self.fileLock:
+                self.file.write(text.encode('ascii'))
+                if self.fsync == 'flush':
+                    self.sync()
+                else:
+                    self.file.flush()
+            self.numRows += len(batch)
+            self.numFlushes += 1
+        except (IOError, OSError) as E:
+            self.lastError = E
+            print("Run log error: " + str(E))
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
@@ -0,0 +1,205 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from collections import deque
+
+# A temperature within this many C of the target is in band
+DFLT_TOLERANCE = 1.0
+# Seconds the temperature must stay in band to be stable. 0 is stable as soon as a sample is in band.
+DFLT_WINDOW = 0.0
+# SettlePredictor fits the samples of the last PREDICT_WINDOW seconds, once it has MIN_FIT_SAMPLES of them, and makes
+# no prediction further ahead than PREDICT_HORIZON seconds
+PREDICT_WINDOW = 1.5
+MIN_FIT_SAMPLES = 4
+PREDICT_HORIZON = 30.0
+
+
+# Streaming statistics of the samples in the last 'window' seconds: count, mean, variance, min and max. Adding a
+# sample is O(1) amortized whatever the window: expired samples are dropped from the front of the deques, min and max
+# come from monotonic deques (each sample is pushed and popped at most once), and the mean and variance from running
+# sums, taken relative to the first sample to limit cancellation.
+class RollingWindow:
+    def __init__(self, window):
+        self.window = window
+        self.samples = deque()
+        # (time, value) with increasing values for the min, decreasing for the max. The fronts are the min and max.
+        self.mins = deque()
+        self.maxs = deque()
+        self.shift = None
+        self.sum = 0.0
+        self.sumSq = 0.0
+        # time of the first sample ever added, and of the last
+        self.firstTime = None
+        self.lastTime = None
+
+    # add a sample. Samples must be added in time order, ones not newer than the last sample are ignored.
+    def add(self, t, value):
+        if self.lastTime is not None and t <= self.lastTime:
+            return
+        if self.firstTime is None:
+            self.firstTime = t
+            self.shift = value
+        self.lastTime = t
+        self.samples.append((t, value))
+        d = value - self.shift
+        self.sum += d
+        self.sumSq += d*d
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((t, value))
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((t, value))
+        self.expire(t - self.window)
+
+    # drop the samples older than start
+    def expire(self, start):
+        samples = self.samples
+        while samples[0][0] < start:
+            t, value = samples.popleft()
+            d = value - self.shift
+            self.sum -= d
+            self.sumSq -= d*d
+        while self.mins[0][0] < start:
+            self.mins.popleft()
+        while self.maxs[0][0] < start:
+            self.maxs.popleft()
+
+    def __len__(self):
+        return len(self.samples)
+
+    # seconds since the first sample
+    def span(self):
+        if self.firstTime is None:
+            return 0.0
+        return self.lastTime - self.firstTime
+
+    def mean(self):
+        return self.shift + self.sum/len(self.samples)
+
+    def variance(self):
+        n = len(self.samples)
+        mean = self.sum/n
+        return max(self.sumSq/n - mean*mean, 0.0)
+
+    def min(self):
+        return self.mins[0][1]
+
+    def max(self):
+        return self.maxs[0][1]
+
+
+# Decides whether a temperature is stable at a target: every sample of the last 'window' seconds is within
+# 'tolerance' of the target and, if spread is given, they are within spread of each other (max - min). The window must
+# have been watched for its full length. Each sample is checked as it is added, so stability is known within one
+# sample period.
+#   target - the set point, may be changed with setTarget
+#   tolerance - half width in C of the band around the target
+#   window - seconds the temperature must stay in band
+#   spread - largest change in C over the window, None for no limit
+class StabilityDetector:
+    def __init__(self, target, tolerance=DFLT_TOLERANCE, window=DFLT_WINDOW, spread=None):
+        self.target = target
+        self.tolerance = tolerance
+        self.window = window
+        self.spread = spread
+        self.stats = RollingWindow(window)
+
+    def setTarget(self, target):
+        self.target = target
+
+    # add a sample and return whether the temperature is now stable
+    def add(self, t, value):
+        self.stats.add(t, value)
+        return self.stable()
+
+    def stable(self):
+        stats = self.stats
+        if len(stats) == 0 or stats.span() < self.window:
+            return False
+        if stats.max() > self.target + self.tolerance or stats.min() < self.target - self.tolerance:
+            return False
+        if self.spread is not None and stats.max() - stats.min() > self.spread:
+            return False
+        return True
+
+
+# Solves the 3x3 system m x = y by Cramer's rule, None if it is singular
+def solve3(m, y):
+    def det(a):
+        return (a[0][0]*(a[1][1]*a[2][2] - a[1][2]*a[2][1]) - a[0][1]*(a[1][0]*a[2][2] - a[1][2]*a[2][0]) +
+                a[0][2]*(a[1][0]*a[2][1] - a[1][1]*a[2][0]))
+    d = det(m)
+    if abs(d) < 1e-12:
+        return None
+    x = []
+    for k in range(3):
+        mk = [[y[i] if j == k else m[i][j] for j in range(3)] for i in range(3)]
+        x.append(det(mk)/d)
+    return x
+
+
+# Predicts when the temperature will enter the band around the target, from the slope and curvature of the last
+# PREDICT_WINDOW seconds: a least squares fit of v(t) = a + b*t + c*t^2 is solved for the first time ahead of the last
+# sample at which it reaches the near edge of the band. The curvature captures the PID slowing the ramp down as it
+# approaches the set point. Used to wake a waiting step when it is due to settle rather than on the next sample.
+class SettlePredictor:
+    def __init__(self, target, tolerance=DFLT_TOLERANCE, window=PREDICT_WINDOW):
+        self.target = target
+        self.tolerance = tolerance
+        self.window = window
+        self.samples = deque()
+
+    def add(self, t, value):
+        if self.samples and t <= self.samples[-1][0]:
+            return
+        self.samples.append((t, value))
+        while self.samples[0][0] < t - self.window:
+            self.samples.popleft()
+
+    # predicted time of entering the band, None if already in it, there are too few samples or the fit does not
+    # reach the band within PREDICT_HORIZON seconds
+    def predict(self):
+        if len(self.samples) < MIN_FIT_SAMPLES:
+            return None
+        last, value = self.samples[-1]
+        if abs(value - self.target) <= self.tolerance:
+            return None
+        edge = self.target - self.tolerance if value < self.target else self.target + self.tolerance
+        # normal equations of the fit, in time relative to the last sample
+        s = [0.0]*5
+        y = [0.0]*3
+        for t, v in self.samples:
+            x = t - last
+            xk = 1.0
+            for k in range(5):
+                if k < 3:
+                    y[k] += xk*v
+                s[k] += xk
+                xk *= x
+        coef = solve3([[s[0], s[1], s[2]], [s[1], s[2], s[3]], [s[2], s[3], s[4]]], y)
+        if coef is None:
+            return None
+        a, b, c = coef
+        a -= edge
+        # first root of a + b*x + c*x^2 after the last sample
+        roots = []
+        if abs(c) < 1e-9:
+            if b != 0:
+                roots = [-a/b]
+        else:
+            disc = b*b - 4*c*a
+            if disc >= 0:
+                r = disc**0.5
+                roots = [(-b - r)/(2*c), (-b + r)/(2*c)]
+        roots = [x for x in roots if 0 <= x <= PREDICT_HORIZON]
+        if not roots:
+            return None
+        return last + min(roots)
@@ -35,6 +35,13 @@ provides human pneumonics for the various controller settings, and
 enables set-point values, limits, gains etc to be set directly in deg
 F or deg C.
 
+Failed reads and writes are retried, with a timeout adapted to the
+measured response time, as set by the retry policy (see tc3625_retry).
+Pass retry_policy to share or customise it. Pass transport to talk to
+something other than a TC3625_Serial, e.g. to record or replay traffic
+(see tc3625_journal). Per command latency, error and retry counts are
+kept in dev.stats (see tc3625_stats).
+
 Classes:
   TC3625
   Method
@@ -50,6 +57,8 @@ Functions:
   dec2int
   amp2cnt
   cnt2amp
+  get_method_names
+  add_methods
 
 
 Note: some functions may require special case treatment such as: 
@@ -59,7 +68,12 @@ Author: Will Dickson
 
 -------------------------------------------------------------------
 """
-from tc3625_serial import TC3625_Serial
+from __future__ import print_function
+import json
+import os
+from tc3625_serial import TC3625_Serial, SERIAL_CMDS
+from tc3625_stats import SerialStats
+from tc3625_retry import RetryPolicy, CircuitOpenError
 
 # Default port settings
 DFLT_PORT='/dev/ttyS0'
@@ -67,6 +81,9 @@ DFLT_TIMEOUT=2.0
 DFLT_BAUDRATE=9600
 DFLT_MAX_ATTEMPT=10
 
+# Rated number of eeprom write cycles
+EEPROM_WRITE_LIMIT=1000000
+
 AMPS_PER_COUNT=2.5
 
 # Types and values
@@ -551,6 +568,16 @@ def int2perc(x):
     power_max_int = dec2int(POWER_RANGE[1])
     return 100.0*x/float(power_max_int)
 
+def get_method_names(meth_str):
+    """
+    Return the names of the get and set methods generated for a
+    METHOD_DICT entry, e.g. 'get_input1_offset', 'set_input1_offset'.
+    """
+    meth_stub = ''
+    for s in meth_str.split():
+        meth_stub += '_%s'%(s,)
+    return 'get' + meth_stub, 'set' + meth_stub
+
 def amp2cnt(x):
     """
     Convert amps to counts
@@ -565,7 +592,9 @@ def cnt2amp(x):
     return x*AMPS_PER_COUNT
 
 
-# Classes implementing get and set methods for tc3625 device interface
+# Classes implementing get and set methods for tc3625 device interface.
+# One instance per METHOD_DICT entry is shared by all TC3625 objects, the
+# device is passed in on each call.
 class Get_Type:
     def __init__(self,type,doc_str=None,warning=None):
         self.type=type
@@ -574,16 +603,18 @@ class Get_Type:
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
 
-    def __call__(self):
+    def __call__(self,parent):
         if self.warning != None:
-            print self.warning
-        val =self.parent._get_value(self.cmd)
+            print(self.warning)
+        val =parent._get_value(self.cmd)
+        return self.decode(val)
+
+    def decode(self,val):
         try:
             val_str = self.itype[val]
         except KeyError:
-            raise IOError, 'unknown type %d from %s'%(val, self.call_name,)       
+            raise IOError('unknown type %d from %s'%(val, self.call_name,))
         return val_str
 
 class Get_Mask:
@@ -593,12 +624,14 @@ class Get_Mask:
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
         
-    def __call__(self):
+    def __call__(self,parent):
         if self.warning != None:
-            print self.warning
-        val =self.parent._get_value(self.cmd)
+            print(self.warning)
+        val =parent._get_value(self.cmd)
+        return self.decode(val)
+
+    def decode(self,val):
         flag, val_list = False, []
         for k in self.maskdict:
             bit = self.maskdict[k]
@@ -611,22 +644,24 @@ class Get_Num:
     def __init__(self,convert=None,range=None,doc_str=None,warning=None):
         self.convert=convert
         self.range=range
-        self.__doc=doc_str
+        self.__doc__=doc_str
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
 
-    def __call__(self):
+    def __call__(self,parent):
         if self.warning != None:
-            print self.warning
-        val =self.parent._get_value(self.cmd)
+            print(self.warning)
+        val =parent._get_value(self.cmd)
+        return self.decode(val)
+
+    def decode(self,val):
         if self.convert != None:
             val = self.convert(val)
         if self.range!=None:
             minval, maxval = self.range
             if val < minval or val > maxval:
-                raise IOError, 'value %s out of range from %s'%(str(val),self.call_name,)
+                raise IOError('value %s out of range from %s'%(str(val),self.call_name,))
         return val
               
 class Set_Type:
@@ -636,18 +671,18 @@ class Set_Type:
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
 
-    def __call__(self,val):
+    def __call__(self,parent,val):
         if self.warning != None:
-            print self.warning
+            print(self.warning)
+        parent._set_value(self.cmd,self.encode(val))
 
+    def encode(self,val):
         try:
             val_int = self.type[val]
         except KeyError:
-            raise ValueError, 'unknown type %s for %s'%(str(val), self.call_name,)
-        
-        self.parent._set_value(self.cmd,val_int)
+            raise ValueError('unknown type %s for %s'%(str(val), self.call_name,))
+        return val_int
 
 class Set_Num:
     def __init__(self,convert=None,range=None,doc_str=None,warning=None):
@@ -657,18 +692,20 @@ class Set_Num:
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
 
-    def __call__(self,val):
+    def __call__(self,parent,val):
          if self.warning != None:
-            print self.warning
+            print(self.warning)
+         parent._set_value(self.cmd,self.encode(val))
+
+    def encode(self,val):
          if self.range!=None:
              minval, maxval = self.range
              if val < minval or val > maxval:
-                 raise IOError, 'value %s out of range from %s'%(str(val),self.call_name,)
+                 raise IOError('value %s out of range from %s'%(str(val),self.call_name,))
          if self.convert!=None:
              val = self.convert(val)
-         self.parent._set_value(self.cmd,val)
+         return val
 
 class Set_NoArg:
     def __init__(self,doc_str=None,warning=None):
@@ -676,12 +713,14 @@ class Set_NoArg:
         self.warning=warning
         self.cmd=None
         self.call_name=None
-        self.parent=None
 
-    def __call__(self):
+    def __call__(self,parent):
         if self.warning != None:
-            print self.warning
-        self.parent._set_value(self.cmd,0)
+            print(self.warning)
+        parent._set_value(self.cmd,self.encode())
+
+    def encode(self,val=None):
+        return 0
         
        
 METHOD_DICT = {
@@ -1080,11 +1119,28 @@ METHOD_DICT = {
         },    
 }
 
+EEPROM_CMD=METHOD_DICT['eeprom write']['cmd']
+
 class TC3625:
     """
     High level python API for the TC-36-25 thermoelectric cooler
     temperature contollers.
+
+    The last value written to or read from each register is kept in
+    self.cache, keyed by serial command. As eeprom writes are disabled
+    by default the controller only changes its settings when told to,
+    so the cache can be used to skip writes which would not change
+    anything (set_if_changed, apply_profile). It is cleared whenever
+    the connection is opened. Writes made while eeprom writes are on
+    are counted in self.eeprom_writes, which is kept in the file
+    eeprom_log if given.
+
+    The get_*/set_* methods are generated once for the class from
+    METHOD_DICT (see add_methods), so any number of devices can be
+    open at the same time.
     """
+    method_dict=METHOD_DICT
+
     def __init__(self, 
                  port=DFLT_PORT, 
                  timeout=DFLT_TIMEOUT,
@@ -1092,98 +1148,266 @@ class TC3625:
                  max_attempt=DFLT_MAX_ATTEMPT,
                  open=True,
                  eeprom='off',
+                 retry_policy=None,
+                 transport=None,
+                 eeprom_log=None,
                  ):
         self.port=port
+        self.transport=transport
+        self.cache={}
+        self.eeprom_log=eeprom_log
+        self.eeprom_writes=0
+        self.eeprom_profile=None
+        self.load_eeprom_log()
         self.timeout=timeout
         self.baudrate=baudrate
         self.max_attempt=max_attempt 
+        if retry_policy is None:
+            retry_policy=RetryPolicy(max_attempt=max_attempt,max_timeout=timeout)
+        self.retry_policy=retry_policy
         # Open serial connection
         if open==True:
             flag = self.open()
             if flag==False:
-                raise IOError, 'unable to open device'
-      
-        # Generate methods
-        self.method_dict=METHOD_DICT
-        for meth_str in self.method_dict:
-            meth_stub = ''
-            for s in meth_str.split():
-                meth_stub += '_%s'%(s,)
-            cmd = self.method_dict[meth_str]['cmd']
-            get_str = 'get' + meth_stub
-            set_str = 'set' + meth_stub 
-            try:
-                get_method = self.method_dict[meth_str]['get']
-                get_method.cmd = cmd
-                get_method.call_name = get_str
-                get_method.parent = self
-                setattr(self,get_str,get_method)
-            except:
-                pass
-            try: 
-                set_method = self.method_dict[meth_str]['set']
-                set_method.cmd = cmd
-                set_method.parent = self
-                set_method.call_name = set_str
-                setattr(self,set_str,set_method)
-            except:
-                pass
+                raise IOError('unable to open device')
 
         if eeprom=='off':
             self.set_eeprom_write('off')
 
     def set_by_dict(self,prop_new):
         """
-        Set deivce properties using dictionary
+        Set deivce properties using dictionary. All values are checked
+        before anything is written and the writes are sent as a single
+        pipelined transaction, in the iteration order of prop_new (use
+        an OrderedDict if the order matters). Writes which fail are
+        retried individually.
         """
-        method_keys = self.method_dict.keys()
+        batch = []
         for k in prop_new.keys():
-            if not k in method_keys:
-                raise ValueError, 'unknown property %s'%(k,)
-            self.set(k,prop_new[k])
+            if not k in self.method_dict:
+                raise ValueError('unknown property %s'%(k,))
+            try:
+                set_method = self.method_dict[k]['set']
+            except KeyError:
+                raise ValueError('unsettable property %s'%(str(k),))
+            batch.append((set_method.cmd, set_method.encode(prop_new[k])))
+        results = self._transact(batch)
+        for (cmd,val), ret in zip(batch,results):
+            if isinstance(ret,IOError):
+                self.stats.retried(cmd,1)
+                self._set_value(cmd,val)
+
+    def set_if_changed(self,prop_str,val):
+        """
+        Set device property unless the cache shows that it already has
+        the value. Returns True if the value was written.
+        """
+        try:
+            set_method = self.method_dict[prop_str]['set']
+        except KeyError:
+            raise ValueError('unknown or unsettable property %s'%(str(prop_str),))
+        val_int = set_method.encode(val)
+        if self.cache.get(set_method.cmd) == val_int:
+            return False
+        self._set_value(set_method.cmd,val_int)
+        return True
+
+    def apply_profile(self,profile,persist=False):
+        """
+        Bring the device to the settings in the dictionary profile.
+        All profile registers are read back in one pipelined sweep and
+        only those which differ are written, in the iteration order of
+        profile. Each write is verified against the value echoed by the
+        controller. Returns the list of properties written.
+
+        If persist is True the whole profile is also written to eeprom,
+        so that the controller powers up with it, unless that profile
+        is already recorded as persisted in the eeprom log. Raises
+        IOError if this would exceed EEPROM_WRITE_LIMIT.
+        """
+        batch = []
+        targets = {}
+        for k in profile.keys():
+            if not k in self.method_dict:
+                raise ValueError('unknown property %s'%(k,))
+            if not 'set' in self.method_dict[k]:
+                raise ValueError('unsettable property %s'%(str(k),))
+            if not 'get' in self.method_dict[k]:
+                raise ValueError('unreadable property %s'%(str(k),))
+            set_method = self.method_dict[k]['set']
+            cmd, val = set_method.cmd, set_method.encode(profile[k])
+            if targets.get(cmd,val) != val:
+                raise ValueError('conflicting values for %s'%(cmd,))
+            if not cmd in targets:
+                batch.append((k,cmd,val))
+            targets[cmd] = val
+        # Read back current settings
+        results = self._transact([(cmd,None) for k, cmd, val in batch])
+        writes = []
+        for (k,cmd,val), ret in zip(batch,results):
+            if isinstance(ret,IOError):
+                self.stats.retried(cmd,1)
+                ret = self._get_value(cmd)
+            if ret != val:
+                writes.append((k,cmd,val))
+        # Write and verify the differences
+        self._write_verified(writes)
+        if persist:
+            key = sorted(targets.items())
+            if self.eeprom_profile != key:
+                self.persist(batch)
+                self.eeprom_profile = key
+                self.save_eeprom_log()
+        return [k for k, cmd, val in writes]
+
+    def persist(self,batch):
+        """
+        Write the (prop, cmd, val) settings in batch to eeprom, eeprom
+        writes are turned off again afterwards.
+        """
+        if self.eeprom_writes+len(batch) > EEPROM_WRITE_LIMIT:
+            raise IOError('eeprom write limit reached, %d writes made'%(self.eeprom_writes,))
+        self.set_eeprom_write('on')
+        try:
+            self._write_verified(batch)
+        finally:
+            self.set_eeprom_write('off')
+
+    def _write_verified(self,batch):
+        """
+        Write the (prop, cmd, val) settings in batch as a pipelined
+        transaction, retrying failures, and check the echoed values.
+        """
+        if len(batch) == 0:
+            return
+        results = self._transact([(cmd,val) for k, cmd, val in batch])
+        for (k,cmd,val), ret in zip(batch,results):
+            if isinstance(ret,IOError):
+                self.stats.retried(cmd,1)
+                ret = self._set_value(cmd,val)
+            if ret != val:
+                self.cache.pop(cmd,None)
+                raise IOError('%s verification failed, wrote %d read %d'%(k,val,ret))
+
+    def load_eeprom_log(self):
+        """ Load eeprom write count and persisted profile """
+        if self.eeprom_log is None or not os.path.exists(self.eeprom_log):
+            return
+        with open(self.eeprom_log,'r') as f:
+            log = json.load(f)
+        self.eeprom_writes = log['writes']
+        if log['profile'] is not None:
+            self.eeprom_profile = [tuple(x) for x in log['profile']]
+
+    def save_eeprom_log(self):
+        """ Save eeprom write count and persisted profile """
+        if self.eeprom_log is None:
+            return
+        with open(self.eeprom_log,'w') as f:
+            json.dump({'writes':self.eeprom_writes,'profile':self.eeprom_profile},f)
+
+    def cached(self,prop_str):
+        """
+        Return the cached value of a device property, or None if not
+        known.
+        """
+        get_method = self.method_dict[prop_str]['get']
+        try:
+            return get_method.decode(self.cache[get_method.cmd])
+        except KeyError:
+            return None
 
     def set(self,prop_str,val):
         """
         Set device property by name value pair
         """
         if not prop_str in self.method_dict.keys():
-            raise ValueError, 'unknown property %s'%(str(prop_str),)
+            raise ValueError('unknown property %s'%(str(prop_str),))
         try:
             set_method = self.method_dict[prop_str]['set']
         except KeyError:
-            raise ValueError, 'unsettable property %s'%(str(prop_str,))
+            raise ValueError('unsettable property %s'%(str(prop_str,)))
         set_method(val)
             
     def get_all(self):
         """
-        Get all device properties
+        Get all device properties. Each register is read once in a
+        single pipelined transaction, reads which fail are retried
+        individually.
         """
+        cmd_list = []
+        for k in self.method_dict:
+            try:
+                get_method = self.method_dict[k]['get']
+            except KeyError:
+                continue
+            if not get_method.cmd in cmd_list:
+                cmd_list.append(get_method.cmd)
+        results = self._transact([(cmd,None) for cmd in cmd_list])
+        vals = {}
+        for cmd, ret in zip(cmd_list,results):
+            if isinstance(ret,IOError):
+                self.stats.retried(cmd,1)
+                ret = self._get_value(cmd)
+            vals[cmd] = ret
         prop={}
         for k in self.method_dict:
             try:
                 get_method = self.method_dict[k]['get']
-            except:
+            except KeyError:
                 continue
-            prop[k]=get_method()
+            prop[k]=get_method.decode(vals[get_method.cmd])
         return prop
 
+    def get_by_list(self,prop_list):
+        """
+        Get the listed device properties in a single pipelined
+        transaction, reads which fail are retried individually.
+        Returns a list of values in the order of prop_list.
+        """
+        get_list = []
+        for k in prop_list:
+            if not k in self.method_dict:
+                raise ValueError('unknown property %s'%(k,))
+            try:
+                get_list.append(self.method_dict[k]['get'])
+            except KeyError:
+                raise ValueError('unreadable property %s'%(str(k),))
+        results = self._transact([(get_method.cmd,None) for get_method in get_list])
+        vals = []
+        for get_method, ret in zip(get_list,results):
+            if isinstance(ret,IOError):
+                self.stats.retried(get_method.cmd,1)
+                ret = self._get_value(get_method.cmd)
+            vals.append(get_method.decode(ret))
+        return vals
+
     def print_all(self):
         """
         Print all device properties
         """
         prop = self.get_all()
-        prop_keys = prop.keys()
-        prop_keys.sort()
+        prop_keys = sorted(prop.keys())
         for k in prop_keys:
-            print '%s: %s'%(k, prop[k])
+            print('%s: %s'%(k, prop[k]))
 
     def open(self):
         """ 
         Open serial connection to device. Note, by defualt the serial
         connection to the device is automatically open on
-        initialization.
+        initialization. If a transport was given, e.g. a journal
+        recording or replay transport, it is used instead of a
+        TC3625_Serial on port.
         """
-        self.dev = TC3625_Serial(port=self.port)
+        self.cache = {}
+        if self.transport is None:
+            self.dev = TC3625_Serial(port=self.port,timeout=self.timeout)
+        else:
+            self.dev = self.transport
+        # Per command latency, error and retry counts, see tc3625_stats
+        self.stats = getattr(self.dev,'stats',None)
+        if self.stats is None:
+            self.stats = SerialStats(SERIAL_CMDS,self.baudrate)
         flag = self.dev.open()
         return flag
         
@@ -1194,39 +1418,101 @@ class TC3625:
 
     def _get_value(self,cmd): 
         """ 
-        Generic get commmand - tries max_attempt times to read value
-        from device using low level serial protocol.
+        Generic get commmand - reads value from device using low level
+        serial protocol, failed reads are retried as set by the retry
+        policy.
         """
-        cnt=0
-        while cnt < self.max_attempt:
-            try:
-                val = self.dev.read(cmd)
-                break
-            except IOError:
-                print '** warning IOError on read'
-                pass
-            cnt+=1
-        if cnt==self.max_attempt:
-            raise IOError, 'max attempts reached for read'
+        op = self.retry_policy.begin()
+        try:
+            val = self.retry_policy.run(op,self.dev,self.dev.read,cmd)
+        finally:
+            self.stats.retried(cmd,op.retries)
+        self.cache[cmd] = val
         return val
                 
+    def _transact(self,batch):
+        """
+        Generic pipelined command - sends the (cmd,val) pairs in batch
+        to the device in one transaction, val=None for a read. Returns
+        a list of values or IOErrors, one per pair. 
+        """
+        if self.retry_policy.is_open():
+            return [CircuitOpenError('circuit breaker open')]*len(batch)
+        self.dev.timeout = self.retry_policy.rto
+        try:
+            results = self.dev.transact(batch)
+        except (IOError,OSError) as err:
+            results = [err]*len(batch)
+        for (cmd,val), ret in zip(batch,results):
+            self._update_cache(cmd,val,ret)
+        return results
+
+    def _update_cache(self,cmd,val,ret):
+        """
+        Update the register cache with the outcome ret of reading
+        (val=None) or writing cmd, and count eeprom writes.
+        """
+        if isinstance(ret,(IOError,OSError)):
+            # The state after a failed write is unknown
+            if val is not None:
+                self.cache.pop(cmd,None)
+            return
+        if val is not None and cmd != EEPROM_CMD:
+            if self.cache.get(EEPROM_CMD) == ON_OFF_TYPES['on']:
+                self.eeprom_writes += 1
+                self.save_eeprom_log()
+        self.cache[cmd] = ret
+
     def _set_value(self,cmd,val):
         """
-        Generic set command - tries max_attempt times to set device
-        value using low level serial protocol.
+        Generic set command - writes value to device using low level
+        serial protocol, failed writes are retried as set by the retry
+        policy.
         """
-        cnt=0
-        while cnt < self.max_attempt:
+        try:
+            op = self.retry_policy.begin()
             try:
-                val = self.dev.write(cmd,val)
-                break
-            except IOError:
-                print '** warning IOError on write'
-                pass
-            cnt+=1
-        if cnt==self.max_attempt:
-            raise IOError, 'max attempts reached for write'
-        return val
+                ret = self.retry_policy.run(op,self.dev,self.dev.write,cmd,val)
+            finally:
+                self.stats.retried(cmd,op.retries)
+        except (IOError,OSError) as err:
+            self._update_cache(cmd,val,err)
+            raise
+        self._update_cache(cmd,val,ret)
+        return ret
+
+
+def make_method(method,name):
+    """
+    Return a function calling the shared get or set object method with
+    the device as its first argument, for use as a TC3625 method.
+    """
+    def call(self,*args):
+        return method(self,*args)
+    call.__doc__=method.__doc__
+    call.__name__=name
+    return call
+
+def add_methods(cls,method_dict):
+    """
+    Generate the get_*/set_* methods of cls for each method_dict entry,
+    e.g. get_input1 and set_setpt.
+    """
+    for meth_str in method_dict:
+        cmd = method_dict[meth_str]['cmd']
+        get_str, set_str = get_method_names(meth_str)
+        if 'get' in method_dict[meth_str]:
+            get_method = method_dict[meth_str]['get']
+            get_method.cmd = cmd
+            get_method.call_name = get_str
+            setattr(cls,get_str,make_method(get_method,get_str))
+        if 'set' in method_dict[meth_str]:
+            set_method = method_dict[meth_str]['set']
+            set_method.cmd = cmd
+            set_method.call_name = set_str
+            setattr(cls,set_str,make_method(set_method,set_str))
+
+add_methods(TC3625,METHOD_DICT)
 
 # --------------------------------------------------------------------
 
@@ -0,0 +1,449 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: asyncio versions of the TC3625_Serial and TC3625 interfaces
+(Python 3 only).
+
+The serial port is opened with pyserial, which leaves the file
+descriptor in non-blocking mode, and is then serviced directly by the
+event loop with add_reader. Requests on the same device are serialized
+by an asyncio.Lock, so a single event loop can drive any number of
+controllers without a thread per port. Coroutines may also share one
+device: each operation has its own retry state (see
+tc3625_retry.Operation) and passes its response timeout to the
+transaction rather than setting it on the device.
+
+AsyncTC3625 has the same get_*/set_* methods as TC3625, generated from
+METHOD_DICT, except that they are coroutines.
+
+Classes:
+  AsyncTC3625_Serial
+  AsyncTC3625
+
+Usage:
+
+  async def main():
+      dev = AsyncTC3625(port)
+      await dev.open()
+      await dev.set_setpt(37.0)
+      temp = await dev.get_input1()
+      dev.close()
+
+  asyncio.run(main())
+
+------------------------------------------------------------------------
+"""
+import asyncio
+import os
+
+import serial
+
+from tc3625_serial import SERIAL_CMDS, ADDRESS, RETURN_SIZE
+from tc3625_serial import DFLT_PIPELINE_DEPTH, DFLT_INTERBYTE_TIMEOUT
+from tc3625_codec import ResponseTimeout
+from tc3625_stats import SerialStats
+from tc3625_codec import get_codec, FrameParser
+from tc3625 import METHOD_DICT, get_method_names
+from tc3625_retry import RetryPolicy, CircuitOpenError, give_up
+from tc3625 import DFLT_PORT, DFLT_TIMEOUT, DFLT_BAUDRATE, DFLT_MAX_ATTEMPT
+
+
+class AsyncTC3625_Serial:
+
+    """
+    Low level serial protocol for the TC3625 on an asyncio event loop.
+    """
+
+    def __init__(self,
+                 port=DFLT_PORT,
+                 timeout=DFLT_TIMEOUT,
+                 baud_rate=DFLT_BAUDRATE,
+                 interbyte_timeout=DFLT_INTERBYTE_TIMEOUT,
+                 ):
+        self.port=port
+        self.timeout=timeout
+        self.baud_rate=baud_rate
+        self.interbyte_timeout=interbyte_timeout
+        self.address=ADDRESS
+        self.serial_cmds=SERIAL_CMDS
+        self.codec=get_codec(self.serial_cmds,self.address)
+        self.parser=FrameParser(self.codec)
+        self.serial=None
+        self.fd=None
+        self.loop=None
+        self.lock=None
+        self.rx_waiter=None
+        self.send_time=None
+        self.rtt=None
+        self.stats=SerialStats(self.serial_cmds,self.baud_rate)
+
+    async def open(self):
+        """ Open serial port and register it with the running loop """
+        if self.lock is None:
+            self.lock=asyncio.Lock()
+        async with self.lock:
+            return self.open_port()
+
+    async def reopen(self):
+        """
+        Close and reopen the serial port, e.g. after a USB adapter
+        reset. Done under the device lock, so that no transaction is in
+        progress meanwhile. Raises IOError if the port can't be opened,
+        the device is then left closed.
+        """
+        async with self.lock:
+            self.close()
+            return self.open_port()
+
+    def open_port(self):
+        """ Open serial port, call with the lock held """
+        self.serial = serial.Serial(
+            self.port,
+            timeout = 0,
+            write_timeout = 0,
+            bytesize=serial.EIGHTBITS,
+            baudrate=self.baud_rate,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            xonxoff=0,
+            rtscts=0,
+            )
+        self.fd=self.serial.fileno()
+        self.loop=asyncio.get_running_loop()
+        self.loop.add_reader(self.fd,self.on_readable)
+        return self.serial.isOpen()
+
+    def close(self):
+        """ Close serial port """
+        if self.fd != None:
+            self.loop.remove_reader(self.fd)
+            self.fd=None
+        if self.serial != None:
+            self.serial.close()
+
+    async def write(self, cmd, val, timeout=None):
+        """
+        Generic write command, see TC3625_Serial.write. timeout is the
+        response timeout, self.timeout if None.
+        """
+        ret=await self.transact([(cmd,val)],timeout=timeout)
+        if isinstance(ret[0],IOError):
+            raise ret[0]
+        return ret[0]
+
+    async def read(self, cmd, timeout=None):
+        """
+        Generic read command, see TC3625_Serial.read. timeout is the
+        response timeout, self.timeout if None.
+        """
+        ret=await self.transact([(cmd,None)],timeout=timeout)
+        if isinstance(ret[0],IOError):
+            raise ret[0]
+        return ret[0]
+
+    async def transact(self, requests, depth=DFLT_PIPELINE_DEPTH, timeout=None):
+        """
+        Pipelined multi-command transaction, see TC3625_Serial.transact.
+        Returns a list of values or IOErrors, one per request. timeout
+        is the response timeout, self.timeout if None; it is passed per
+        call so that coroutines sharing the device don't change each
+        other's.
+        """
+        if timeout is None:
+            timeout=self.timeout
+        requests=list(requests)
+        send_list=[]
+        for cmd, val in requests:
+            if val is None:
+                send_list.append(self.codec.read_frame(cmd))
+            else:
+                buf=bytearray(16)
+                self.codec.encode_write(buf,0,cmd,val)
+                send_list.append(bytes(buf))
+        depth=max(1,int(depth))
+        results=[]
+        async with self.lock:
+            if self.fd == None:
+                return [IOError('serial port %s is not open'%(self.port,))]*len(requests)
+            for i in range(0,len(send_list),depth):
+                burst=send_list[i:i+depth]
+                t_send=self.loop.time()
+                self.parser.reset()
+                try:
+                    await self.send(b''.join(burst))
+                    burst_results=await self.receive(len(burst),timeout)
+                except (IOError,OSError) as err:
+                    burst_results=[err]*len(burst)
+                latency=(self.loop.time()-t_send)/len(burst)
+                for (cmd,val), frame, ret in zip(requests[i:i+depth],burst,burst_results):
+                    self.stats.record(cmd,len(frame),ret,latency)
+                results.extend(burst_results)
+        return results
+
+    async def send(self, data):
+        """ Write data to the port without blocking the loop """
+        self.rtt=None
+        view=memoryview(data)
+        while len(view) > 0:
+            try:
+                num=os.write(self.fd,view)
+            except BlockingIOError:
+                num=0
+            view=view[num:]
+            if len(view) > 0:
+                writable=self.loop.create_future()
+                self.loop.add_writer(self.fd,writable.set_result,None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+        self.send_time=self.loop.time()
+
+    async def receive(self, num, timeout=None):
+        """
+        Receive the responses to the last num commands sent, see
+        TC3625_Serial.receive. Returns a list of num values or IOErrors.
+        """
+        if timeout is None:
+            timeout=self.timeout
+        parser=self.parser
+        discarded=parser.discarded
+        results=[]
+        deadline=self.loop.time()+timeout
+        while len(results) < num:
+            ret=parser.next()
+            if ret is not None:
+                results.append(ret)
+                deadline=self.loop.time()+timeout
+                continue
+            if parser.pending() > 0:
+                # in the middle of a frame
+                wait=self.interbyte_timeout
+            else:
+                wait=deadline-self.loop.time()
+                if wait <= 0:
+                    break
+            self.rx_waiter=self.loop.create_future()
+            try:
+                await asyncio.wait_for(self.rx_waiter,wait)
+            except asyncio.TimeoutError:
+                break
+            finally:
+                self.rx_waiter=None
+        missing=num-len(results)
+        if missing == 0:
+            return results
+        if len(results) == 0 and parser.pending() == 0 and parser.discarded == discarded:
+            err=ResponseTimeout('no response within timeout %.3f s'%(timeout,))
+        else:
+            err=ResponseTimeout('incomplete response, %d of %d frames received'%(len(results),num))
+        if num > 1 and parser.discarded != discarded:
+            return [err]*num
+        return results+[err]*missing
+
+    def on_readable(self):
+        try:
+            data=os.read(self.fd,4096)
+        except BlockingIOError:
+            return
+        except OSError as err:
+            if self.rx_waiter != None and not self.rx_waiter.done():
+                self.rx_waiter.set_exception(IOError(str(err)))
+            return
+        if self.rtt is None and self.send_time is not None:
+            self.rtt=self.loop.time()-self.send_time
+        self.parser.feed(data)
+        if self.rx_waiter != None and not self.rx_waiter.done():
+            self.rx_waiter.set_result(None)
+
+
+class AsyncTC3625:
+    """
+    asyncio version of the TC3625 high level API. The get_*/set_*
+    methods are coroutines.
+    """
+    def __init__(self,
+                 port=DFLT_PORT,
+                 timeout=DFLT_TIMEOUT,
+                 baudrate=DFLT_BAUDRATE,
+                 max_attempt=DFLT_MAX_ATTEMPT,
+                 eeprom='off',
+                 retry_policy=None,
+                 ):
+        self.port=port
+        self.timeout=timeout
+        self.baudrate=baudrate
+        self.max_attempt=max_attempt
+        self.eeprom=eeprom
+        if retry_policy is None:
+            retry_policy=RetryPolicy(max_attempt=max_attempt,max_timeout=timeout)
+        self.retry_policy=retry_policy
+        self.method_dict=METHOD_DICT
+        self.dev=None
+
+    async def open(self):
+        """ Open serial connection to device """
+        self.dev=AsyncTC3625_Serial(port=self.port,timeout=self.timeout,baud_rate=self.baudrate)
+        flag=await self.dev.open()
+        if flag==False:
+            raise IOError('unable to open device')
+        if self.eeprom=='off':
+            await self.set_eeprom_write('off')
+        return flag
+
+    def close(self):
+        """ Close serial conection to device """
+        self.dev.close()
+
+    async def set_by_dict(self,prop_new):
+        """
+        Set device properties using dictionary, see TC3625.set_by_dict.
+        """
+        batch=[]
+        for k in prop_new.keys():
+            if not k in self.method_dict:
+                raise ValueError('unknown property %s'%(k,))
+            try:
+                set_method=self.method_dict[k]['set']
+            except KeyError:
+                raise ValueError('unsettable property %s'%(str(k),))
+            batch.append((self.method_dict[k]['cmd'],set_method.encode(prop_new[k])))
+        results=await self._transact(batch)
+        for (cmd,val), ret in zip(batch,results):
+            if isinstance(ret,IOError):
+                await self._set_value(cmd,val)
+
+    async def get_all(self):
+        """
+        Get all device properties, see TC3625.get_all.
+        """
+        cmd_list=[]
+        for k in self.method_dict:
+            if 'get' in self.method_dict[k]:
+                cmd=self.method_dict[k]['cmd']
+                if not cmd in cmd_list:
+                    cmd_list.append(cmd)
+        results=await self._transact([(cmd,None) for cmd in cmd_list])
+        vals={}
+        for cmd, ret in zip(cmd_list,results):
+            if isinstance(ret,IOError):
+                ret=await self._get_value(cmd)
+            vals[cmd]=ret
+        prop={}
+        for k in self.method_dict:
+            if 'get' in self.method_dict[k]:
+                get_method=self.method_dict[k]['get']
+                prop[k]=get_method.decode(vals[self.method_dict[k]['cmd']])
+        return prop
+
+    async def _get_value(self,cmd):
+        """
+        Generic get commmand, failed reads are retried as set by the
+        retry policy.
+        """
+        op=self.retry_policy.begin()
+        try:
+            return await self._retry(op,self.dev.read,cmd)
+        finally:
+            self.dev.stats.retried(cmd,op.retries)
+
+    async def _set_value(self,cmd,val):
+        """
+        Generic set command, failed writes are retried as set by the
+        retry policy.
+        """
+        op=self.retry_policy.begin()
+        try:
+            return await self._retry(op,self.dev.write,cmd,val)
+        finally:
+            self.dev.stats.retried(cmd,op.retries)
+
+    async def _transact(self,batch):
+        """
+        Generic pipelined command, see TC3625._transact.
+        """
+        if self.retry_policy.is_open():
+            return [CircuitOpenError('circuit breaker open')]*len(batch)
+        try:
+            return await self.dev.transact(batch,timeout=self.retry_policy.rto)
+        except (IOError,OSError) as err:
+            return [err]*len(batch)
+
+    async def _retry(self,op,func,*args):
+        """
+        Run the coroutine function func(*args) as operation op of the
+        retry policy, see RetryPolicy.run.
+        """
+        policy=self.retry_policy
+        try:
+            while True:
+                try:
+                    val=await func(*args,timeout=policy.timeout(op))
+                except (IOError,OSError) as err:
+                    kind, delay=policy.failure(op,err)
+                    if delay is None:
+                        raise give_up(err,op.attempt)
+                    if kind == 'port':
+                        # a failed reopen leaves the port closed, and the
+                        # next attempt fails with a port error
+                        try:
+                            await self.dev.reopen()
+                        except (IOError,OSError):
+                            pass
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    continue
+                policy.success(op,self.dev.rtt)
+                return val
+        except BaseException:
+            # e.g. cancelled, don't leave the circuit breaker half open
+            if op.trial:
+                policy.abandon(op)
+            raise
+
+
+def _make_get(get_method,cmd):
+    async def get(self):
+        if get_method.warning != None:
+            print(get_method.warning)
+        return get_method.decode(await self._get_value(cmd))
+    get.__doc__=get_method.__doc__
+    return get
+
+def _make_set(set_method,cmd):
+    async def set(self,*args):
+        if set_method.warning != None:
+            print(set_method.warning)
+        await self._set_value(cmd,set_method.encode(*args))
+    set.__doc__=set_method.__doc__
+    return set
+
+# Generate the coroutine get_*/set_* methods
+for _meth_str in METHOD_DICT:
+    _get_str, _set_str = get_method_names(_meth_str)
+    _cmd = METHOD_DICT[_meth_str]['cmd']
+    if 'get' in METHOD_DICT[_meth_str]:
+        setattr(AsyncTC3625,_get_str,_make_get(METHOD_DICT[_meth_str]['get'],_cmd))
+    if 'set' in METHOD_DICT[_meth_str]:
+        setattr(AsyncTC3625,_set_str,_make_set(METHOD_DICT[_meth_str]['set'],_cmd))
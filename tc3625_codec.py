@@ -0,0 +1,291 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: bytes native frame codec for the TC-36-25 serial protocol.
+
+The send strings for all read commands are fixed, so they are computed
+once per (command table, address) and shared. Write frames are encoded
+into a caller supplied bytearray using lookup tables for the hex digits
+and the checksum, and responses are decoded in place from any buffer
+whose items are integers (bytearray, or bytes/memoryview on Python 3)
+without creating intermediate strings.
+
+Classes:
+  ChecksumError
+  NakError
+  ResponseTimeout
+  FrameCodec
+  FrameParser
+
+Functions:
+  get_codec
+  classify
+
+Usage:
+
+  codec = get_codec(SERIAL_CMDS, '00')
+
+  # Read frame, immutable bytes
+  frame = codec.read_frame(cmd_str)
+
+  # Encode write frame into buf at offset, returns new offset
+  buf = bytearray(WRITE_FRAME_SIZE)
+  pos = codec.encode_write(buf, 0, cmd_str, val)
+
+  # Decode response starting at offset of buf
+  val = codec.decode(buf, 0)
+
+  # Decode a stream of responses, resynchronizing on framing errors
+  parser = FrameParser(codec)
+  parser.feed(data)
+  val = parser.next()
+
+------------------------------------------------------------------------
+"""
+
+# Protocol bytes
+STX_BYTE=0x2a
+ETX_BYTE=0x0d
+ACK_BYTE=0x5e
+NAK_BYTE=ord('X')
+STX=b'*'
+
+READ_FRAME_SIZE=8
+WRITE_FRAME_SIZE=16
+RETURN_FRAME_SIZE=12
+DATA_SIZE=8
+
+# Lookup tables: nibble -> ascii hex digit and ascii byte -> nibble (-1
+# for bytes which are not hex digits).
+HEX_DIGITS=bytearray(b'0123456789abcdef')
+HEX_VALUES=[-1]*256
+for _i, _c in enumerate(bytearray(b'0123456789abcdef')):
+    HEX_VALUES[_c]=_i
+for _i, _c in enumerate(bytearray(b'ABCDEF')):
+    HEX_VALUES[_c]=10+_i
+
+# Hex digits of the low byte of a checksum, as a pair of ascii bytes
+CHECKSUM_DIGITS=[(HEX_DIGITS[i>>4],HEX_DIGITS[i&0xf]) for i in range(256)]
+
+NAK_DATA=bytearray([NAK_BYTE]*DATA_SIZE)
+
+
+class ChecksumError(IOError):
+    """ Return string corrupted, checksum mismatch or non hex data """
+    pass
+
+class NakError(IOError):
+    """ Controller rejected the checksum of the sent string """
+    pass
+
+class ResponseTimeout(IOError):
+    """ No response, or an incomplete one, within the timeout """
+    pass
+
+
+def classify(err):
+    """
+    Return the failure class of an exception raised by a read or
+    write: 'checksum', 'nak', 'timeout' or 'port'.
+    """
+    if isinstance(err,ChecksumError):
+        return 'checksum'
+    if isinstance(err,NakError):
+        return 'nak'
+    if isinstance(err,ResponseTimeout):
+        return 'timeout'
+    return 'port'
+
+
+class FrameCodec:
+
+    """
+    Frame encoder/decoder for a given command table and address. Use
+    get_codec to share instances.
+    """
+
+    def __init__(self,serial_cmds,address):
+        self.address=address
+        addr=bytearray(address.encode('ascii'))
+        self.read_frames={}
+        self.write_prefix={}
+        self.write_prefix_sum={}
+        for cmd, cmd_dict in serial_cmds.items():
+            if cmd_dict['read'] != None:
+                body=addr+bytearray(cmd_dict['read'].encode('ascii'))
+                cs=CHECKSUM_DIGITS[sum(body)&0xff]
+                frame=bytearray([STX_BYTE])+body+bytearray(cs)+bytearray([ETX_BYTE])
+                self.read_frames[cmd]=bytes(frame)
+            if cmd_dict['write'] != None:
+                body=addr+bytearray(cmd_dict['write'].encode('ascii'))
+                self.write_prefix[cmd]=bytes(bytearray([STX_BYTE])+body)
+                self.write_prefix_sum[cmd]=sum(body)
+
+    def read_frame(self,cmd):
+        """
+        Return the send string for reading cmd.
+        """
+        try:
+            return self.read_frames[cmd]
+        except KeyError:
+            raise ValueError('read unsupported for command %s'%(cmd,))
+
+    def encode_write(self,buf,pos,cmd,val):
+        """
+        Encode the send string for writing the signed integer val to
+        cmd into buf[pos:pos+WRITE_FRAME_SIZE]. Returns the position
+        following the frame.
+        """
+        try:
+            prefix=self.write_prefix[cmd]
+        except KeyError:
+            raise ValueError('write unsupported for command %s'%(cmd,))
+        cs=self.write_prefix_sum[cmd]
+        buf[pos:pos+5]=prefix
+        x=int(val)&0xffffffff
+        i=pos+12
+        while i > pos+4:
+            c=HEX_DIGITS[x&0xf]
+            buf[i]=c
+            cs+=c
+            x>>=4
+            i-=1
+        hi, lo=CHECKSUM_DIGITS[cs&0xff]
+        buf[pos+13]=hi
+        buf[pos+14]=lo
+        buf[pos+15]=ETX_BYTE
+        return pos+WRITE_FRAME_SIZE
+
+    def decode(self,buf,pos=0):
+        """
+        Decode the response in buf[pos:pos+RETURN_FRAME_SIZE] and
+        return the signed integer value. Raises ChecksumError on checksum
+        mismatch and NakError if the controller rejected the sent
+        checksum.
+        """
+        val=0
+        cs=0
+        nak=True
+        for i in range(pos+1,pos+1+DATA_SIZE):
+            c=buf[i]
+            cs+=c
+            if c != NAK_BYTE:
+                nak=False
+            n=HEX_VALUES[c]
+            val=(val<<4)|n
+        cs_hi=HEX_VALUES[buf[pos+9]]
+        cs_lo=HEX_VALUES[buf[pos+10]]
+        if cs_hi < 0 or cs_lo < 0 or (cs_hi<<4|cs_lo) != cs&0xff:
+            cs_ret=''.join([chr(c) for c in bytearray(buf[pos+9:pos+11])])
+            raise ChecksumError('return checksum %s does not match calculated %02x'%(cs_ret,cs&0xff))
+        if nak:
+            raise NakError('sent checksum incorrect')
+        if val < 0:
+            raise ChecksumError('non hex data in return string')
+        if val >= 0x80000000:
+            val-=0x100000000
+        return val
+
+
+class FrameParser:
+
+    """
+    Incremental parser for the controller's return strings.
+
+    Bytes are fed in as they arrive and complete frames are taken out
+    with next(). The parser scans for (stx), checks that the frame has
+    the right length and ends with (ack) and drops any bytes which can
+    not be part of a frame. As (stx) never occurs inside a valid frame,
+    a truncated frame is detected, and discarded, as soon as the next
+    (stx) arrives, so a dropped or extra byte costs only the frame it
+    hit. The number of bytes discarded is counted in self.discarded.
+    """
+
+    def __init__(self,codec):
+        self.codec=codec
+        self.buf=bytearray()
+        self.discarded=0
+
+    def reset(self):
+        """ Discard any buffered bytes """
+        self.discarded+=len(self.buf)
+        del self.buf[:]
+
+    def feed(self,data):
+        """ Add received bytes """
+        self.buf.extend(data)
+
+    def pending(self):
+        """ Number of bytes buffered """
+        return len(self.buf)
+
+    def next(self):
+        """
+        Return the value of the next complete frame, or the IOError
+        raised decoding it, or None if no complete frame is buffered.
+        """
+        buf=self.buf
+        while True:
+            start=buf.find(STX)
+            if start < 0:
+                self.discarded+=len(buf)
+                del buf[:]
+                return None
+            if start > 0:
+                self.discarded+=start
+                del buf[:start]
+            end=buf.find(STX,1,RETURN_FRAME_SIZE)
+            if end > 0:
+                # truncated frame, resync to the following stx
+                self.discarded+=end
+                del buf[:end]
+                continue
+            if len(buf) < RETURN_FRAME_SIZE:
+                return None
+            if buf[RETURN_FRAME_SIZE-1] != ACK_BYTE:
+                self.discarded+=1
+                del buf[:1]
+                continue
+            try:
+                val=self.codec.decode(buf,0)
+            except IOError as err:
+                val=err
+            del buf[:RETURN_FRAME_SIZE]
+            return val
+
+
+_codec_cache={}
+
+def get_codec(serial_cmds,address):
+    """
+    Return the shared FrameCodec for the given command table and
+    address, creating it on first use.
+    """
+    key=(id(serial_cmds),address)
+    try:
+        return _codec_cache[key]
+    except KeyError:
+        codec=FrameCodec(serial_cmds,address)
+        _codec_cache[key]=codec
+        return codec
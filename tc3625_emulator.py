@@ -0,0 +1,442 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: software emulation of a TC-36-25 controller and the block it
+drives, for testing and benchmarking without hardware (Linux only).
+
+The emulator opens a pseudo-terminal and answers the STX/ETX framed
+commands in SERIAL_CMDS on its slave side, so TC3625_Serial, TC3625
+and Thermocycler can be pointed at emu.port like a real serial port.
+All writable registers are kept in a register file and the read only
+registers (input1, power output, etc.) come from a first order thermal
+model of the block driven by the emulated deadband/PID/computer control
+loop.
+
+Faults can be injected: a fixed response latency, emulation of the
+wire time at a given baud rate, randomly dropped response bytes and
+randomly corrupted response checksums. Requests whose checksum is wrong
+are answered with 'X'*8 as the real controller does.
+
+Classes:
+  TC3625_Emulator
+
+Usage:
+
+  emu = TC3625_Emulator(latency=0.005, corrupt_rate=0.01, time_scale=10.0)
+  emu.start()
+  dev = TC3625(port=emu.port)
+  ...
+  emu.stop()
+
+  # Or run stand-alone and point the GUI at the printed port
+  python tc3625_emulator.py [--time-scale 10]
+
+------------------------------------------------------------------------
+"""
+from __future__ import print_function
+import os
+import random
+import select
+import threading
+import time
+import tty
+
+from tc3625_serial import SERIAL_CMDS, ADDRESS
+from tc3625_codec import STX_BYTE, ETX_BYTE, ACK_BYTE
+from tc3625_codec import HEX_DIGITS, HEX_VALUES, CHECKSUM_DIGITS, NAK_DATA
+from tc3625_codec import READ_FRAME_SIZE, WRITE_FRAME_SIZE
+
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    monotonic = time.time
+
+# Plant defaults
+DFLT_AMBIENT=22.0       # deg C
+DFLT_HEAT_RATE=3.0      # deg C/s at 100% heating output
+DFLT_COOL_RATE=2.0      # deg C/s at 100% cooling output
+DFLT_TAU=60.0           # s, time constant of the loss to ambient
+DFLT_MAX_CURRENT=20.0   # A at 100% output
+MAX_STEP=0.05           # s, largest integration step of the plant model
+POWER_MAX=511
+AMPS_PER_COUNT=2.5
+
+# Power-up contents of the register file, by command name
+DFLT_REGISTERS={
+    'alarm type':0,
+    'set type define':0,
+    'sensor type':1,
+    'control type':1,
+    'control output polarity':0,
+    'power on/off':0,
+    'output shutdown if alarm':0,
+    'fixed desired control setting':2500,
+    'proportional bandwidth':500,
+    'integral gain':100,
+    'derivative gain':0,
+    'low external set range':0,
+    'high external set range':10000,
+    'alarm deadband':100,
+    'high alarm setting':10500,
+    'low alarm setting':0,
+    'control deadband setting':50,
+    'input1 offset':0,
+    'input2 offset':0,
+    'heat multiplier':100,
+    'cool multiplier':100,
+    'over current count compare value':12,
+    'alarm latch enable':0,
+    'alarm latch request':0,
+    'choose sensor for alarm function':0,
+    'temperature working units':1,
+    'eeprom write enable':1,
+    'over current continuous':1,
+    'over current restart attempts':0,
+    'JP3 display enable':1,
+}
+
+# Alarm status bits
+ALARM_HIGH_BIT=0
+ALARM_LOW_BIT=1
+ALARM_COMPUTER_BIT=2
+
+
+class TC3625_Emulator:
+
+    """
+    Emulated TC-36-25 controller on a pseudo-terminal.
+    """
+
+    def __init__(self,
+                 ambient=DFLT_AMBIENT,
+                 heat_rate=DFLT_HEAT_RATE,
+                 cool_rate=DFLT_COOL_RATE,
+                 tau=DFLT_TAU,
+                 max_current=DFLT_MAX_CURRENT,
+                 latency=0.0,
+                 baud_rate=None,
+                 drop_rate=0.0,
+                 corrupt_rate=0.0,
+                 time_scale=1.0,
+                 seed=None,
+                 address=ADDRESS,
+                 ):
+        self.ambient=ambient
+        self.heat_rate=heat_rate
+        self.cool_rate=cool_rate
+        self.tau=tau
+        self.max_current=max_current
+        self.latency=latency
+        self.baud_rate=baud_rate
+        self.drop_rate=drop_rate
+        self.corrupt_rate=corrupt_rate
+        self.time_scale=time_scale
+        self.random=random.Random(seed)
+        self.address=bytearray(address.encode('ascii'))
+        self.serial_cmds=SERIAL_CMDS
+        self.read_codes={}
+        self.write_codes={}
+        for cmd, cmd_dict in SERIAL_CMDS.items():
+            if cmd_dict['read'] != None:
+                self.read_codes[bytes(bytearray(cmd_dict['read'].encode('ascii')))]=cmd
+            if cmd_dict['write'] != None:
+                self.write_codes[bytes(bytearray(cmd_dict['write'].encode('ascii')))]=cmd
+        self.lock=threading.Lock()
+        self.registers=dict(DFLT_REGISTERS)
+        self.temperature=ambient
+        self.output=0.0
+        self.integral=0.0
+        self.last_error=None
+        self.alarm_latched=0
+        self.sim_time=monotonic()
+        # Counters
+        self.num_requests=0
+        self.num_naks=0
+        self.num_dropped=0
+        self.num_corrupted=0
+        self.port=None
+        self.master=None
+        self.slave=None
+        self.thread=None
+        self.running=False
+
+    def start(self):
+        """ Open the pseudo-terminal and start answering requests """
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port=os.ttyname(self.slave)
+        self.running=True
+        self.sim_time=monotonic()
+        self.thread=threading.Thread(target=self.run)
+        self.thread.daemon=True
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        """ Stop the emulator and close the pseudo-terminal """
+        self.running=False
+        if self.thread != None:
+            self.thread.join()
+            self.thread=None
+        for fd in (self.master,self.slave):
+            if fd != None:
+                os.close(fd)
+        self.master=self.slave=None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*args):
+        self.stop()
+
+    def run(self):
+        """ Request loop, runs in its own thread """
+        frame=bytearray()
+        in_frame=False
+        while self.running:
+            ready=select.select([self.master],[],[],0.05)[0]
+            if not ready:
+                continue
+            try:
+                data=bytearray(os.read(self.master,1024))
+            except OSError:
+                break
+            for c in data:
+                if c == STX_BYTE:
+                    frame=bytearray([c])
+                    in_frame=True
+                elif in_frame:
+                    frame.append(c)
+                    if c == ETX_BYTE:
+                        in_frame=False
+                        self.respond(frame)
+                    elif len(frame) > WRITE_FRAME_SIZE:
+                        in_frame=False
+
+    # ------------------------------------------------------------------
+    # Protocol
+
+    def respond(self,frame):
+        """ Answer a complete request frame """
+        self.num_requests+=1
+        data=self.handle(frame)
+        ret=bytearray([STX_BYTE])+data
+        cs=CHECKSUM_DIGITS[sum(data)&0xff]
+        if self.corrupt_rate > 0 and self.random.random() < self.corrupt_rate:
+            cs=CHECKSUM_DIGITS[(sum(data)+1)&0xff]
+            self.num_corrupted+=1
+        ret.extend(cs)
+        ret.append(ACK_BYTE)
+        if self.drop_rate > 0:
+            kept=bytearray()
+            for c in ret:
+                if self.random.random() < self.drop_rate:
+                    self.num_dropped+=1
+                else:
+                    kept.append(c)
+            ret=kept
+        delay=self.latency
+        if self.baud_rate:
+            delay+=10.0*(len(frame)+len(ret))/self.baud_rate
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            os.write(self.master,bytes(ret))
+        except OSError:
+            pass
+
+    def handle(self,frame):
+        """
+        Process a request frame and return the 8 data bytes of the
+        response.
+        """
+        size=len(frame)
+        if size not in (READ_FRAME_SIZE,WRITE_FRAME_SIZE) or frame[1:3] != self.address:
+            return self.nak()
+        cs=sum(frame[1:size-3])&0xff
+        if (HEX_VALUES[frame[size-3]]<<4|HEX_VALUES[frame[size-2]]) != cs:
+            return self.nak()
+        code=bytes(frame[3:5])
+        with self.lock:
+            self.advance()
+            if size == READ_FRAME_SIZE:
+                try:
+                    cmd=self.read_codes[code]
+                except KeyError:
+                    return self.nak()
+                val=self.read_register(cmd)
+            else:
+                try:
+                    cmd=self.write_codes[code]
+                except KeyError:
+                    return self.nak()
+                val=0
+                for c in frame[5:13]:
+                    n=HEX_VALUES[c]
+                    if n < 0:
+                        return self.nak()
+                    val=(val<<4)|n
+                if val >= 0x80000000:
+                    val-=0x100000000
+                self.write_register(cmd,val)
+        return self.hex_data(val)
+
+    def nak(self):
+        self.num_naks+=1
+        return bytearray(NAK_DATA)
+
+    def hex_data(self,val):
+        x=int(val)&0xffffffff
+        data=bytearray(8)
+        for i in range(7,-1,-1):
+            data[i]=HEX_DIGITS[x&0xf]
+            x>>=4
+        return data
+
+    def read_register(self,cmd):
+        if cmd == 'input1':
+            return self.from_c(self.temperature)+self.registers['input1 offset']
+        if cmd == 'input2':
+            return self.from_c(self.ambient)+self.registers['input2 offset']
+        if cmd == 'desired control value':
+            return self.registers['fixed desired control setting']
+        if cmd == 'power output':
+            return int(round(POWER_MAX*self.output))
+        if cmd == 'output current counts':
+            return int(abs(self.output)*self.max_current/AMPS_PER_COUNT)
+        if cmd == 'alarm status':
+            return self.alarm_status()
+        return self.registers[cmd]
+
+    def write_register(self,cmd,val):
+        if cmd == 'alarm latch request':
+            self.alarm_latched=0
+        elif cmd == 'fixed desired control setting' and val != self.registers[cmd]:
+            self.integral=0.0
+        self.registers[cmd]=val
+
+    # ------------------------------------------------------------------
+    # Plant and control loop
+
+    def to_c(self,val):
+        """ Register value in working units to deg C """
+        if self.registers['temperature working units'] == 0:
+            return (val/100.0-32.0)*5.0/9.0
+        return val/100.0
+
+    def from_c(self,temp):
+        """ deg C to register value in working units """
+        if self.registers['temperature working units'] == 0:
+            temp=temp*9.0/5.0+32.0
+        return int(round(100*temp))
+
+    def alarm_status(self):
+        status=self.alarm_latched
+        alarm_type=self.registers['alarm type']
+        if alarm_type == 2:
+            if self.temperature > self.to_c(self.registers['high alarm setting']):
+                status|=1<<ALARM_HIGH_BIT
+            if self.temperature < self.to_c(self.registers['low alarm setting']):
+                status|=1<<ALARM_LOW_BIT
+        elif alarm_type == 3 and self.registers['alarm latch enable']:
+            status|=1<<ALARM_COMPUTER_BIT
+        if self.registers['alarm latch enable'] and alarm_type != 3:
+            self.alarm_latched=status
+        return status
+
+    def control(self,dt):
+        """ Controller output in [-1,1] """
+        reg=self.registers
+        if reg['power on/off'] == 0:
+            self.integral=0.0
+            return 0.0
+        if reg['output shutdown if alarm'] and self.alarm_status():
+            return 0.0
+        if reg['control type'] == 2:
+            out=reg['fixed desired control setting']/float(POWER_MAX)
+        else:
+            error=self.to_c(reg['fixed desired control setting'])-self.temperature
+            if reg['control type'] == 0:
+                band=reg['control deadband setting']/100.0
+                if error > band:
+                    out=1.0
+                elif error < -band:
+                    out=-1.0
+                else:
+                    out=0.0
+            else:
+                pb=max(reg['proportional bandwidth']/100.0,0.01)
+                deriv=0.0
+                if self.last_error != None and dt > 0:
+                    deriv=(error-self.last_error)/dt
+                self.last_error=error
+                igain=reg['integral gain']/100.0/60.0
+                dgain=reg['derivative gain']/100.0*60.0
+                out=(error+self.integral+dgain*deriv)/pb
+                if -1.0 < out < 1.0:
+                    self.integral+=igain*error*dt
+        if out > 0:
+            out*=reg['heat multiplier']/100.0
+        else:
+            out*=reg['cool multiplier']/100.0
+        return max(-1.0,min(1.0,out))
+
+    def advance(self):
+        """ Integrate the plant up to the current time """
+        now=monotonic()
+        elapsed=(now-self.sim_time)*self.time_scale
+        self.sim_time=now
+        while elapsed > 0:
+            dt=min(elapsed,MAX_STEP)
+            elapsed-=dt
+            self.output=self.control(dt)
+            rate=self.heat_rate if self.output > 0 else self.cool_rate
+            dtemp=self.output*rate-(self.temperature-self.ambient)/self.tau
+            self.temperature+=dtemp*dt
+
+
+if __name__ == '__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description='TC-36-25 emulator on a pseudo-terminal')
+    parser.add_argument('--time-scale',type=float,default=1.0)
+    parser.add_argument('--latency',type=float,default=0.0)
+    parser.add_argument('--baud-rate',type=int,default=None)
+    parser.add_argument('--drop-rate',type=float,default=0.0)
+    parser.add_argument('--corrupt-rate',type=float,default=0.0)
+    args=parser.parse_args()
+    emu=TC3625_Emulator(
+        time_scale=args.time_scale,
+        latency=args.latency,
+        baud_rate=args.baud_rate,
+        drop_rate=args.drop_rate,
+        corrupt_rate=args.corrupt_rate,
+        )
+    print('TC3625 emulator on %s'%(emu.start(),))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emu.stop()
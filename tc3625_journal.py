@@ -0,0 +1,399 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: wire level capture and replay of TC3625 traffic.
+
+RecordingTransport wraps a TC3625_Serial (or anything with the same
+read/write/transact interface) and appends one fixed size record per
+command to a binary journal. ReplayTransport reads a journal back and
+answers the same commands with the recorded values and errors, either
+at the original pace or as fast as possible, so that TC3625 and
+Thermocycler can be run offline against real traffic. Both are passed
+to TC3625 (or Thermocycler) as the transport.
+
+The send and return strings are fully determined by the command, the
+value and the outcome, so these are recorded rather than the raw bytes:
+
+  header:  magic 'TC3625J1', wall clock start time (float64) and the
+           command name table (uint16 count, then uint8 length + ascii
+           name for each command)
+  records: t_send, t_recv (float64, monotonic seconds from the start of
+           the journal), command index (uint16), op (uint8, 0=read
+           1=write), status (uint8, see STATUS), request value (int32,
+           the value written) and return value (int32)
+
+all little endian. load_arrays decodes a whole journal into NumPy
+arrays in one step.
+
+Classes:
+  RecordingTransport
+  ReplayTransport
+  ReplayMismatch
+
+Functions:
+  read_journal
+  load_arrays
+
+Usage:
+
+  # Record
+  rec = RecordingTransport(TC3625_Serial(port), 'run.tcj')
+  dev = TC3625(port, transport=rec)
+  ...
+  dev.close()
+
+  # Replay at original speed, or realtime=False as fast as possible
+  dev = TC3625(transport=ReplayTransport('run.tcj', realtime=True))
+
+  # Bulk decode
+  data = load_arrays('run.tcj')
+  data['time'], data['cmd'], data['value'], data['names']
+
+------------------------------------------------------------------------
+"""
+from __future__ import print_function
+import struct
+import time
+
+import serial
+
+from tc3625_serial import SERIAL_CMDS, SEND_SIZE_READ, SEND_SIZE_WRITE
+from tc3625_codec import ChecksumError, NakError, ResponseTimeout, classify
+from tc3625_retry import clock
+from tc3625_stats import SerialStats
+
+MAGIC=b'TC3625J1'
+HEADER_FMT='<8sdH'
+HEADER_SIZE=struct.calcsize(HEADER_FMT)
+RECORD_FMT='<ddHBBii'
+RECORD_SIZE=struct.calcsize(RECORD_FMT)
+
+OP_READ=0
+OP_WRITE=1
+
+# Status codes, index = code
+STATUS=('ok','checksum','nak','timeout','port')
+STATUS_CODE=dict([(s,i) for i, s in enumerate(STATUS)])
+
+# Exceptions raised on replay of a failed command
+STATUS_ERROR={
+    'checksum':ChecksumError,
+    'nak':NakError,
+    'timeout':ResponseTimeout,
+    'port':serial.SerialException,
+    }
+
+
+class ReplayMismatch(ValueError):
+    """ Command does not match the journal """
+    pass
+
+
+class RecordingTransport:
+
+    """
+    Transport which forwards all commands to dev and records them to
+    the journal at path.
+    """
+
+    def __init__(self,dev,path,serial_cmds=SERIAL_CMDS):
+        self.dev=dev
+        self.path=path
+        self.names=sorted(serial_cmds.keys())
+        self.index=dict([(n,i) for i, n in enumerate(self.names)])
+        self.timeout=dev.timeout
+        self.rtt=None
+        self.stats=getattr(dev,'stats',None)
+        self.num_records=0
+        self.journal=open(path,'wb')
+        self.start=clock()
+        self.journal.write(struct.pack(HEADER_FMT,MAGIC,time.time(),len(self.names)))
+        for name in self.names:
+            name=name.encode('ascii')
+            self.journal.write(struct.pack('<B',len(name))+name)
+        self.journal.flush()
+
+    def open(self):
+        """ Open the wrapped device """
+        return self.dev.open()
+
+    def close(self):
+        """ Close the wrapped device, the journal is flushed """
+        self.journal.flush()
+        self.dev.close()
+
+    def close_journal(self):
+        """ Close the journal, no further commands are recorded """
+        self.journal.close()
+
+    def read(self,cmd):
+        """ Read cmd from the device, see TC3625_Serial.read """
+        return self.call(cmd,None,self.dev.read,cmd)
+
+    def write(self,cmd,val):
+        """ Write val to cmd, see TC3625_Serial.write """
+        return self.call(cmd,val,self.dev.write,cmd,val)
+
+    def transact(self,requests,*args,**kwargs):
+        """
+        Pipelined transaction, see TC3625_Serial.transact. Each request
+        is recorded with the send time of the transaction.
+        """
+        requests=list(requests)
+        self.dev.timeout=self.timeout
+        t_send=clock()
+        try:
+            results=self.dev.transact(requests,*args,**kwargs)
+        except (IOError,OSError) as err:
+            self.record_all(t_send,requests,[err]*len(requests))
+            raise
+        self.record_all(t_send,requests,results)
+        return results
+
+    def record_all(self,t_send,requests,results):
+        for (cmd,val), ret in zip(requests,results):
+            self.record(t_send,cmd,val,ret)
+        self.journal.flush()
+
+    def call(self,cmd,val,func,*args):
+        """ Call func(*args) on the device and record the outcome """
+        self.dev.timeout=self.timeout
+        t_send=clock()
+        try:
+            ret=func(*args)
+        except (IOError,OSError) as err:
+            self.rtt=None
+            self.record(t_send,cmd,val,err)
+            self.journal.flush()
+            raise
+        self.rtt=self.dev.rtt
+        self.record(t_send,cmd,val,ret)
+        self.journal.flush()
+        return ret
+
+    def record(self,t_send,cmd,val,ret):
+        """ Append a record, ret is the returned value or exception """
+        if isinstance(ret,(IOError,OSError)):
+            status=STATUS_CODE[classify(ret)]
+            ret=0
+        else:
+            status=0
+        if val is None:
+            op=OP_READ
+            val=0
+        else:
+            op=OP_WRITE
+        self.journal.write(struct.pack(RECORD_FMT,
+            t_send-self.start,
+            clock()-self.start,
+            self.index[cmd],
+            op,
+            status,
+            int(val),
+            int(ret),
+            ))
+        self.num_records+=1
+
+
+class ReplayTransport:
+
+    """
+    Transport which answers commands from a journal. With
+    realtime=True each response is delayed until its original time,
+    relative to the first command. With strict=True a command (or for
+    a write, its value) which does not match the next record raises
+    ReplayMismatch, otherwise records are skipped until one matches
+    (counted in num_skipped).
+    """
+
+    def __init__(self,path,realtime=False,strict=True):
+        self.path=path
+        self.realtime=realtime
+        self.strict=strict
+        self.start_time, self.names, self.records=read_journal(path)
+        self.pos=0
+        self.num_skipped=0
+        self.timeout=None
+        self.rtt=None
+        self.replay_start=None
+        # Statistics of the replayed traffic, with the recorded times
+        self.stats=SerialStats(dict([(n,None) for n in self.names]))
+
+    def open(self):
+        return True
+
+    def close(self):
+        pass
+
+    def read(self,cmd):
+        """ Replay the read of cmd """
+        return self.replay(cmd,None)
+
+    def write(self,cmd,val):
+        """ Replay the write of val to cmd """
+        return self.replay(cmd,val)
+
+    def transact(self,requests,*args,**kwargs):
+        """ Replay a pipelined transaction """
+        results=[]
+        for cmd, val in requests:
+            try:
+                results.append(self.replay(cmd,val))
+            except (IOError,OSError) as err:
+                results.append(err)
+        return results
+
+    def at_end(self):
+        """ True if all records have been replayed """
+        return self.pos >= len(self.records)
+
+    def next_record(self,cmd,op,val=None):
+        """
+        Return the next record for cmd, op and (for a write) the value
+        val written, see the class documentation.
+        """
+        while self.pos < len(self.records):
+            rec=self.records[self.pos]
+            self.pos+=1
+            if self.names[rec[2]] == cmd and rec[3] == op:
+                if op == OP_READ or rec[5] == int(val):
+                    return rec
+            if self.strict:
+                raise ReplayMismatch('record %d is %s, not %s'%(
+                    self.pos-1,
+                    describe(self.names[rec[2]],rec[3],rec[5]),
+                    describe(cmd,op,val),
+                    ))
+            self.num_skipped+=1
+        raise EOFError('end of journal %s'%(self.path,))
+
+    def replay(self,cmd,val):
+        op=OP_READ if val is None else OP_WRITE
+        t_send, t_recv, index, op, status, request, ret=self.next_record(cmd,op,val)
+        if self.realtime:
+            if self.replay_start is None:
+                self.replay_start=clock()-t_send
+            delay=self.replay_start+t_recv-clock()
+            if delay > 0:
+                time.sleep(delay)
+        size=SEND_SIZE_READ if op == OP_READ else SEND_SIZE_WRITE
+        if status != 0:
+            self.rtt=None
+            kind=STATUS[status]
+            err=STATUS_ERROR[kind]('replayed %s error'%(kind,))
+            self.stats.record(cmd,size,err,t_recv-t_send)
+            raise err
+        self.rtt=t_recv-t_send
+        self.stats.record(cmd,size,ret,self.rtt)
+        return ret
+
+
+def describe(cmd,op,val):
+    """ Describe a command for a ReplayMismatch message """
+    if op == OP_READ:
+        return 'read %s'%(cmd,)
+    return 'write %s %d'%(cmd,int(val))
+
+def read_journal(path):
+    """
+    Read a journal. Returns (start_time, names, records) where
+    start_time is the wall clock time the journal was started, names
+    the command name table and records a list of (t_send, t_recv,
+    cmd_index, op, status, request, value) tuples.
+    """
+    with open(path,'rb') as f:
+        data=f.read()
+    offset, start_time, names=read_header(data)
+    num=(len(data)-offset)//RECORD_SIZE
+    records=[]
+    for i in range(num):
+        records.append(struct.unpack_from(RECORD_FMT,data,offset+i*RECORD_SIZE))
+    return start_time, names, records
+
+def read_header(data):
+    """
+    Parse the journal header, returns (record offset, start_time,
+    names).
+    """
+    magic, start_time, num=struct.unpack_from(HEADER_FMT,data,0)
+    if magic != MAGIC:
+        raise ValueError('not a tc3625 journal')
+    pos=HEADER_SIZE
+    names=[]
+    for i in range(num):
+        n=bytearray(data[pos:pos+1])[0]
+        names.append(data[pos+1:pos+1+n].decode('ascii'))
+        pos+=1+n
+    return pos, start_time, names
+
+def load_arrays(path):
+    """
+    Decode a journal into NumPy arrays. Returns a dictionary with the
+    arrays 'time' (t_recv), 't_send', 'cmd' (index into 'names'), 'op',
+    'status', 'request' and 'value', plus 'names' and 'start_time'. A
+    partly written last record is ignored.
+    """
+    import numpy
+    with open(path,'rb') as f:
+        data=f.read()
+    offset, start_time, names=read_header(data)
+    dtype=numpy.dtype([
+        ('t_send','<f8'),
+        ('t_recv','<f8'),
+        ('cmd','<u2'),
+        ('op','u1'),
+        ('status','u1'),
+        ('request','<i4'),
+        ('value','<i4'),
+        ])
+    num=(len(data)-offset)//RECORD_SIZE
+    rec=numpy.frombuffer(data,dtype=dtype,count=num,offset=offset)
+    return {
+        'time':rec['t_recv'],
+        't_send':rec['t_send'],
+        'cmd':rec['cmd'],
+        'op':rec['op'],
+        'status':rec['status'],
+        'request':rec['request'],
+        'value':rec['value'],
+        'names':names,
+        'start_time':start_time,
+        }
+
+
+if __name__ == '__main__':
+
+    import sys
+    start_time, names, records=read_journal(sys.argv[1])
+    print('started %s, %d records'%(time.ctime(start_time),len(records)))
+    for t_send, t_recv, index, op, status, request, ret in records:
+        if op == OP_READ:
+            cmd_str='read  %s'%(names[index],)
+        else:
+            cmd_str='write %s %d'%(names[index],request)
+        if status == 0:
+            ret_str=str(ret)
+        else:
+            ret_str='** %s'%(STATUS[status],)
+        print('%10.4f %8.4f  %-45s %s'%(t_send,t_recv-t_send,cmd_str,ret_str))
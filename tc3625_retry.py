@@ -0,0 +1,385 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: retry policy for TC3625 reads and writes.
+
+Failures are classified and handled differently:
+
+  checksum - the return string was corrupted on the line, the command
+             is repeated immediately.
+  nak      - the controller rejected the send string ('X'*8), repeated
+             immediately once, then with backoff.
+  timeout  - no (or an incomplete) response, repeated after a backoff.
+  port     - the serial port itself failed (e.g. a USB adapter reset),
+             the port is reopened after a longer backoff.
+
+The response timeout is not fixed but computed from a smoothed
+estimate of the round trip time and its variation, as for TCP (RFC
+6298), and is doubled after each timeout until a new measurement
+arrives. Each operation has a time budget, max_stall, so the worst
+case time a caller can be blocked is bounded no matter how many
+attempts are allowed. After breaker_threshold consecutive failed
+operations the circuit breaker opens and operations fail immediately
+with CircuitOpenError until breaker_reset seconds have passed, after
+which a single trial operation is allowed through; other operations
+are still rejected until the trial succeeds or fails. So a controller
+which stops responding blocks the caller for at most breaker_threshold
+operations before reads and writes fail fast.
+
+The policy is a state machine (begin, timeout, success, failure) so that
+it can drive both the blocking and the asyncio interfaces; call() runs
+it for a blocking function. begin() returns an Operation holding the
+attempt count and time budget of that operation, so one policy can be
+shared by concurrent callers; the policy itself only holds what they
+share, the round trip time estimate, the circuit breaker and the
+counters. Counters and the largest observed stall are available from
+metrics().
+
+Classes:
+  CircuitOpenError
+  Operation
+  RetryPolicy
+
+Functions:
+  give_up
+  reopen
+
+Usage:
+
+  policy = RetryPolicy(max_attempt=10, max_stall=5.0)
+  dev = TC3625(port, retry_policy=policy)
+  ...
+  op = policy.begin()
+  val = policy.run(op, serial_dev, serial_dev.read, cmd)
+  print(op.retries)
+  ...
+  print(policy.metrics())
+
+------------------------------------------------------------------------
+"""
+from __future__ import print_function
+import time
+from threading import Lock
+
+from tc3625_codec import ChecksumError, NakError, ResponseTimeout, classify
+
+# Default policy settings
+DFLT_MAX_ATTEMPT=10
+DFLT_MAX_STALL=5.0
+DFLT_MIN_TIMEOUT=0.1
+DFLT_MAX_TIMEOUT=2.0
+DFLT_BREAKER_THRESHOLD=3
+DFLT_BREAKER_RESET=5.0
+
+# Backoff before the n-th retry of each class within an operation is
+# min(BACKOFF[kind]*2**(n-1), MAX_BACKOFF[kind]), except that the first
+# checksum or nak retry is immediate.
+BACKOFF={
+    'checksum':0.0,
+    'nak':0.005,
+    'timeout':0.02,
+    'port':0.25,
+    }
+MAX_BACKOFF={
+    'checksum':0.0,
+    'nak':0.1,
+    'timeout':0.5,
+    'port':2.0,
+    }
+
+# Weights for the round trip time estimators, RFC 6298
+RTT_ALPHA=0.125
+RTT_BETA=0.25
+RTT_K=4.0
+
+try:
+    clock=time.monotonic
+except AttributeError:
+    clock=time.time
+
+
+class CircuitOpenError(IOError):
+    """ Circuit breaker open, operation not attempted """
+    pass
+
+
+class Operation:
+
+    """
+    State of one operation under a RetryPolicy, returned by
+    RetryPolicy.begin.
+    """
+
+    def __init__(self,start):
+        self.start=start
+        self.attempt=0
+        # Attempts repeated after a failure, one less than the failed
+        # attempts if the operation was given up
+        self.retries=0
+        self.repeats={}
+        # True for the trial operation of a half open circuit breaker
+        self.trial=False
+
+
+class RetryPolicy:
+
+    """
+    Classified retry, adaptive timeout and circuit breaker for one
+    device. See module documentation.
+    """
+
+    def __init__(self,
+                 max_attempt=DFLT_MAX_ATTEMPT,
+                 max_stall=DFLT_MAX_STALL,
+                 min_timeout=DFLT_MIN_TIMEOUT,
+                 max_timeout=DFLT_MAX_TIMEOUT,
+                 breaker_threshold=DFLT_BREAKER_THRESHOLD,
+                 breaker_reset=DFLT_BREAKER_RESET,
+                 ):
+        self.max_attempt=max_attempt
+        self.max_stall=max_stall
+        self.min_timeout=min_timeout
+        self.max_timeout=max_timeout
+        self.breaker_threshold=breaker_threshold
+        self.breaker_reset=breaker_reset
+        # Round trip time estimate, None until the first measurement
+        self.srtt=None
+        self.rttvar=None
+        self.rto=max_timeout
+        # Circuit breaker
+        self.consecutive=0
+        self.open_until=None
+        self.trial_in_flight=False
+        self.lock=Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        """ Zero the counters returned by metrics() """
+        self.num_ops=0
+        self.num_attempts=0
+        self.num_failed_ops=0
+        self.num_rejected=0
+        self.num_trips=0
+        self.failures=dict([(k,0) for k in BACKOFF])
+        self.backoff_time=0.0
+        self.max_seen_stall=0.0
+        self.last_stall=0.0
+
+    def timeout(self,op):
+        """
+        Response timeout for the next attempt of operation op, limited
+        to what is left of its time budget.
+        """
+        left=self.max_stall-(clock()-op.start)
+        return max(min(self.rto,left),self.min_timeout)
+
+    def begin(self):
+        """
+        Start an operation and return its Operation. Raises
+        CircuitOpenError if the circuit breaker is open.
+        """
+        with self.lock:
+            if self.trial_in_flight:
+                self.num_rejected+=1
+                raise CircuitOpenError('circuit breaker half open, trial operation in progress')
+            if self.is_open():
+                self.num_rejected+=1
+                raise CircuitOpenError('circuit breaker open after %d consecutive failed operations'%(self.consecutive,))
+            op=Operation(clock())
+            if self.open_until is not None:
+                # Half open, allow one trial operation
+                self.consecutive=self.breaker_threshold-1
+                self.open_until=None
+                self.trial_in_flight=True
+                op.trial=True
+            self.num_ops+=1
+        return op
+
+    def is_open(self):
+        """
+        True if the circuit breaker is open, or half open with its trial
+        operation in progress
+        """
+        if self.trial_in_flight:
+            return True
+        return self.open_until is not None and clock() < self.open_until
+
+    def success(self,op,rtt=None):
+        """
+        Record a successful attempt and end operation op. rtt is the
+        measured response time of a single command, if known.
+        """
+        with self.lock:
+            self.num_attempts+=1
+            self.consecutive=0
+            if rtt is not None:
+                self.sample(rtt)
+            self.end(op)
+
+    def failure(self,op,err):
+        """
+        Record a failed attempt of operation op. Returns (kind, delay),
+        where delay is the backoff before the next attempt or None if
+        the operation should be given up.
+        """
+        op.attempt+=1
+        kind=classify(err)
+        n=op.repeats.get(kind,0)
+        op.repeats[kind]=n+1
+        if n == 0 and kind in ('checksum','nak'):
+            delay=0.0
+        else:
+            delay=min(BACKOFF[kind]*2**n,MAX_BACKOFF[kind])
+        left=self.max_stall-(clock()-op.start)
+        with self.lock:
+            self.num_attempts+=1
+            self.failures[kind]+=1
+            if kind == 'timeout':
+                self.rto=min(2*self.rto,self.max_timeout)
+            if op.attempt >= self.max_attempt or left-delay < self.min_timeout:
+                self.fail(op)
+                return kind, None
+            self.backoff_time+=delay
+        op.retries+=1
+        return kind, delay
+
+    def fail(self,op):
+        """ End operation op as failed, call with the lock held """
+        self.num_failed_ops+=1
+        self.consecutive+=1
+        if self.consecutive >= self.breaker_threshold:
+            self.num_trips+=1
+            self.open_until=clock()+self.breaker_reset
+        self.end(op)
+
+    def abandon(self,op):
+        """
+        End operation op without a success or failure, e.g. when it is
+        interrupted, so that a trial in progress no longer holds the
+        circuit breaker half open.
+        """
+        with self.lock:
+            self.end(op)
+
+    def end(self,op):
+        """ Record the stall of operation op, call with the lock held """
+        if op.trial:
+            op.trial=False
+            self.trial_in_flight=False
+        stall=clock()-op.start
+        self.last_stall=stall
+        if stall > self.max_seen_stall:
+            self.max_seen_stall=stall
+
+    def sample(self,rtt):
+        """ Update the round trip time estimate, call with the lock held """
+        if self.srtt is None:
+            self.srtt=rtt
+            self.rttvar=0.5*rtt
+        else:
+            self.rttvar=(1-RTT_BETA)*self.rttvar+RTT_BETA*abs(self.srtt-rtt)
+            self.srtt=(1-RTT_ALPHA)*self.srtt+RTT_ALPHA*rtt
+        rto=self.srtt+RTT_K*self.rttvar
+        self.rto=min(max(rto,self.min_timeout),self.max_timeout)
+
+    def stall_bound(self):
+        """
+        Worst case time an operation can block the caller: the time
+        budget plus a last attempt started just inside it.
+        """
+        return self.max_stall+self.min_timeout
+
+    def metrics(self):
+        """ Return a dictionary of counters and estimates """
+        return {
+            'ops':self.num_ops,
+            'attempts':self.num_attempts,
+            'failed ops':self.num_failed_ops,
+            'rejected ops':self.num_rejected,
+            'breaker trips':self.num_trips,
+            'breaker open':self.is_open(),
+            'failures':dict(self.failures),
+            'backoff time':self.backoff_time,
+            'srtt':self.srtt,
+            'rttvar':self.rttvar,
+            'timeout':self.rto,
+            'last stall':self.last_stall,
+            'max stall':self.max_seen_stall,
+            'stall bound':self.stall_bound(),
+            }
+
+    def call(self,dev,func,*args):
+        """
+        Run func(*args) on the blocking device dev under this policy
+        and return its result, see run.
+        """
+        return self.run(self.begin(),dev,func,*args)
+
+    def run(self,op,dev,func,*args):
+        """
+        Run func(*args) on the blocking device dev as operation op (from
+        begin) and return its result. On port errors the device is
+        closed and reopened before the next attempt. Raises the last
+        error, with the number of attempts, if the operation is given
+        up.
+        """
+        try:
+            while True:
+                dev.timeout=self.timeout(op)
+                try:
+                    val=func(*args)
+                except (IOError,OSError) as err:
+                    kind, delay=self.failure(op,err)
+                    if delay is None:
+                        raise give_up(err,op.attempt)
+                    if kind == 'port':
+                        reopen(dev)
+                    if delay > 0:
+                        time.sleep(delay)
+                    continue
+                self.success(op,dev.rtt)
+                return val
+        except BaseException:
+            if op.trial:
+                self.abandon(op)
+            raise
+
+
+def give_up(err,attempt):
+    """ Exception to raise when an operation is given up """
+    msg='%s, giving up after %d attempts'%(err,attempt)
+    if isinstance(err,(ChecksumError,NakError,ResponseTimeout,CircuitOpenError)):
+        return err.__class__(msg)
+    return IOError(msg)
+
+def reopen(dev):
+    """ Close and reopen the port of dev, ignoring errors """
+    try:
+        dev.close()
+    except Exception:
+        pass
+    try:
+        dev.open()
+    except Exception:
+        pass
@@ -63,6 +63,10 @@ Usage:
   # Read value from controller
   val = dev.read(cmd_str)
 
+  # Pipelined reads/writes, val=None for a read. Returns a list of
+  # values or IOErrors in request order.
+  vals = dev.transact([(cmd_str0,None), (cmd_str1,val1)])
+
   # Close serial connection
   dev.close() 
 
@@ -79,13 +83,19 @@ Usage:
 Author: Will Dickson  
 ----------------------------------------------------------------------------
 """
-import struct
+from __future__ import print_function
 import serial
+from tc3625_codec import get_codec, FrameParser
+from tc3625_codec import ChecksumError, NakError, ResponseTimeout
+from tc3625_stats import SerialStats
+from tc3625_retry import clock
 
 # Defualt Serial Port settings
 DFLT_PORT='/dev/ttyS0'
 DFLT_TIMEOUT=2.0
 DFLT_BAUDRATE=9600
+DFLT_PIPELINE_DEPTH=8
+DFLT_INTERBYTE_TIMEOUT=0.05
 
 # Seial protocol constants
 ADDRESS='00'
@@ -506,15 +516,27 @@ class TC3625_Serial:
                  port=DFLT_PORT,
                  timeout=DFLT_TIMEOUT,
                  baud_rate=DFLT_BAUDRATE,
+                 interbyte_timeout=DFLT_INTERBYTE_TIMEOUT,
                  ):
         self.port=port
         self.timeout=timeout
         self.baud_rate=baud_rate
+        self.interbyte_timeout=interbyte_timeout
         self.address=ADDRESS
         self.serial_cmds = SERIAL_CMDS
         self.stx=STX
         self.etx=ETX
         self.ack=ACK
+        self.codec=get_codec(self.serial_cmds,self.address)
+        self.parser=FrameParser(self.codec)
+        # Reusable send buffer
+        self.send_buf=bytearray(SEND_SIZE_WRITE)
+        # Time from the last send to the first response bytes, None
+        # if nothing was received.
+        self.send_time=None
+        self.rtt=None
+        # Per command latency and error counts
+        self.stats=SerialStats(self.serial_cmds,self.baud_rate)
 
     def get_rw_str(self, cmd):
         """
@@ -531,36 +553,34 @@ class TC3625_Serial:
 
     def print_cmds(self):
         """ list all serial commands """
-        cmd_keys = self.serial_cmds.keys()
-        cmd_keys.sort()
+        cmd_keys = sorted(self.serial_cmds.keys())
         for cmd in cmd_keys:
-            print '%s %s'%(cmd,self.get_rw_str(cmd),)
+            print('%s %s'%(cmd,self.get_rw_str(cmd),))
             
     def print_help_all(self, rw=False):
         """ Displays a list of all serial commands."""
-        cmd_keys = self.serial_cmds.keys()
-        cmd_keys.sort()
+        cmd_keys = sorted(self.serial_cmds.keys())
         for cmd in cmd_keys:
             self.print_help(cmd)
-            print 
+            print()
 
     def print_help(self, cmd, rw=False):
         """print write/read values and description for a given command."""
-        print 'command: %s %s'%(cmd, self.get_rw_str(cmd),)
+        print('command: %s %s'%(cmd, self.get_rw_str(cmd),))
         if rw==True:
             self.print_rw(cmd)
-        print self.serial_cmds[cmd]['description']
+        print(self.serial_cmds[cmd]['description'])
 
     def print_rw(self,cmd):
         """print the read write charatcers for the given commands."""
-        print 'write: ', self.serial_cmds[cmd]['write']
-        print 'read: ', self.serial_cmds[cmd]['read']
+        print('write: ', self.serial_cmds[cmd]['write'])
+        print('read: ', self.serial_cmds[cmd]['read'])
         
     def open(self):
         """ Open serial port """
         self.serial = serial.Serial(
             self.port,
-            timeout = self.timeout,
+            timeout = self.interbyte_timeout,
             bytesize=serial.EIGHTBITS,
             baudrate=self.baud_rate,
             parity=serial.PARITY_NONE,
@@ -584,29 +604,9 @@ class TC3625_Serial:
         twos complement required for the send string is computed by
         this function. 
         """
-        if self.serial_cmds[cmd]['write']==None:
-            raise ValueError, 'write unsupported for command %s'%(cmd,)
-        # Create serial command
-        cc=self.serial_cmds[cmd]['write']
-        val = int(val)
-        val_2c = to_twoscomp(val)
-        cs=get_checksum(self.address+cc+val_2c)
-        cmd_list = [self.stx,self.address[0],self.address[1],cc[0],cc[1]]
-        for x in val_2c:
-            cmd_list.append(x)
-        cmd_list.extend([cs[0],cs[1],self.etx])
-        cmd = struct.pack('c'*SEND_SIZE_WRITE,*cmd_list)
+        self.codec.encode_write(self.send_buf,0,cmd,val)
         # Send serial command and read response
-        self.serial.write(cmd)
-        self.serial.flush()
-        ret = self.serial.read(RETURN_SIZE)
-        cs = get_checksum(ret[1:-3])
-        cs_ret = ret[-3:-1]
-        if cs != cs_ret:
-            raise IOError, 'return checksum %s does not match calculated %s'%(cs_ret,cs)
-        if ret[1:-3] == 'X'*8:
-            raise IOError, 'sent checksum incorrect'
-        return from_twoscomp(ret[1:-3])
+        return self.exchange(cmd,self.send_buf)
 
     def read(self, cmd):
         """ 
@@ -618,24 +618,149 @@ class TC3625_Serial:
         dev.print_help(cmd), or see the appropriate _DSCR_STR
         variable.
         """
-        if self.serial_cmds[cmd]['read']==None:
-            raise ValueError, 'read unsupported for command %s'%(cmd,)
-        # Create serial command
-        cc=self.serial_cmds[cmd]['read'] 
-        cs=get_checksum(self.address+cc)
-        cmd_tuple = (self.stx,self.address[0],self.address[1],cc[0],cc[1],cs[0],cs[1],self.etx)
-        cmd = struct.pack('c'*SEND_SIZE_READ,*cmd_tuple)
+        send_str = self.codec.read_frame(cmd)
         # Send serial command and read response
-        self.serial.write(cmd)
+        return self.exchange(cmd,send_str)
+
+    def transact(self, requests, depth=DFLT_PIPELINE_DEPTH):
+        """
+        Pipelined multi-command transaction. 
+
+        'requests' is a sequence of (cmd, val) pairs. A val of None
+        means read cmd, otherwise val is written to cmd as in
+        dev.write(cmd,val). The send strings for up to 'depth' requests
+        are written to the port in a single burst and the responses,
+        which the controller returns in order, are then demultiplexed.
+
+        Returns a list with one entry per request, in order. Each entry
+        is either the returned value or the IOError raised for that
+        request, e.g. on a checksum mismatch, so that errors are
+        reported per command and the caller can retry just those.
+        Invalid commands raise ValueError before anything is sent.
+        """
+        requests = list(requests)
+        send_buf = self.pack(requests)
+        depth = max(1,int(depth))
+        results = []
+        pos = 0
+        for i in range(0,len(requests),depth):
+            burst = requests[i:i+depth]
+            end = pos
+            for cmd, val in burst:
+                end += SEND_SIZE_READ if val is None else SEND_SIZE_WRITE
+            t_send = clock()
+            self.send(send_buf[pos:end])
+            burst_results = self.receive(len(burst))
+            # The time of the burst is shared by its commands
+            latency = (clock()-t_send)/len(burst)
+            for (cmd, val), ret in zip(burst,burst_results):
+                size = SEND_SIZE_READ if val is None else SEND_SIZE_WRITE
+                self.stats.record(cmd,size,ret,latency)
+            pos = end
+            results.extend(burst_results)
+        return results
+
+    def pack(self, requests):
+        """
+        Create the concatenated send strings for a sequence of (cmd,
+        val) pairs, val=None for a read.
+        """
+        size = 0
+        for cmd, val in requests:
+            size += SEND_SIZE_READ if val is None else SEND_SIZE_WRITE
+        buf = bytearray(size)
+        pos = 0
+        for cmd, val in requests:
+            if val is None:
+                buf[pos:pos+SEND_SIZE_READ] = self.codec.read_frame(cmd)
+                pos += SEND_SIZE_READ
+            else:
+                pos = self.codec.encode_write(buf,pos,cmd,val)
+        return buf
+
+    def send(self, send_str):
+        """
+        Discard any stale input, e.g. a late response to an earlier
+        command, and send the given send string(s).
+        """
+        try:
+            self.serial.reset_input_buffer()
+        except (IOError,OSError):
+            raise
+        except Exception as err:
+            # e.g. termios.error when a USB adapter is unplugged
+            raise serial.SerialException('reset input buffer failed: %s'%(err,))
+        self.parser.reset()
+        self.serial.write(send_str)
         self.serial.flush()
-        ret = self.serial.read(RETURN_SIZE)
-        cs = get_checksum(ret[1:-3])
-        cs_ret = ret[-3:-1]
-        if cs != cs_ret:
-            raise IOError, 'return checksum %s does not match calculated %s'%(cs_ret,cs)
-        if ret[1:-3] == 'X'*8:
-            raise IOError, 'sent checksum incorrect'
-        return from_twoscomp(ret[1:-3])
+        self.send_time = clock()
+        self.rtt = None
+
+    def receive(self, num):
+        """
+        Receive the responses to the last num commands sent. Returns a
+        list of num values or IOErrors.
+
+        Bytes are read until num frames have been parsed, until the
+        next frame does not start within timeout of the previous one
+        (or of the send), or until the line is idle for more than
+        interbyte_timeout in the middle of a frame. So a response which
+        lost bytes fails as soon as the line goes quiet rather than
+        after the full timeout, while a controller which pauses between
+        the responses to a pipelined burst is waited for. Times are
+        taken from the monotonic clock of tc3625_retry. The port is
+        opened with interbyte_timeout as its read timeout, as pyserial
+        does not honour inter_byte_timeout on all platforms.
+
+        If bytes had to be discarded and frames are missing, it is
+        unknown which command the received frames belong to and all num
+        commands fail.
+        """
+        parser = self.parser
+        discarded = parser.discarded
+        results = []
+        deadline = clock()+self.timeout
+        while len(results) < num:
+            ret = parser.next()
+            if ret is not None:
+                results.append(ret)
+                deadline = clock()+self.timeout
+                continue
+            size = RETURN_SIZE*(num-len(results))-parser.pending()
+            data = self.serial.read(size)
+            if len(data) > 0:
+                parser.feed(data)
+                if self.rtt is None:
+                    self.rtt = clock()-self.send_time
+            elif parser.pending() > 0 or clock() >= deadline:
+                # quiet in the middle of a frame, or no frame started
+                break
+        missing = num-len(results)
+        if missing == 0:
+            return results
+        if len(results) == 0 and parser.pending() == 0 and parser.discarded == discarded:
+            err = ResponseTimeout('no response within timeout %.3f s'%(self.timeout,))
+        else:
+            err = ResponseTimeout('incomplete response, %d of %d frames received'%(len(results),num))
+        if num > 1 and parser.discarded != discarded:
+            return [err]*num
+        return results+[err]*missing
+
+    def exchange(self, cmd, send_str):
+        """
+        Send the send string for a single command, receive the response
+        and return its value. The outcome is recorded in self.stats.
+        """
+        t_send = clock()
+        try:
+            self.send(send_str)
+            ret = self.receive(1)[0]
+        except (IOError,OSError) as err:
+            ret = err
+        self.stats.record(cmd,len(send_str),ret,clock()-t_send)
+        if isinstance(ret,(IOError,OSError)):
+            raise ret
+        return ret
 
     def close(self):
         """ Close serial port"""
@@ -649,8 +774,8 @@ def get_checksum(val):
     Calculate the checksum for given string
     """
     cs=0
-    for v in val:
-        cs+=ord(v)
+    for v in bytearray(val.encode('ascii') if isinstance(val,type(u'')) else val):
+        cs+=v
     cs_hex = '%x'%(cs,)
     return cs_hex[-2:]
     
@@ -674,7 +799,7 @@ def from_twoscomp(x):
     integer.
     """
     x2c = int(x,16)
-    if x2c >= (16**8)/2:
+    if x2c >= (16**8)//2:
         y = int(x2c-16**8)
     else:
         y = x2c
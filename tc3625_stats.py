@@ -0,0 +1,229 @@
+"""
+-----------------------------------------------------------------------
+tc3625
+
+Released under the LGPL Licence, Version 3
+
+This file is part of tc3625.
+
+tc3625 is free software: you can redistribute it and/or modify it
+under the terms of the GNU Lesser General Public License as published
+by the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+tc3625 is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public
+License along with tc3625.  If not, see
+<http://www.gnu.org/licenses/>.
+
+------------------------------------------------------------------------
+
+Purpose: per command latency and error statistics for the TC3625
+serial link.
+
+For every serial command the number of calls, a latency histogram,
+the number of failures of each class (checksum, nak, timeout, port) and
+the number of retries are counted. Recording a command is a few integer
+updates and a bisection into a fixed table of logarithmic bucket edges
+(10 per decade from 100 us to 10 s), so it can stay enabled. Percentiles
+are read from the histogram and are accurate to one bucket (about 26%).
+
+The link utilization is the time the 9600 baud line spends transmitting
+the send and return strings divided by the elapsed time, and the busy
+fraction the time spent waiting on commands divided by the elapsed
+time. As the controller only answers one command at a time a busy
+fraction close to one means the link is saturated.
+
+Classes:
+  LatencyHistogram
+  CommandStats
+  SerialStats
+
+Usage:
+
+  stats = dev.stats   # TC3625_Serial or TC3625
+  snap = stats.snapshot(reset=False)
+  snap['commands']['input1']['p95']
+  snap['link']['utilization']
+
+------------------------------------------------------------------------
+"""
+from __future__ import print_function
+import bisect
+import time
+
+from tc3625_codec import classify, RETURN_FRAME_SIZE
+
+ERROR_CLASSES=('checksum','nak','timeout','port')
+
+# Latency bucket upper edges (s), the last bucket counts everything
+# above LATENCY_EDGES[-1].
+LATENCY_EDGES=[1.0e-4*10**(i/10.0) for i in range(51)]
+
+# Bits on the wire per byte, 8N1
+BITS_PER_BYTE=10
+
+
+class LatencyHistogram:
+
+    """
+    Latency histogram with fixed logarithmic buckets.
+    """
+
+    def __init__(self):
+        self.counts=[0]*(len(LATENCY_EDGES)+1)
+        self.num=0
+        self.total=0.0
+        self.max=0.0
+
+    def add(self,t):
+        self.counts[bisect.bisect_left(LATENCY_EDGES,t)]+=1
+        self.num+=1
+        self.total+=t
+        if t > self.max:
+            self.max=t
+
+    def percentile(self,p):
+        """
+        Return the upper edge of the bucket holding the p-th percentile
+        (0-100), the maximum for the overflow bucket, or None if empty.
+        """
+        if self.num == 0:
+            return None
+        rank=p/100.0*self.num
+        cnt=0
+        for i, n in enumerate(self.counts):
+            cnt+=n
+            if cnt >= rank and n > 0:
+                if i < len(LATENCY_EDGES):
+                    return min(LATENCY_EDGES[i],self.max)
+                return self.max
+        return self.max
+
+    def mean(self):
+        if self.num == 0:
+            return None
+        return self.total/self.num
+
+
+class CommandStats:
+
+    """
+    Counters for one serial command.
+    """
+
+    def __init__(self):
+        self.count=0
+        self.errors=dict([(k,0) for k in ERROR_CLASSES])
+        self.retries=0
+        self.latency=LatencyHistogram()
+
+    def as_dict(self):
+        return {
+            'count':self.count,
+            'errors':dict(self.errors),
+            'timeouts':self.errors['timeout'],
+            'checksum failures':self.errors['checksum'],
+            'retries':self.retries,
+            'p50':self.latency.percentile(50),
+            'p95':self.latency.percentile(95),
+            'p99':self.latency.percentile(99),
+            'mean':self.latency.mean(),
+            'max':self.latency.max,
+            }
+
+
+class SerialStats:
+
+    """
+    Per command statistics for one serial link, see module
+    documentation.
+    """
+
+    def __init__(self,serial_cmds,baud_rate=9600):
+        self.serial_cmds=serial_cmds
+        self.baud_rate=baud_rate
+        self.reset()
+
+    def reset(self):
+        """ Zero all counters """
+        self.commands=dict([(cmd,CommandStats()) for cmd in self.serial_cmds])
+        self.start=time.time()
+        self.wire_bytes=0
+        self.busy=0.0
+
+    def record(self,cmd,send_size,ret,latency):
+        """
+        Record a command: the size of its send string, the returned
+        value or exception and the time it took (successful commands
+        only go into the latency histogram).
+        """
+        stats=self.commands[cmd]
+        stats.count+=1
+        self.wire_bytes+=send_size
+        self.busy+=latency
+        if isinstance(ret,(IOError,OSError)):
+            stats.errors[classify(ret)]+=1
+        else:
+            self.wire_bytes+=RETURN_FRAME_SIZE
+            stats.latency.add(latency)
+
+    def retried(self,cmd,num):
+        """ Record num retries of cmd """
+        if num > 0:
+            self.commands[cmd].retries+=num
+
+    def snapshot(self,reset=False):
+        """
+        Return the statistics as a dictionary:
+
+          'commands': per command dictionaries with count, errors (by
+                      class), timeouts, checksum failures, retries, and
+                      latency p50, p95, p99, mean, max in seconds
+          'link':     elapsed time, wire bytes, utilization and busy
+                      fraction since the last reset
+          'total':    totals over all commands
+
+        If reset is True the counters are zeroed afterwards.
+        """
+        elapsed=time.time()-self.start
+        commands={}
+        total={'count':0,'retries':0,'errors':dict([(k,0) for k in ERROR_CLASSES])}
+        for cmd, stats in self.commands.items():
+            commands[cmd]=stats.as_dict()
+            total['count']+=stats.count
+            total['retries']+=stats.retries
+            for k in ERROR_CLASSES:
+                total['errors'][k]+=stats.errors[k]
+        wire_time=float(BITS_PER_BYTE*self.wire_bytes)/self.baud_rate
+        link={
+            'elapsed':elapsed,
+            'wire bytes':self.wire_bytes,
+            'wire time':wire_time,
+            'utilization':wire_time/elapsed if elapsed > 0 else 0.0,
+            'busy':self.busy/elapsed if elapsed > 0 else 0.0,
+            }
+        if reset:
+            self.reset()
+        return {'commands':commands,'link':link,'total':total}
+
+    def print_snapshot(self,reset=False):
+        """ Print the statistics of all commands used """
+        snap=self.snapshot(reset)
+        ms=lambda t: '-' if t is None else '%.1f'%(1e3*t,)
+        print('%-40s %7s %7s %7s %7s %5s %5s %5s %5s'%(
+            'command','count','p50 ms','p95 ms','p99 ms','csum','nak','tout','retry'))
+        for cmd in sorted(snap['commands']):
+            s=snap['commands'][cmd]
+            if s['count'] == 0:
+                continue
+            print('%-40s %7d %7s %7s %7s %5d %5d %5d %5d'%(
+                cmd,s['count'],ms(s['p50']),ms(s['p95']),ms(s['p99']),
+                s['errors']['checksum'],s['errors']['nak'],s['errors']['timeout'],s['retries']))
+        link=snap['link']
+        print('link: %.1f s, utilization %.1f%%, busy %.1f%%'%(
+            link['elapsed'],100*link['utilization'],100*link['busy']))
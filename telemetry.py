@@ -0,0 +1,144 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from array import array
+
+# Columns of a TelemetryBuffer, in row order
+COLUMNS = ('time', 'temperature', 'setpoint', 'power', 'current')
+# One day at one sample per second
+DFLT_CAPACITY = 86400
+
+# Marks a missing value, eg the set point before one has been set. Plots leave a gap for it.
+MISSING = float('nan')
+
+def isMissing(value):
+    return value != value
+
+
+# Fixed capacity columnar ring buffer of telemetry samples. Each column is an array of doubles allocated up front, so
+# appending is O(1) and the memory use does not change however long a run is; once full, the oldest rows are
+# overwritten.
+#
+# There is one writer (append) and any number of readers, which take no lock. The writer fills in a row and only then
+# increments count, so a reader never sees a half written row. Views are not copied: a View stays valid until the
+# writer has wrapped around onto it, which View.valid() checks. The ring has one row more than the capacity, so the row
+# being written is never part of a view. snapshot() copies the rows it returns and retries if the writer overtook it
+# while copying.
+#   capacity - number of rows kept
+#   columns - column names
+class TelemetryBuffer:
+    def __init__(self, capacity=DFLT_CAPACITY, columns=COLUMNS):
+        self.capacity = capacity
+        self.size = capacity + 1
+        self.columns = tuple(columns)
+        self.data = dict([(col, array('d', [MISSING]) * self.size) for col in self.columns])
+        self.arrays = [self.data[col] for col in self.columns]
+        # total number of rows ever appended
+        self.count = 0
+        self.subscribers = []
+
+    # callback(row) is called by the writer with the tuple of values of every row appended, eg RunLog.write
+    def subscribe(self, callback):
+        self.subscribers = self.subscribers + [callback]
+
+    def unsubscribe(self, callback):
+        self.subscribers = [cb for cb in self.subscribers if cb != callback]
+
+    # append a row, values in column order (missing trailing values are MISSING)
+    def append(self, *values):
+        i = self.count % self.size
+        for arr, value in zip(self.arrays, values):
+            arr[i] = value
+        for arr in self.arrays[len(values):]:
+            arr[i] = MISSING
+        self.count += 1
+        if self.subscribers:
+            row = tuple([arr[i] for arr in self.arrays])
+            for callback in self.subscribers:
+                callback(row)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # most recent value of column, or None if empty
+    def latest(self, column):
+        count = self.count
+        if count == 0:
+            return None
+        return self.data[column][(count - 1) % self.size]
+
+    # zero copy View of the last n rows (all rows kept if None) of column
+    def window(self, column, n=None):
+        count = self.count
+        size = min(count, self.capacity)
+        if n is None or n > size:
+            n = size
+        return View(self, self.data[column], count - n, n)
+
+    # dictionary of column: list of the last n rows (all rows kept if None), copied consistently
+    def snapshot(self, columns=None, n=None):
+        if columns is None:
+            columns = self.columns
+        while True:
+            views = [self.window(col, n) for col in columns]
+            rows = [view.tolist() for view in views]
+            if all(view.valid() for view in views):
+                return dict(zip(columns, rows))
+
+
+# Window onto rows [start, start+n) of one column of a TelemetryBuffer, start counting from the first row ever
+# appended. Indexing and iteration read the ring directly.
+class View:
+    def __init__(self, buffer, data, start, n):
+        self.buffer = buffer
+        self.data = data
+        self.start = start
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    # True if none of the rows have been overwritten since the view was made
+    def valid(self):
+        return self.buffer.count - self.start <= self.buffer.capacity
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if i < 0 or i >= self.n:
+            raise IndexError('telemetry view index out of range')
+        return self.data[(self.start + i) % self.buffer.size]
+
+    def __iter__(self):
+        for arr, lo, hi in self.segments():
+            for i in range(lo, hi):
+                yield arr[i]
+
+    # the view as at most two (array, lo, hi) slices of the underlying ring, oldest first
+    def segments(self):
+        size = self.buffer.size
+        lo = self.start % size
+        if lo + self.n <= size:
+            return [(self.data, lo, lo + self.n)]
+        return [(self.data, lo, size), (self.data, 0, lo + self.n - size)]
+
+    def tolist(self):
+        values = []
+        for arr, lo, hi in self.segments():
+            values.extend(arr[lo:hi])
+        return values
+
+    # the view as a NumPy array (a copy, as the ring may wrap)
+    def asarray(self):
+        import numpy
+        parts = [numpy.frombuffer(arr, dtype=numpy.float64)[lo:hi] for arr, lo, hi in self.segments()]
+        return numpy.concatenate(parts) if len(parts) > 1 else parts[0].copy()
@@ -0,0 +1,257 @@
+"""
+Tests for the TC3625 interface against the TC3625_Emulator (Linux only).
+
+The get_*/set_* methods are generated once per class (see add_methods
+in tc3625.py); MultipleControllersTest checks, with several controllers
+open at the same time, that each instance's methods talk to its own
+port and that its register cache is its own. The other tests cover the
+return string parser, the circuit breaker of the retry policy and
+journal record and replay.
+
+Usage:
+
+  python -m pytest -q test_tc3625.py
+  python -m unittest test_tc3625
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import serial
+
+from tc3625 import TC3625
+from tc3625_codec import FrameParser, ChecksumError, get_codec, RETURN_FRAME_SIZE
+from tc3625_emulator import TC3625_Emulator
+from tc3625_journal import RecordingTransport, ReplayTransport, ReplayMismatch
+from tc3625_retry import RetryPolicy, CircuitOpenError
+from tc3625_serial import TC3625_Serial, SERIAL_CMDS, ADDRESS
+
+NUM_DEVICES = 3
+
+
+class MultipleControllersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emus = []
+        self.devs = []
+        for i in range(NUM_DEVICES):
+            emu = TC3625_Emulator(seed=i)
+            emu.start()
+            self.emus.append(emu)
+            self.devs.append(TC3625(port=emu.port))
+
+    def tearDown(self):
+        for dev in self.devs:
+            dev.close()
+        for emu in self.emus:
+            emu.stop()
+
+    def test_methods_bound_per_instance(self):
+        for dev in self.devs:
+            self.assertTrue(dev.get_setpt.__self__ is dev)
+            self.assertTrue(dev.set_setpt.__self__ is dev)
+        # generated once, on the class
+        self.assertFalse('get_setpt' in self.devs[0].__dict__)
+        self.assertTrue(self.devs[0].get_setpt.__func__ is self.devs[1].get_setpt.__func__)
+
+    def test_setpoints_independent(self):
+        for i, dev in enumerate(self.devs):
+            dev.set_setpt(30.0+10*i)
+        for i, dev in enumerate(self.devs):
+            self.assertEqual(dev.get_setpt(), 30.0+10*i)
+        # each write reached its own emulator only
+        setpts = [emu.registers['fixed desired control setting'] for emu in self.emus]
+        self.assertEqual(len(set(setpts)), NUM_DEVICES)
+
+    def test_caches_independent(self):
+        caches = [dev.cache for dev in self.devs]
+        for i in range(NUM_DEVICES):
+            for j in range(i+1, NUM_DEVICES):
+                self.assertFalse(caches[i] is caches[j])
+        before = [dict(dev.cache) for dev in self.devs[1:]]
+        self.devs[0].set_setpt(42.0)
+        self.assertEqual(self.devs[0].cache['fixed desired control setting'], 4200)
+        self.assertEqual([dict(dev.cache) for dev in self.devs[1:]], before)
+        # an unchanged value is not written again, on that device only
+        num_requests = [emu.num_requests for emu in self.emus]
+        self.assertFalse(self.devs[0].set_if_changed('setpt', 42.0))
+        self.assertTrue(self.devs[1].set_if_changed('setpt', 42.0))
+        self.assertEqual(self.emus[0].num_requests, num_requests[0])
+        self.assertTrue(self.emus[1].num_requests > num_requests[1])
+
+    def test_concurrent_polling(self):
+        for i, dev in enumerate(self.devs):
+            dev.set_setpt(25.0+i)
+        errors = []
+
+        def poll(i, dev):
+            try:
+                for k in range(20):
+                    if dev.get_setpt() != 25.0+i:
+                        errors.append((i, 'wrong set point'))
+                    dev.get_input1()
+            except Exception as err:
+                errors.append((i, err))
+
+        threads = [threading.Thread(target=poll, args=(i, dev)) for i, dev in enumerate(self.devs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+
+class FrameParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.codec = get_codec(SERIAL_CMDS, ADDRESS)
+        self.parser = FrameParser(self.codec)
+        # a return string as sent by the emulator, 25.00 C = 2500
+        with TC3625_Emulator() as emu:
+            emu.registers['fixed desired control setting'] = 2500
+            port = serial.Serial(emu.port, timeout=1.0)
+            try:
+                port.write(self.codec.read_frame('fixed desired control setting'))
+                self.frame = bytearray(port.read(RETURN_FRAME_SIZE))
+            finally:
+                port.close()
+        self.assertEqual(len(self.frame), RETURN_FRAME_SIZE)
+
+    def test_frame(self):
+        self.parser.feed(self.frame[:5])
+        self.assertEqual(self.parser.next(), None)
+        self.parser.feed(self.frame[5:])
+        self.assertEqual(self.parser.next(), 2500)
+        self.assertEqual(self.parser.pending(), 0)
+        self.assertEqual(self.parser.discarded, 0)
+
+    def test_resync_on_garbage(self):
+        garbage = bytearray(b'\x00garbage\xff^^')
+        self.parser.feed(garbage + self.frame + garbage + self.frame)
+        self.assertEqual(self.parser.next(), 2500)
+        self.assertEqual(self.parser.next(), 2500)
+        self.assertEqual(self.parser.next(), None)
+        self.assertEqual(self.parser.discarded, 2*len(garbage))
+
+    def test_resync_on_truncated_frame(self):
+        # a dropped byte costs only the frame it hit
+        truncated = self.frame[:4] + self.frame[5:]
+        self.parser.feed(truncated + self.frame)
+        self.assertEqual(self.parser.next(), 2500)
+        self.assertEqual(self.parser.next(), None)
+        self.assertEqual(self.parser.discarded, len(truncated))
+
+    def test_corrupted_frame(self):
+        corrupted = bytearray(self.frame)
+        corrupted[3] ^= 0x01
+        self.parser.feed(corrupted + self.frame)
+        self.assertTrue(isinstance(self.parser.next(), ChecksumError))
+        self.assertEqual(self.parser.next(), 2500)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.emu = TC3625_Emulator(seed=0)
+        self.emu.start()
+        self.policy = RetryPolicy(max_attempt=2, max_timeout=0.1, breaker_threshold=2, breaker_reset=0.3)
+        self.dev = TC3625(port=self.emu.port, retry_policy=self.policy)
+
+    def tearDown(self):
+        self.dev.close()
+        self.emu.stop()
+
+    def trip(self):
+        # every byte of every response lost
+        self.emu.drop_rate = 1.0
+        for i in range(self.policy.breaker_threshold):
+            self.assertRaises(IOError, self.dev.get_setpt)
+        self.assertTrue(self.policy.is_open())
+
+    def test_trip(self):
+        self.trip()
+        num_requests = self.emu.num_requests
+        self.assertRaises(CircuitOpenError, self.dev.get_setpt)
+        # rejected without reaching the controller
+        self.assertEqual(self.emu.num_requests, num_requests)
+        metrics = self.policy.metrics()
+        self.assertEqual(metrics['breaker trips'], 1)
+        self.assertEqual(metrics['rejected ops'], 1)
+
+    def test_reset(self):
+        self.trip()
+        self.emu.drop_rate = 0.0
+        time.sleep(self.policy.breaker_reset)
+        self.dev.set_setpt(30.0)
+        self.assertFalse(self.policy.is_open())
+        self.assertEqual(self.dev.get_setpt(), 30.0)
+
+    def test_failed_trial(self):
+        self.trip()
+        time.sleep(self.policy.breaker_reset)
+        # a single failed trial opens the breaker again
+        self.assertRaises(IOError, self.dev.get_setpt)
+        self.assertTrue(self.policy.is_open())
+        self.assertEqual(self.policy.metrics()['breaker trips'], 2)
+
+    def test_one_trial(self):
+        self.trip()
+        time.sleep(self.policy.breaker_reset)
+        op = self.policy.begin()
+        self.assertTrue(op.trial)
+        self.assertRaises(CircuitOpenError, self.policy.begin)
+        self.policy.success(op)
+        self.assertFalse(self.policy.is_open())
+        self.assertFalse(self.policy.begin().trial)
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.tcj')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def session(self, dev):
+        vals = []
+        for setpt in (30.0, 45.5, -2.0):
+            dev.set_setpt(setpt)
+            vals.append(dev.get_setpt())
+            vals.append(dev.get_input1())
+        vals.append(dev.get_all())
+        return vals
+
+    def record(self):
+        with TC3625_Emulator(seed=0) as emu:
+            rec = RecordingTransport(TC3625_Serial(emu.port), self.path)
+            dev = TC3625(port=emu.port, transport=rec)
+            try:
+                return self.session(dev)
+            finally:
+                dev.close()
+
+    def test_replay_equal(self):
+        recorded = self.record()
+        replay = ReplayTransport(self.path)
+        replayed = self.session(TC3625(transport=replay))
+        self.assertEqual(replayed, recorded)
+        self.assertTrue(replay.at_end())
+        self.assertEqual(replay.num_skipped, 0)
+
+    def test_strict_mismatch(self):
+        self.record()
+        dev = TC3625(transport=ReplayTransport(self.path))
+        # the first set point written was 30.0
+        self.assertRaises(ReplayMismatch, dev.set_setpt, 31.0)
+        dev = TC3625(transport=ReplayTransport(self.path))
+        self.assertRaises(ReplayMismatch, dev.get_setpt)
+
+
+if __name__ == '__main__':
+    unittest.main()
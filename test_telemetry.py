@@ -0,0 +1,195 @@
+"""
+Tests for the telemetry buffer and the run log and run archive written
+from it.
+
+Usage:
+
+  python -m pytest -q test_telemetry.py
+  python -m unittest test_telemetry
+"""
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+
+from telemetry import TelemetryBuffer, COLUMNS, MISSING, isMissing
+from runlog import RunLog, HEADER, MISSING_TEXT
+from runarchive import ArchiveWriter, RunArchive, INDEX_STRIDE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def sample(i):
+    """ Row i of a made up run, one sample per second """
+    return (float(i), 25.0+0.01*i, 95.0, 50.0, 1.5)
+
+
+class TelemetryBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buf = TelemetryBuffer(capacity=10)
+
+    def test_empty(self):
+        self.assertEqual(len(self.buf), 0)
+        self.assertEqual(self.buf.latest('time'), None)
+        self.assertEqual(self.buf.window('time').tolist(), [])
+
+    def test_missing_values(self):
+        self.buf.append(1.0, 25.0)
+        self.assertEqual(self.buf.latest('temperature'), 25.0)
+        self.assertTrue(isMissing(self.buf.latest('setpoint')))
+        self.assertTrue(isMissing(MISSING))
+
+    def test_wrap(self):
+        for i in range(25):
+            self.buf.append(*sample(i))
+        self.assertEqual(len(self.buf), 10)
+        self.assertEqual(self.buf.count, 25)
+        self.assertEqual(self.buf.latest('time'), 24.0)
+        # only the last capacity rows are kept, oldest first
+        times = self.buf.window('time')
+        self.assertEqual(times.tolist(), [float(i) for i in range(15, 25)])
+        self.assertEqual(list(times), times.tolist())
+        self.assertEqual(times[0], 15.0)
+        self.assertEqual(times[-1], 24.0)
+        self.assertEqual(times[2:4], [17.0, 18.0])
+        self.assertEqual(len(times.segments()), 2)
+        self.assertEqual(self.buf.window('time', 3).tolist(), [22.0, 23.0, 24.0])
+        snapshot = self.buf.snapshot(('time', 'temperature'), n=2)
+        self.assertEqual(snapshot['time'], [23.0, 24.0])
+        self.assertEqual(snapshot['temperature'], [sample(23)[1], sample(24)[1]])
+
+    def test_view_overwritten(self):
+        for i in range(10):
+            self.buf.append(*sample(i))
+        view = self.buf.window('time')
+        self.assertTrue(view.valid())
+        self.buf.append(*sample(10))
+        self.assertFalse(view.valid())
+
+    @unittest.skipIf(numpy is None, 'needs NumPy')
+    def test_asarray(self):
+        for i in range(25):
+            self.buf.append(*sample(i))
+        self.assertEqual(self.buf.window('time').asarray().tolist(), [float(i) for i in range(15, 25)])
+
+    def test_subscribers(self):
+        rows = []
+        self.buf.subscribe(rows.append)
+        self.buf.append(*sample(0))
+        self.buf.unsubscribe(rows.append)
+        self.buf.append(*sample(1))
+        self.assertEqual(rows, [sample(0)])
+
+
+class RunLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'logs', 'run.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        with open(self.path) as f:
+            return [line.rstrip('\n').split(',') for line in f]
+
+    def test_round_trip(self):
+        buf = TelemetryBuffer(capacity=10)
+        log = RunLog(self.path, flushRows=7, fsync='never')
+        buf.subscribe(log.write)
+        for i in range(25):
+            buf.append(*sample(i))
+        buf.append(25.0, 25.0)
+        log.close()
+        lines = self.read()
+        self.assertEqual(lines[0], HEADER)
+        # every row, not only those still in the buffer
+        self.assertEqual(len(lines), 1+26)
+        for i, line in enumerate(lines[1:26]):
+            self.assertEqual(tuple([float(v) for v in line]), sample(i))
+        self.assertEqual(lines[-1][2:], [MISSING_TEXT]*3)
+        self.assertEqual(log.numRows, 26)
+
+    def test_append_after_partial_row(self):
+        log = RunLog(self.path, fsync='never')
+        log.write(sample(0))
+        log.close()
+        # a row cut short, eg by a power cut
+        with open(self.path, 'ab') as f:
+            f.write(b'1.0,25.0')
+        log = RunLog(self.path, fsync='never')
+        log.write(sample(1))
+        log.close()
+        lines = self.read()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(tuple([float(v) for v in lines[2]]), sample(1))
+
+
+@unittest.skipIf(numpy is None, 'needs NumPy')
+class RunArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = os.path.join(tempfile.mkdtemp(), 'run')
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.dir))
+
+    def write(self, num_rows, step_every):
+        writer = ArchiveWriter(self.dir)
+        for i in range(num_rows):
+            if i % step_every == 0:
+                writer.markStep(95.0 if i//step_every % 2 == 0 else 60.0, (i//(2*step_every),))
+            writer.append(sample(i))
+        writer.close()
+
+    def test_round_trip(self):
+        num_rows = 3*INDEX_STRIDE+10
+        self.write(num_rows, 100)
+        archive = RunArchive(self.dir)
+        self.assertEqual(len(archive), num_rows)
+        self.assertEqual(archive.columns, list(COLUMNS))
+        rows = archive.slice(0, num_rows)
+        for i in (0, INDEX_STRIDE, num_rows-1):
+            self.assertEqual(tuple([float(rows[col][i]) for col in COLUMNS]), sample(i))
+
+    def test_time_range(self):
+        self.write(3*INDEX_STRIDE+10, 100)
+        archive = RunArchive(self.dir)
+        self.assertEqual(archive.rowAt(300.0), 300)
+        self.assertEqual(archive.rowAt(299.5), 300)
+        times = archive.timeRange(250.0, 260.0, ['time'])['time']
+        self.assertEqual(times.tolist(), [float(i) for i in range(250, 260)])
+
+    def test_steps(self):
+        self.write(450, 100)
+        archive = RunArchive(self.dir)
+        self.assertEqual(len(archive.steps), 5)
+        self.assertEqual(archive.stepRows(1), (100, 200))
+        self.assertEqual(archive.stepRows(4), (400, 450))
+        self.assertEqual(archive.steps['setpoint'].tolist(), [95.0, 60.0, 95.0, 60.0, 95.0])
+        self.assertEqual(archive.stepsIn((1,)), [2, 3])
+        self.assertEqual(archive.iteration((1,), ['time'])['time'][0], 200.0)
+        self.assertEqual(archive.iteration((7,)), None)
+
+    def test_reopen_trims_partial_row(self):
+        self.write(10, 100)
+        # a row written to some columns only
+        with open(os.path.join(self.dir, 'time.f64'), 'ab') as f:
+            f.write(b'\0'*8)
+        self.assertEqual(len(RunArchive(self.dir)), 10)
+        writer = ArchiveWriter(self.dir)
+        writer.append(sample(10))
+        writer.close()
+        archive = RunArchive(self.dir)
+        self.assertEqual(len(archive), 11)
+        self.assertEqual(float(archive.data['time'][10]), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#MIT License
+#
+#Copyright (c) 2018 Jonathan A. White
+#
+#Permission is hereby granted, free of charge, to any person obtaining a copy of this software and associated documentation files (the "Software"), to deal in the Software without restriction, including without limitation the rights to use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of the Software, and to permit persons to whom the Software is furnished to do so, subject to the following conditions:
+#
+#The above copyright notice and this permission notice shall be included in all copies or substantial portions of the Software.
+#
+#THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import time
+from threading import Lock
+from collections import OrderedDict
+
+from tc3625_stats import LatencyHistogram
+
+# Updates are applied this many times a second
+DFLT_RATE = 20.0
+# A drain running this many seconds late is reported as a stall of the Tk event loop
+STALL_THRESHOLD = 0.25
+
+
+# Tk widgets may only be used from the thread running the mainloop. Protocol threads post widget changes (step
+# colors, elapsed time, loop iteration) to the UIBus instead, and the Tk thread applies them with after() at display
+# rate. Only the latest options posted for each widget are kept, so a thread can post as often as it likes and the
+# Tk thread does at most one call per widget per drain.
+#
+# Running timers (see startTimer) are also shown from the Tk thread, so the protocol thread does not have to wake up to
+# update them. The bus also measures how late each drain runs compared to when it was scheduled, which is how long the
+# Tk event loop was blocked.
+class UIBus:
+    def __init__(self, rate=DFLT_RATE):
+        self.interval = int(1000 / rate)
+        self.lock = Lock()
+        # key: [function, args, options], in the order they were last posted
+        self.pending = OrderedDict()
+        # widget: [start time, text prefix, seconds shown]
+        self.timers = {}
+        self.master = None
+        self.afterId = None
+        self.due = None
+        self.lag = LatencyHistogram()
+        self.lastLag = 0.0
+        self.numStalls = 0
+        self.numPosted = 0
+        self.numApplied = 0
+
+    # start draining on the Tk thread of master. Until then updates are applied as they are posted.
+    def start(self, master):
+        self.master = master
+        self.due = time.time() + self.interval / 1000.0
+        self.afterId = master.after(self.interval, self.tick)
+
+    def stop(self):
+        if self.afterId is not None:
+            self.master.after_cancel(self.afterId)
+        self.master = None
+        self.afterId = None
+        self.drain()
+
+    # widget.method(**options) on the Tk thread, eg post(label, text = "Iteration: 3") or post(label, 'grid_forget').
+    # Options posted for the same widget and method before the next drain are merged, later values win.
+    def post(self, widget, method = 'config', **options):
+        self.call((widget, method), getattr(widget, method), **options)
+
+    # func(*args, **options) on the Tk thread. Replaces (merging options) anything pending under the same key, which
+    # is then applied after everything posted before it.
+    def call(self, key, func, *args, **options):
+        with self.lock:
+            self.numPosted += 1
+            entry = self.pending.pop(key, None)
+            if entry is not None:
+                entry[2].update(options)
+                options = entry[2]
+            self.pending[key] = [func, args, options]
+        if self.master is None:
+            self.drain()
+
+    # show prefix followed by the whole seconds since start (a time.time()) in widget until stopTimer
+    def startTimer(self, widget, start, prefix = ""):
+        with self.lock:
+            self.timers[widget] = [start, prefix, None]
+        if self.master is None:
+            self.showTimers()
+
+    def stopTimer(self, widget):
+        with self.lock:
+            self.timers.pop(widget, None)
+
+    # updates the text of the timers whose seconds changed. Called before the drain, so text posted after stopTimer
+    # is shown last.
+    def showTimers(self):
+        now = time.time()
+        with self.lock:
+            timers = list(self.timers.items())
+        for widget, timer in timers:
+            seconds = int(now - timer[0])
+            if seconds != timer[2]:
+                timer[2] = seconds
+                try:
+                    widget.config(text = timer[1] + str(seconds))
+                except Exception as E:
+                    print("UI update failed: " + str(E))
+
+    def tick(self):
+        now = time.time()
+        self.lastLag = max(now - self.due, 0.0)
+        self.lag.add(self.lastLag)
+        if self.lastLag > STALL_THRESHOLD:
+            self.numStalls += 1
+            print("GUI stalled for %.2f s" % (self.lastLag,))
+        try:
+            self.showTimers()
+            self.drain()
+        finally:
+            self.due = time.time() + self.interval / 1000.0
+            self.afterId = self.master.after(self.interval, self.tick)
+
+    def drain(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = OrderedDict()
+        for func, args, options in pending.values():
+            try:
+                func(*args, **options)
+            except Exception as E:
+                # eg the widget was destroyed after the update was posted
+                print("UI update failed: " + str(E))
+        self.numApplied += len(pending)
+
+    # lag of the Tk event loop in seconds: last, median, 99th percentile and maximum, and the number of stalls
+    def lagStats(self):
+        return {
+            'last': self.lastLag,
+            'p50': self.lag.percentile(50),
+            'p99': self.lag.percentile(99),
+            'max': self.lag.max,
+            'stalls': self.numStalls,
+        }
+
+
+# The bus shared by the steps and loops of all protocols, started by usbGUI
+bus = UIBus()